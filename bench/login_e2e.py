@@ -0,0 +1,402 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 各渠道账号的端到端登录耗时测试。
+# 渠道SDK、mgbsdk的uni_sauth和mpay的qrcode/scan、confirm_login都由本地的替身服务应答（单独进程，HTTP和HTTPS各一个端口），
+# 通过代理的DNS劫持把这些域名指向替身，httpclient用本次生成的CA校验证书。浏览器登录步骤替换为直接注入OAuth结果。
+# 每轮对每个渠道先做一次冷登录（新的账号对象，从OAuth开始），再用同一个对象做一次热登录（使用缓存的凭证），
+# 按httpclient请求的域名把耗时归到各阶段，剩余部分记为local（本地的SAUTH组装、加解密、保存账号等）。
+#
+# 用法: python bench/login_e2e.py --rounds 20 --output login.json [--baseline old.json --max-regression 0.2]
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets")
+GAME_ID = "aecfrt3rmaaaaajl-g-h55"
+
+# 替身服务应答的域名：(域名, 是否HTTPS)
+STANDIN_HOSTS = [
+    ("who.nie.netease.com", True),
+    ("account.migc.g.mi.com", False),
+    ("oauth-login.cloud.huawei.com", True),
+    ("jgw-drcn.jos.dbankcloud.cn", True),
+    ("joint.vivo.com.cn", True),
+    ("ysdk.qq.com", True),
+    ("api.weixin.qq.com", True),
+    ("mgbsdk.matrix.netease.com", True),
+    ("service.mkey.163.com", True),
+]
+
+# 按请求地址划分阶段，先匹配的优先
+STAGES = [
+    ("ip_lookup", "who.nie.netease.com", ""),
+    ("oauth", "account.migc.g.mi.com", "/misdk/v2/oauth"),
+    ("oauth", "oauth-login.cloud.huawei.com", ""),
+    ("oauth", "joint.vivo.com.cn", "/h5/union/get"),
+    ("oauth", "ysdk.qq.com", "/auth/wx_verify_code"),
+    ("oauth", "api.weixin.qq.com", "/sns/userinfo"),
+    ("channel_session", "", ""),
+    ("uni_sauth", "mgbsdk.matrix.netease.com", ""),
+    ("qrcode_scan", "service.mkey.163.com", "/mpay/api/qrcode/scan"),
+    ("confirm_login", "service.mkey.163.com", "/mpay/api/qrcode/confirm_login"),
+]
+STAGE_NAMES = ["ip_lookup", "oauth", "channel_session", "uni_sauth", "qrcode_scan", "confirm_login", "local", "total"]
+
+CHANNELS = {
+    "xiaomi": {"login_info": {"login_channel": "xiaomi_app", "code": "bench-mi"}, "game_id": GAME_ID},
+    "huawei": {"login_info": {"login_channel": "huawei", "code": "bench-hw"}, "game_id": GAME_ID},
+    "vivo": {"login_info": {"login_channel": "nearme_vivo", "code": "bench-vivo"}, "game_id": GAME_ID},
+    "wechat": {"login_info": {"login_channel": "myapp", "code": "bench-wx"}, "game_id": GAME_ID, "uuid": "wx-bench"},
+    "scan": {
+        "login_info": {"login_channel": "netease", "code": "bench-scan"},
+        "user_info": {"id": "bench-scan-user", "token": "token"},
+        "ext_info": {
+            "src_app_channel2": "netease",
+            "src_udid": "0123456789abcdef",
+            "src_app_channel": "netease",
+            "src_jf_game_id": "h55",
+            "src_pay_channel": "netease",
+            "extra_unisdk_data": "",
+        },
+    },
+}
+
+
+def standin_app(latency: float):
+    """替身服务。所有域名共用一个WSGI应用，按Host区分"""
+    import gevent
+
+    from channelHandler.miLogin.consts import AES_KEY
+    from channelHandler.miLogin.utils import aes_encrypt
+
+    def reply(start_response, body):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(data)))])
+        return [data]
+
+    def app(environ, start_response):
+        gevent.sleep(latency)
+        host = environ.get("HTTP_HOST", "").split(":")[0]
+        path = environ["PATH_INFO"]
+        environ["wsgi.input"].read()
+        now = int(time.time())
+        if host == "who.nie.netease.com":
+            return reply(start_response, {"ip": "10.0.0.1"})
+        if host == "account.migc.g.mi.com":
+            if path == "/misdk/v2/oauth":
+                return reply(start_response, aes_encrypt(json.dumps({"code": 0, "uuid": "1000001", "st": "bench-st"}), AES_KEY))
+            return reply(start_response, aes_encrypt(json.dumps({"retCode": 200, "appAccountId": 2000001, "session": "bench-session"}), AES_KEY))
+        if host == "oauth-login.cloud.huawei.com":
+            return reply(start_response, {"access_token": "bench-at", "refresh_token": "bench-rt", "expires_in": 3600})
+        if host == "jgw-drcn.jos.dbankcloud.cn":
+            return reply(
+                start_response,
+                {"playerLevel": 1, "openId": "bench-open", "openIdSign": "s", "gameAuthSign": "bench-sign", "playerId": "3000001", "ts": str(now * 1000)},
+            )
+        if host == "joint.vivo.com.cn":
+            if path == "/h5/union/get":
+                account = {"nickName": "bench", "subOpenId": "bench-sub", "createTime": now, "lastLogin": True}
+                return reply(start_response, {"code": 0, "data": {"openId": "bench-open", "phone": "138****0000", "subAccounts": [account]}})
+            return reply(start_response, {"code": 0, "data": "bench-open-token"})
+        if host == "ysdk.qq.com":
+            return reply(
+                start_response,
+                {"ret": 0, "msg": "", "atk": "bench-atk", "atk_expire": 7200, "openid": "bench-openid", "pf": "desktop_m_wechat", "pfKey": "k", "rtk": "bench-rtk"},
+            )
+        if host == "api.weixin.qq.com":
+            if path == "/sns/userinfo":
+                return reply(start_response, {"nickname": "bench"})
+            return reply(start_response, {"errcode": 0, "errmsg": "ok"})
+        if host == "mgbsdk.matrix.netease.com":
+            login_json = base64.b64encode(json.dumps({"username": "bench@ad.netease.win.163.com"}).encode()).decode()
+            return reply(start_response, {"code": 200, "unisdk_login_json": login_json})
+        if host == "service.mkey.163.com":
+            return reply(start_response, {"code": 0, "qrcode": {"status": 1}})
+        start_response("404 Not Found", [("Content-Length", "0")])
+        return [b""]
+
+    return app
+
+
+def serve_standins(http_port: int, https_port: int, cert_dir: str, latency: float):
+    from gevent import monkey
+
+    monkey.patch_all()
+    sys.path.insert(0, SRC)
+    from gevent import pywsgi
+
+    from logutil import logger
+
+    # stdout只用来通知父进程已就绪
+    logger.remove()
+    app = standin_app(latency)
+    plain = pywsgi.WSGIServer(("127.0.0.1", http_port), app, log=None)
+    secure = pywsgi.WSGIServer(
+        ("127.0.0.1", https_port),
+        app,
+        log=None,
+        certfile=os.path.join(cert_dir, "server.pem"),
+        keyfile=os.path.join(cert_dir, "server.key"),
+    )
+    plain.start()
+    secure.start()
+    print("ready", flush=True)
+    secure.serve_forever()
+
+
+def prepare_certificates(cert_dir: str):
+    from certmgr import certmgr
+
+    mgr = certmgr()
+    ca_key = mgr.generate_private_key(2048)
+    ca_cert = mgr.generate_ca(ca_key)
+    srv_key = mgr.generate_private_key(2048)
+    srv_cert = mgr.generate_cert([host for host, _ in STANDIN_HOSTS], srv_key, ca_cert, ca_key)
+    mgr.export_cert(os.path.join(cert_dir, "ca.pem"), ca_cert)
+    mgr.export_cert(os.path.join(cert_dir, "server.pem"), srv_cert)
+    mgr.export_key(os.path.join(cert_dir, "server.key"), srv_key)
+    return os.path.join(cert_dir, "ca.pem")
+
+
+def stage_of(url: str) -> str:
+    parsed = urlparse(url)
+    for name, host, path in STAGES:
+        if name == "channel_session":
+            # 其余渠道SDK请求都算作换取登录会话
+            if parsed.hostname not in ("who.nie.netease.com", "mgbsdk.matrix.netease.com", "service.mkey.163.com"):
+                return name
+            continue
+        if parsed.hostname == host and parsed.path.startswith(path):
+            return name
+    return "other"
+
+
+def inject_oauth(item):
+    """把浏览器登录替换为注入的OAuth结果，之后的请求和正常登录一致"""
+    import httpclient
+
+    name = item.channel_name
+    if name == "xiaomi_app":
+        item.miLogin.webLogin = lambda: item.miLogin.getSTbyCode("bench-code")
+    elif name == "huawei":
+
+        def oauth():
+            item.huaweiLogin.code_verifier = "bench-verifier"
+            item.huaweiLogin.standardCallback("hms://redirect_url?code=bench-code")
+
+        item.huaweiLogin.newOAuthLogin = oauth
+    elif name == "nearme_vivo":
+        package = item.vivoLogin.gamePackage
+        item.vivoLogin.webLogin = lambda: httpclient.get(f"https://joint.vivo.com.cn/h5/union/get?gamePackage={package}").json()["data"]
+    elif name == "myapp":
+        item.wechatLogin.webLogin = lambda: httpclient.get(
+            "https://ysdk.qq.com/auth/wx_verify_code", params={"code": "bench-code", "wx_appid": item.wx_appid}
+        ).json()
+
+
+def run(args, workdir: str, ca_path: str, http_port: int, https_port: int) -> dict:
+    from gevent import monkey
+
+    monkey.patch_all()
+    sys.path.insert(0, SRC)
+    os.environ["PROGRAMDATA"] = workdir
+    # requests里环境变量指定的CA优先于session.verify，去掉后才会用本次生成的CA
+    for name in ("REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE"):
+        os.environ.pop(name, None)
+    os.makedirs(os.path.join(workdir, "idv-login"), exist_ok=True)
+
+    from envmgr import genv
+    from logutil import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    shutil.copy(os.path.join(ASSETS, "cloudRes.json"), os.path.join(workdir, "cache.json"))
+    genv.set("FP_CHANNEL_RECORD", os.path.join(workdir, "channels.json"))
+    genv.set("FAKE_DEVICE", {"device_model": "M2102K1AC", "os_name": "android", "os_ver": "12", "udid": "0123456789abcdef", "app_ver": "157"})
+
+    import httpclient
+    from channelmgr import ChannelManager
+    from cloudRes import CloudRes
+    from ipmgr import PublicIPProvider, _parse_json_ip
+    from proxymgr import add_custom_dns
+
+    for host, secure in STANDIN_HOSTS:
+        add_custom_dns(host, 443 if secure else 80, "127.0.0.1", target_port=https_port if secure else http_port)
+    httpclient.client.verify = ca_path
+    genv.set("CLOUD_RES", CloudRes([], workdir))
+    provider = PublicIPProvider(sources=[("https://who.nie.netease.com/", _parse_json_ip)])
+    provider.session.verify = ca_path
+    genv.set("IP_PROVIDER", provider)
+    manager = ChannelManager()
+
+    current = {}
+
+    def on_request(method, url, elapsed, ok):
+        stage = stage_of(url)
+        current[stage] = current.get(stage, 0) + elapsed
+
+    httpclient.client.hooks.append(on_request)
+    samples = {}
+    failures = {}
+    channels = [i for i in args.channels if i in CHANNELS]
+    for round_index in range(args.rounds + 1):
+        for name in channels:
+            data = dict(CHANNELS[name], name=f"bench-{name}")
+            item = manager.channel_from_dict(json.loads(json.dumps(data)))
+            inject_oauth(item)
+            manager.channels = [item]
+            for mode in ("cold", "warm"):
+                current.clear()
+                start = time.perf_counter()
+                try:
+                    ok = manager.simulate_scan(item.uuid, f"bench-qr-{round_index}", GAME_ID)
+                except Exception:
+                    logger.exception(f"{name}登录失败")
+                    ok = False
+                total = time.perf_counter() - start
+                # 第0轮用于建立连接和预热，不计入结果
+                if round_index == 0:
+                    continue
+                key = f"{name}/{mode}"
+                if not ok:
+                    failures[key] = failures.get(key, 0) + 1
+                    continue
+                stages = dict(current, total=total)
+                stages["local"] = max(total - sum(v for k, v in current.items()), 0)
+                for stage, value in stages.items():
+                    samples.setdefault(key, {}).setdefault(stage, []).append(value)
+    return {"samples": samples, "failures": failures}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def summarize(samples: dict) -> dict:
+    result = {}
+    for key, stages in samples.items():
+        result[key] = {
+            stage: {
+                "p50_ms": round(percentile(stages[stage], 0.5) * 1000, 2),
+                "p95_ms": round(percentile(stages[stage], 0.95) * 1000, 2),
+            }
+            for stage in STAGE_NAMES
+            if stage in stages
+        }
+    return result
+
+
+def check_regressions(current: dict, baseline: dict, max_regression: float, min_delta_ms: float) -> list:
+    """p50比基准慢超过max_regression比例且绝对差值超过min_delta_ms的阶段"""
+    regressions = []
+    for key, stages in current.items():
+        for stage, item in stages.items():
+            old = baseline.get("results", {}).get(key, {}).get(stage)
+            if not old:
+                continue
+            delta = item["p50_ms"] - old["p50_ms"]
+            if delta > min_delta_ms and delta > old["p50_ms"] * max_regression:
+                regressions.append(f"{key} {stage}: {old['p50_ms']}ms -> {item['p50_ms']}ms")
+    return regressions
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各渠道端到端登录耗时测试")
+    parser.add_argument("--rounds", type=int, default=20, help="每个渠道登录的轮数（另有1轮预热）")
+    parser.add_argument("--channels", nargs="+", default=list(CHANNELS), help=f"测试的渠道，可选 {' '.join(CHANNELS)}")
+    parser.add_argument("--latency", type=float, default=0.02, help="替身服务的响应延迟（秒）")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    parser.add_argument("--baseline", help="基准结果JSON，有阶段退化超过阈值时返回非零")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的p50退化比例")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="小于该毫秒数的退化忽略")
+    parser.add_argument("--serve", nargs=3, type=int, metavar=("HTTP", "HTTPS", "_"), help=argparse.SUPPRESS)
+    parser.add_argument("--cert-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve_standins(args.serve[0], args.serve[1], args.cert_dir, args.latency)
+
+    sys.path.insert(0, SRC)
+    workdir = tempfile.mkdtemp(prefix="idv-login-e2e-")
+    # logutil导入时会在当前目录创建log.txt，整个测试都在临时目录里进行
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        ca_path = prepare_certificates(workdir)
+        http_port, https_port = free_port(), free_port()
+        standins = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", str(http_port), str(https_port), "0",
+             "--cert-dir", workdir, "--latency", str(args.latency)],
+            stdout=subprocess.PIPE,
+            cwd=workdir,
+        )
+        try:
+            if standins.stdout.readline().strip() != b"ready":
+                raise RuntimeError("替身服务启动失败")
+            raw = run(args, workdir, ca_path, http_port, https_port)
+        finally:
+            standins.terminate()
+            standins.wait()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = summarize(raw["samples"])
+    print(f"{'渠道/模式':<16}" + "".join(f"{i:>16}" for i in STAGE_NAMES))
+    for key, stages in sorted(results.items()):
+        print(f"{key:<16}" + "".join(f"{stages[i]['p50_ms'] if i in stages else '-':>16}" for i in STAGE_NAMES))
+    print("（单位：毫秒，p50）")
+    if raw["failures"]:
+        print(f"失败次数: {raw['failures']}")
+    report = {"time": int(time.time()), "config": {"rounds": args.rounds, "latency": args.latency}, "results": results, "failures": raw["failures"]}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    failed = bool(raw["failures"])
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = check_regressions(results, json.load(f), args.max_regression, args.min_delta_ms)
+        for item in regressions:
+            print(f"退化: {item}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 登录和转发路径上纯计算函数的微基准测试：SAUTH签名与组装、小米AES、各渠道的extra_unisdk_data、
+# 二维码水印、自动填充的密码加解密、hosts文件读写和tools/unpack.py的validate。
+# 每个用例先自动确定每轮的调用次数（单轮约0.1秒），重复多轮取最小值和中位数，单位为微秒/次。
+# 结果默认和bench/baselines/micro.json对比。基准是录制机器上的绝对耗时，只有机器、CPU和Python版本都相同时
+# 才检查退化（中位数慢于基准超过阈值时返回非零），否则只显示对比；--save更新基准。
+# 导入失败的用例（例如无图形环境时加载不了PyQt5的渠道）记为跳过，不影响其他用例。
+#
+# 用法: python bench/micro.py [-k sign] [--save] [--max-regression 0.3]
+
+import argparse
+import base64
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "micro.json")
+GAME_ID = "aecfrt3rmaaaaajl-g-h55"
+FAKE_DEVICE = {
+    "device_model": "M2102K1AC",
+    "os_name": "android",
+    "os_ver": "12",
+    "udid": "0123456789abcdef",
+    "app_ver": "157",
+    "imei": "860000000000000",
+    "mac": "02:00:00:00:00:00",
+}
+
+CASES = []
+
+
+def case(name: str):
+    """注册用例。被装饰的函数做准备工作，返回要计时的无参函数"""
+
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+
+    return register
+
+
+def prepare_env(workdir: str):
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, os.path.join(ROOT, "tools"))
+    os.environ.setdefault("PROGRAMDATA", workdir)
+    os.makedirs(os.path.join(os.environ["PROGRAMDATA"], "idv-login"), exist_ok=True)
+    os.chdir(workdir)
+
+    from logutil import logger
+
+    logger.remove()
+    from envmgr import genv
+
+    genv.set("FAKE_DEVICE", FAKE_DEVICE)
+    # 固定IP，buildSAUTH不发网络请求
+    genv.set("IP_PROVIDER", SimpleNamespace(get_ip=lambda: "10.0.0.1"))
+
+
+def sauth_body() -> dict:
+    from channelHandler import channelUtils
+
+    return channelUtils.buildSAUTH("xiaomi_app", "xiaomi_app", "1000001", "bench-session", GAME_ID, "3.0.5", {"gas_token": "x" * 64})
+
+
+@case("channelUtils.calcSign")
+def _calc_sign():
+    from channelHandler import channelUtils
+
+    body = json.dumps(sauth_body())
+    return lambda: channelUtils.calcSign("https://mgbsdk.matrix.netease.com/h55/sdk/uni_sauth", "POST", body, "bench-key-0123456789")
+
+
+@case("channelUtils.buildSAUTH")
+def _build_sauth():
+    return sauth_body
+
+
+@case("channelUtils.CustomEncoder")
+def _custom_encoder():
+    from channelHandler import channelUtils
+
+    body = sauth_body()
+    return lambda: json.dumps(body, cls=channelUtils.CustomEncoder)
+
+
+@case("channelUtils.encode_escaped")
+def _encode_escaped():
+    from channelHandler import channelUtils
+
+    body = sauth_body()
+    return lambda: channelUtils.encode_escaped(body)
+
+
+@case("miLogin.aes_encrypt")
+def _mi_encrypt():
+    from channelHandler.miLogin.consts import AES_KEY
+    from channelHandler.miLogin.utils import aes_encrypt
+
+    data = json.dumps({"code": 0, "uuid": "1000001", "st": "s" * 128, "nickname": "bench"})
+    return lambda: aes_encrypt(data, AES_KEY)
+
+
+@case("miLogin.aes_decrypt")
+def _mi_decrypt():
+    from channelHandler.miLogin.consts import AES_KEY
+    from channelHandler.miLogin.utils import aes_decrypt, aes_encrypt
+
+    data = aes_encrypt(json.dumps({"code": 0, "uuid": "1000001", "st": "s" * 128, "nickname": "bench"}), AES_KEY)
+    return lambda: aes_decrypt(data, AES_KEY)
+
+
+@case("miLogin.generate_unsign_request")
+def _mi_unsign_request():
+    from channelHandler.miLogin.consts import AES_KEY
+    from channelHandler.miLogin.utils import generate_unsign_request
+
+    params = {"accountType": 4, "code": "c" * 64, "isSaveSt": "true", "appid": "2000202"}
+    return lambda: generate_unsign_request(params, AES_KEY)
+
+
+def handler_instance(cls, **attrs):
+    """不走构造函数（会读写账号文件、请求渠道SDK），只设置_build_extra_unisdk_data用到的属性"""
+    from logutil import setup_logger
+
+    item = cls.__new__(cls)
+    item.logger = setup_logger()
+    item.game_id = GAME_ID
+    item.uniBody = sauth_body()
+    item.uniSDKJSON = {"username": "bench@ad.netease.win.163.com"}
+    for k, v in attrs.items():
+        setattr(item, k, v)
+    return item._build_extra_unisdk_data
+
+
+@case("miChannel._build_extra_unisdk_data")
+def _mi_extra():
+    from channelHandler.miChannelHandler import miChannel
+
+    return handler_instance(miChannel, oAuthData={"uuid": "1000001"})
+
+
+@case("huaweiChannel._build_extra_unisdk_data")
+def _huawei_extra():
+    from channelHandler.huaChannelHandler import huaweiChannel
+
+    return handler_instance(huaweiChannel, session=SimpleNamespace(ts=str(int(time.time() * 1000)), playerLevel=1))
+
+
+@case("vivoChannel._build_extra_unisdk_data")
+def _vivo_extra():
+    from channelHandler.vivoChannelHandler import vivoChannel
+
+    return handler_instance(vivoChannel)
+
+
+@case("wechatChannel._build_extra_unisdk_data")
+def _wechat_extra():
+    from channelHandler.wechatChannelHandler import wechatChannel
+
+    session = SimpleNamespace(openid="o" * 28, atk="a" * 88, pf="desktop_m_wechat", pfKey="k" * 32)
+    return handler_instance(wechatChannel, session=session)
+
+
+@case("riskWmUtils.wm")
+def _watermark():
+    from io import BytesIO
+
+    from PIL import Image
+
+    from riskWmUtils import wm
+
+    # 和mpay返回的二维码图片尺寸相近
+    output = BytesIO()
+    Image.new("RGB", (430, 430), (255, 255, 255)).save(output, format="PNG")
+    image = output.getvalue()
+    return lambda: wm(image, "请勿扫描")
+
+
+@case("AutoFillRecord.encrypt")
+def _autofill_encrypt():
+    from AutoFillUtils import AutoFillRecord
+
+    return lambda: AutoFillRecord(username="bench@163.com", password="p" * 16).to_dict()
+
+
+@case("AutoFillRecord.decrypt")
+def _autofill_decrypt():
+    from AutoFillUtils import AutoFillRecord
+
+    data = AutoFillRecord(username="bench@163.com", password="p" * 16).to_dict()
+
+    def run():
+        record = AutoFillRecord(record_dict=data)
+        return record.decrypt_password("bench@163.com", record.encrypted_password)
+
+    return run
+
+
+def hosts_file() -> str:
+    # 和用户实际的hosts文件相近：注释、本机地址和一些其他软件写入的条目
+    lines = ["# Copyright (c) 1993-2009 Microsoft Corp.", "#", "127.0.0.1 localhost", "::1 localhost", ""]
+    lines += [f"10.0.{i // 256}.{i % 256} host{i}.example.com host{i}" for i in range(200)]
+    lines += ["127.0.0.1 service.mkey.163.com"]
+    path = os.path.join(os.getcwd(), "hosts")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+@case("python_hosts.parse")
+def _hosts_parse():
+    from python_hosts import Hosts
+
+    path = hosts_file()
+    return lambda: Hosts(path=path)
+
+
+@case("python_hosts.write")
+def _hosts_write():
+    from python_hosts import Hosts
+
+    hosts = Hosts(path=hosts_file())
+    target = os.path.join(os.getcwd(), "hosts.out")
+    return lambda: hosts.write(path=target)
+
+
+@case("unpack.validate")
+def _unpack_validate():
+    from unpack import validate
+
+    key = bytes((76 + i % 40 + 7 * (i // 40)) for i in range(62)) + bytes(range(48, 110))
+    data = {"UNISDK_SERVER_KEY": base64.b64encode(key).decode(), "JF_LOG_KEY": "abcdefghijklmnopqrstuvwxyz0123456789" * 2}
+    return lambda: validate(data, "JF_LOG_KEY")
+
+
+def measure(func, rounds: int, target: float) -> dict:
+    """先翻倍找到单轮耗时超过target的调用次数，再重复rounds轮"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target or number >= 1 << 20:
+            break
+        number *= 2
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        "min_us": round(min(timings) * 1e6, 3),
+        "median_us": round(statistics.median(timings) * 1e6, 3),
+        "number": number,
+        "rounds": rounds,
+    }
+
+
+def cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def environment() -> dict:
+    """基准只在相同的环境下可比"""
+    return {
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}",
+        "cpu": cpu_model(),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SRC, text=True).strip()
+    except Exception:
+        return ""
+
+
+def report(results: dict, skipped: dict, baseline: dict, max_regression: float) -> list:
+    """打印与基准的对比，返回退化的用例"""
+    old = baseline.get("results", {})
+    regressions = []
+    print(f"{'用例':<44}{'基准(us)':>12}{'当前(us)':>12}{'变化':>10}")
+    for name, item in results.items():
+        before = old.get(name, {}).get("median_us")
+        if not before:
+            print(f"{name:<44}{'-':>12}{item['median_us']:>12}{'新增':>10}")
+            continue
+        change = item["median_us"] / before - 1
+        mark = ""
+        if change > max_regression:
+            mark = " !"
+            regressions.append(name)
+        print(f"{name:<44}{before:>12}{item['median_us']:>12}{change * 100:>+9.1f}%{mark}")
+    for name, error in skipped.items():
+        print(f"{name:<44}{'跳过':>12}  {error}")
+    if baseline:
+        print(f"基准: {baseline.get('commit', '')} {baseline.get('python', '')} {baseline.get('machine', '')} {baseline.get('cpu', '')}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="纯计算函数的微基准测试")
+    parser.add_argument("-k", dest="keyword", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--rounds", type=int, default=7, help="每个用例重复的轮数")
+    parser.add_argument("--target", type=float, default=0.1, help="每轮的目标耗时（秒）")
+    parser.add_argument("--baseline", default=BASELINE, help="对比的基准文件")
+    parser.add_argument("--save", action="store_true", help="把本次结果写入基准文件")
+    parser.add_argument("--max-regression", type=float, default=0.3, help="中位数允许的退化比例")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="idv-login-micro-")
+    cwd = os.getcwd()
+    prepare_env(workdir)
+    results = {}
+    skipped = {}
+    try:
+        for name, setup in CASES:
+            if args.keyword and args.keyword not in name:
+                continue
+            try:
+                results[name] = measure(setup(), args.rounds, args.target)
+            except Exception as e:
+                skipped[name] = f"{type(e).__name__}: {e}"
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    data = dict(
+        {"time": int(time.time()), "commit": git_commit(), "note": "各用例为录制机器上的绝对耗时，只能和同一机器、同一Python版本的结果比较"},
+        **environment(),
+        results=results,
+        skipped=skipped,
+    )
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = report(results, skipped, baseline, args.max_regression)
+    comparable = all(baseline.get(k) == v for k, v in environment().items())
+    if baseline and not comparable:
+        print("基准来自其他机器或Python版本，只显示对比，不检查退化")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    if args.save:
+        if args.keyword or skipped:
+            # 只跑了部分用例或有用例跳过时保留其余用例的基准
+            data["results"] = dict(baseline.get("results", {}), **results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"基准已更新: {args.baseline}")
+        return
+    if regressions and comparable:
+        print(f"{len(regressions)}个用例慢于基准{args.max_regression * 100:.0f}%以上")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
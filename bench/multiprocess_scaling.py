@@ -0,0 +1,194 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 多进程模式的吞吐量测试。
+# 服务端使用src/workers.py和src/statestore.py，用与代理相同的方式fork工作进程；
+# 每个请求模拟一次登录中的CPU开销（JSON改写、SAUTH的AES加密和HMAC签名），并通过共享状态读写登录会话。
+# 客户端用多个进程保持长连接持续发请求，统计每秒完成的请求数。仅支持Linux/macOS。
+#
+# 用法: python bench/multiprocess_scaling.py --workers 1 2 4 --clients 8 --duration 10
+
+import argparse
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from http.client import HTTPConnection
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+LOGIN_METHODS = [
+    {"name": f"渠道{i}", "icon_url": "https://example.com/icon.png", "text_color": "", "hot": i % 2 == 0, "type": i}
+    for i in range(40)
+]
+
+
+def login_work(qr_uuid: str, sessions) -> bytes:
+    """一次扫码登录中代理要做的CPU工作"""
+    from Crypto.Cipher import AES
+
+    config = json.loads(json.dumps({"uuid": qr_uuid, "login_methods": LOGIN_METHODS, "qrcode_scanners": [{"url": ""}]}))
+    config["qrcode_scanners"][0]["url"] = f"https://localhost/_idv-login/index?qr={qr_uuid}"
+    config["login_methods"] = [i for i in config["login_methods"] if i["type"] != 3]
+    body = json.dumps(config).encode()
+    key = hashlib.sha256(qr_uuid.encode()).digest()
+    cipher = AES.new(key[:16], AES.MODE_CBC, key[16:])
+    padded = body + b"\0" * (16 - len(body) % 16)
+    for _ in range(20):
+        padded = cipher.encrypt(padded)
+        sign = hmac.new(key, padded, hashlib.sha256).hexdigest()
+    session = sessions.get(qr_uuid) or sessions.create(qr_uuid, "bench", "127.0.0.1")
+    session.account_uuid = sign[:16]
+    sessions.save(session)
+    return json.dumps({"uuid": qr_uuid, "sign": sign, "size": len(body)}).encode()
+
+
+def serve(workers_count: int, port: int):
+    from gevent import monkey
+
+    monkey.patch_all()
+    sys.path.insert(0, SRC)
+    import logging
+    import signal
+
+    from gevent import pywsgi
+
+    # logutil导入时会在当前目录创建log.txt，在临时目录里导入后只保留stderr上的警告
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="idv-bench-") as workdir:
+        os.chdir(workdir)
+        from logutil import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        os.chdir(cwd)
+
+    import workers
+    from sessionmgr import SessionTable
+    from statestore import RemoteStore, StateServer
+
+    sessions = SessionTable()
+    pool = None
+    if workers_count > 1:
+        state_server = StateServer().start()
+        pool = workers.WorkerPool(workers_count, ("127.0.0.1", port))
+
+        def on_child(index):
+            state_server.close()
+            sessions.attach(RemoteStore(state_server.address))
+
+        if pool.start(on_child) == 0:
+            sessions.attach(state_server.store)
+
+    def app(environ, start_response):
+        qr_uuid = environ.get("QUERY_STRING", "").partition("=")[2] or "bench"
+        body = login_work(qr_uuid, sessions)
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    log = logging.getLogger("bench")
+    log.setLevel(logging.WARN)
+    server = pywsgi.WSGIServer(pool.listener() if pool else ("127.0.0.1", port), app, log=log)
+    if pool and pool.index != 0:
+        pool.serve(server.serve_forever)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        if pool:
+            pool.stop()
+            if pool.index == 0:
+                state_server.remove()
+
+
+def client(port: int, duration: float, client_id: int, result):
+    conn = HTTPConnection("127.0.0.1", port, timeout=10)
+    deadline = time.time() + duration
+    count = 0
+    try:
+        while time.time() < deadline:
+            conn.request("GET", f"/mpay/api/qrcode/create_login?uuid=c{client_id}-{count % 50}")
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 200:
+                count += 1
+    finally:
+        conn.close()
+        result.put(count)
+
+
+def wait_ready(port: int, timeout: float = 10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/?uuid=ready")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("服务端启动超时")
+
+
+def run_case(workers_count: int, clients: int, duration: float, port: int) -> float:
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(workers_count), "--port", str(port)])
+    try:
+        wait_ready(port)
+        result = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client, args=(port, duration, i, result)) for i in range(clients)]
+        for p in procs:
+            p.start()
+        total = sum(result.get() for _ in procs)
+        for p in procs:
+            p.join()
+        return total / duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程代理模式吞吐量测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=18443)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+    if not hasattr(os, "fork"):
+        print("多进程模式需要fork，当前系统不支持")
+        return
+    print(f"CPU核数: {os.cpu_count()}  客户端进程: {args.clients}  每轮: {args.duration}秒")
+    baseline = None
+    for count in args.workers:
+        rps = run_case(count, args.clients, args.duration, args.port)
+        baseline = baseline or rps
+        print(f"workers={count:<3d} {rps:10.1f} req/s  x{rps / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
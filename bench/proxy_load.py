@@ -0,0 +1,371 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 登录代理的压力测试。
+# 三类进程：模拟mpay接口的上游桩、运行proxymgr的Flask应用的代理（HTTP，Host: localhost，与游戏客户端的请求一致）、
+# 发请求的客户端。每个虚拟用户循环执行一次完整的扫码登录：login_methods、pc_config、create_login、
+# 轮询qrcode/query直到确认、exchange_token、data/upload。
+# 统计各路由的RPS和p50/p95/p99，代理进程和上游桩的CPU、内存，结果写成JSON，可用--compare和之前的结果对比。
+#
+# 用法: python bench/proxy_load.py --users 50 --duration 30 --output result.json [--compare old.json]
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+GAME_ID = "aecfrt3rmaaaaajl-g-h55"
+ROUTES = ["login_methods", "pc_config", "create_login", "qrcode_query", "exchange_token", "data_upload"]
+# 固定数量的上游账号，exchange_token后导入的渠道服账号按id去重，账号文件不会无限增长
+ACCOUNT_POOL = 50
+
+
+def serve_upstream(port: int, latency: float, scan_delay: float):
+    """模拟mpay接口。二维码在create_login之后scan_delay秒变为已确认"""
+    from gevent import monkey
+
+    monkey.patch_all()
+    import gevent
+    from gevent import pywsgi
+    from urllib.parse import parse_qs
+
+    created = {}
+    login_methods = {
+        "entrance": [],
+        "select_platform": False,
+        "config": {str(i): {"name": f"渠道{i}", "select_platforms": [0]} for i in range(30)},
+    }
+    pc_config = {"game": {"config": {"cv_review_status": 0, "pad": "x" * 2048}}}
+
+    def app(environ, start_response):
+        gevent.sleep(latency)
+        path = environ["PATH_INFO"]
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        if path.endswith("/login_methods"):
+            body = login_methods
+        elif path == "/mpay/games/pc_config":
+            body = pc_config
+        elif path == "/mpay/api/qrcode/create_login":
+            qr_uuid = uuid.uuid4().hex
+            created[qr_uuid] = time.time()
+            body = {"uuid": qr_uuid, "qrcode_scanners": [{"url": f"https://example.com/qr?uuid={qr_uuid}"}], "expire": 120}
+        elif path == "/mpay/api/qrcode/query":
+            qr_uuid = query.get("uuid", [""])[0]
+            confirmed = time.time() - created.get(qr_uuid, time.time()) >= scan_delay
+            body = {"qrcode": {"status": 2 if confirmed else 0}}
+            if confirmed:
+                user_id = f"bench{hash(qr_uuid) % ACCOUNT_POOL}"
+                body["login_info"] = {"login_channel": "netease", "code": user_id, "src_client_type": 1}
+        elif path == "/mpay/api/users/login/qrcode/exchange_token":
+            qr_uuid = parse_qs(environ["wsgi.input"].read().decode()).get("uuid", [""])[0]
+            user_id = f"bench{hash(qr_uuid) % ACCOUNT_POOL}"
+            body = {"user": {"id": user_id, "token": uuid.uuid4().hex}, "device": {"id": "bench"}, "ext_info": {}}
+        elif path == "/mpay/api/data/upload":
+            environ["wsgi.input"].read()
+            body = {"code": 0}
+        else:
+            start_response("404 Not Found", [("Content-Length", "0")])
+            return [b""]
+        data = json.dumps(body).encode()
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(data)))])
+        return [data]
+
+    pywsgi.WSGIServer(("127.0.0.1", port), app, log=None).serve_forever()
+
+
+def serve_proxy(port: int, upstream: str, workdir: str):
+    """用proxymgr的Flask应用处理请求，上游指向桩服务器"""
+    from gevent import monkey
+
+    monkey.patch_all()
+    sys.path.insert(0, SRC)
+    os.chdir(workdir)
+    import logging
+
+    from gevent import pywsgi
+
+    from envmgr import genv
+    from logutil import logger
+
+    # 只输出警告以上，不写log.txt
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    genv.set("DOMAIN_TARGET", upstream)
+    genv.set("FP_CHANNEL_RECORD", os.path.join(workdir, "channels.json"))
+    genv.set("GLOB_LOGIN_PROFILE_PATH", workdir)
+    from channelmgr import ChannelManager
+
+    genv.set("CHANNELS_HELPER", ChannelManager())
+    import admission
+    import proxymgr
+
+    log = logging.getLogger("bench")
+    log.setLevel(logging.WARN)
+    server = pywsgi.WSGIServer(("127.0.0.1", port), proxymgr.app, log=log, **admission.controller.server_options())
+    server.serve_forever()
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def run_clients(port: int, users: int, duration: float, poll_interval: float):
+    """虚拟用户循环登录，结果以JSON写到stdout"""
+    from gevent import monkey
+
+    monkey.patch_all()
+    import gevent
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode
+
+    latencies = {name: [] for name in ROUTES + ["login"]}
+    errors = {name: 0 for name in ROUTES + ["login"]}
+    headers = {"Host": "localhost", "Accept-Encoding": "gzip", "Content-Type": "application/x-www-form-urlencoded"}
+    deadline = time.time() + duration
+
+    def call(conn, route, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except Exception:
+            errors[route] += 1
+            conn.close()
+            return None
+        latencies[route].append(time.perf_counter() - start)
+        if resp.status != 200:
+            errors[route] += 1
+            return None
+        return data
+
+    def user(index: int):
+        conn = HTTPConnection("127.0.0.1", port, timeout=60)
+        while time.time() < deadline:
+            start = time.perf_counter()
+            call(conn, "login_methods", "GET", f"/mpay/games/{GAME_ID}/login_methods")
+            call(conn, "pc_config", "GET", f"/mpay/games/pc_config?game_id={GAME_ID}")
+            data = call(conn, "create_login", "GET", f"/mpay/api/qrcode/create_login?game_id={GAME_ID}")
+            if data is None:
+                errors["login"] += 1
+                gevent.sleep(poll_interval)
+                continue
+            qr_uuid = json.loads(data)["uuid"]
+            confirmed = False
+            while time.time() < deadline + 30 and not confirmed:
+                data = call(conn, "qrcode_query", "GET", f"/mpay/api/qrcode/query?uuid={qr_uuid}")
+                if data is not None and json.loads(data).get("qrcode", {}).get("status") == 2:
+                    confirmed = True
+                else:
+                    gevent.sleep(poll_interval)
+            form = urlencode({"uuid": qr_uuid, "game_id": GAME_ID, "token": uuid.uuid4().hex})
+            ok = confirmed and call(conn, "exchange_token", "POST", "/mpay/api/users/login/qrcode/exchange_token", form)
+            call(conn, "data_upload", "POST", "/mpay/api/data/upload", urlencode({"game_id": GAME_ID, "event": "login"}))
+            if ok:
+                latencies["login"].append(time.perf_counter() - start)
+            else:
+                errors["login"] += 1
+        conn.close()
+
+    gevent.joinall([gevent.spawn(user, i) for i in range(users)])
+    json.dump({"latencies": latencies, "errors": errors}, sys.stdout)
+
+
+def wait_port(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"端口{port}启动超时")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ProcessSampler:
+    """定时采样进程的CPU占用和常驻内存"""
+
+    def __init__(self, pid: int):
+        import psutil
+
+        self.process = psutil.Process(pid)
+        self.process.cpu_percent()
+        self.cpu = []
+        self.rss = []
+        self.start_cpu_time = sum(self.process.cpu_times()[:2])
+        self.start = time.time()
+
+    def sample(self):
+        self.cpu.append(self.process.cpu_percent())
+        self.rss.append(self.process.memory_info().rss)
+
+    def summary(self) -> dict:
+        cpu_seconds = sum(self.process.cpu_times()[:2]) - self.start_cpu_time
+        return {
+            "cpu_percent_avg": round(cpu_seconds / max(time.time() - self.start, 1e-6) * 100, 1),
+            "cpu_percent_max": max(self.cpu, default=0),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "rss_mb_max": round(max(self.rss, default=0) / 1024 / 1024, 1),
+        }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SRC, text=True).strip()
+    except Exception:
+        return ""
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    routes = {}
+    for name in ROUTES + ["login"]:
+        values = [v for r in results for v in r["latencies"][name]]
+        routes[name] = {
+            "count": len(values),
+            "errors": sum(r["errors"][name] for r in results),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    return routes
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\n与 {baseline.get('commit') or '基准'} 对比:")
+    print(f"{'路由':<16}{'RPS':>18}{'p95(ms)':>22}")
+    for name, item in current["routes"].items():
+        old = baseline.get("routes", {}).get(name)
+        if not old:
+            continue
+        rps_delta = (item["rps"] - old["rps"]) / old["rps"] * 100 if old["rps"] else 0
+        p95_delta = (item["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+        print(f"{name:<16}{old['rps']:>8} -> {item['rps']:<6}({rps_delta:+.0f}%){old['p95_ms']:>9} -> {item['p95_ms']:<7}({p95_delta:+.0f}%)")
+    old_cpu = baseline.get("proxy", {}).get("cpu_seconds")
+    if old_cpu:
+        print(f"代理CPU时间: {old_cpu}s -> {current['proxy']['cpu_seconds']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录代理压力测试")
+    parser.add_argument("--users", type=int, default=50, help="并发的虚拟用户（同时进行的登录）数量")
+    parser.add_argument("--duration", type=float, default=30, help="测试时长（秒）")
+    parser.add_argument("--client-procs", type=int, default=2, help="客户端进程数")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="客户端轮询qrcode/query的间隔（秒）")
+    parser.add_argument("--scan-delay", type=float, default=3.0, help="create_login之后多久扫码确认（秒）")
+    parser.add_argument("--upstream-latency", type=float, default=0.03, help="上游桩的响应延迟（秒）")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    parser.add_argument("--compare", metavar="JSON", help="与之前保存的结果对比")
+    parser.add_argument("--serve-upstream", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--serve-proxy", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--client", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_upstream:
+        return serve_upstream(args.serve_upstream, args.upstream_latency, args.scan_delay)
+    if args.serve_proxy:
+        return serve_proxy(args.serve_proxy, args.upstream, args.workdir)
+    if args.client:
+        return run_clients(args.client, args.users, args.duration, args.poll_interval)
+
+    script = os.path.abspath(__file__)
+    upstream_port, proxy_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="idv-bench-")
+    common = ["--upstream-latency", str(args.upstream_latency), "--scan-delay", str(args.scan_delay)]
+    upstream_proc = subprocess.Popen([sys.executable, script, "--serve-upstream", str(upstream_port)] + common)
+    proxy_proc = subprocess.Popen(
+        [sys.executable, script, "--serve-proxy", str(proxy_port), "--upstream", f"127.0.0.1:{upstream_port}", "--workdir", workdir]
+    )
+    try:
+        wait_port(upstream_port)
+        wait_port(proxy_port)
+        proxy_sampler, upstream_sampler = ProcessSampler(proxy_proc.pid), ProcessSampler(upstream_proc.pid)
+        per_proc = [args.users // args.client_procs + (1 if i < args.users % args.client_procs else 0) for i in range(args.client_procs)]
+        print(f"{args.users}个并发用户，{args.client_procs}个客户端进程，持续{args.duration}秒...")
+        start = time.time()
+        # 客户端把全部延迟样本写到stdout，数据量会超过管道缓冲区，直接写到文件里，避免客户端阻塞在写入上
+        outputs = [os.path.join(workdir, f"client-{i}.json") for i in range(len(per_proc))]
+        clients = []
+        for n, path in zip(per_proc, outputs):
+            if not n:
+                continue
+            with open(path, "wb") as out:
+                clients.append(subprocess.Popen(
+                    [sys.executable, script, "--client", str(proxy_port), "--users", str(n), "--duration", str(args.duration),
+                     "--poll-interval", str(args.poll_interval)],
+                    stdout=out,
+                ))
+        while any(c.poll() is None for c in clients):
+            proxy_sampler.sample()
+            upstream_sampler.sample()
+            time.sleep(0.5)
+        elapsed = time.time() - start
+        results = []
+        for n, path in zip(per_proc, outputs):
+            if n:
+                with open(path, encoding="utf-8") as f:
+                    results.append(json.load(f))
+        report = {
+            "commit": git_commit(),
+            "time": int(time.time()),
+            "config": {k: getattr(args, k) for k in ("users", "duration", "client_procs", "poll_interval", "scan_delay", "upstream_latency")},
+            "elapsed": round(elapsed, 2),
+            "routes": summarize(results, elapsed),
+            "proxy": proxy_sampler.summary(),
+            "upstream": upstream_sampler.summary(),
+        }
+    finally:
+        for proc in (proxy_proc, upstream_proc):
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'路由':<16}{'请求数':>8}{'错误':>6}{'RPS':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, item in report["routes"].items():
+        print(f"{name:<16}{item['count']:>8}{item['errors']:>6}{item['rps']:>8}{item['p50_ms']:>9}{item['p95_ms']:>9}{item['p99_ms']:>9}")
+    print(f"代理进程: {report['proxy']}")
+    print(f"上游桩: {report['upstream']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 上游回放服务器。读取--capture录制的归档，按(方法, 域名, 路径, 查询参数)匹配请求，
+# 同一个请求录到多次时按录制顺序依次返回；按录制时的耗时（可缩放）延迟应答，并可注入故障。
+# 默认启用HTTPS，证书签发给归档里的所有域名，生成的CA用于代理的--upstream-ca。
+#
+# 用法:
+#   python bench/replay_server.py capture.ndjson.gz --port 8443 --cert-dir /tmp/replay-ca
+#   python src/main.py --replay 127.0.0.1:8443 --upstream-ca /tmp/replay-ca/ca.pem
+
+import argparse
+import gzip
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlparse
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import gevent
+from gevent import pywsgi
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# logutil导入时会在当前目录创建log.txt，在临时目录里导入后只保留stderr上的警告
+_cwd = os.getcwd()
+with tempfile.TemporaryDirectory(prefix="idv-replay-") as _workdir:
+    os.chdir(_workdir)
+    from logutil import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    os.chdir(_cwd)
+
+import capturemgr
+
+HOP_HEADERS = ("connection", "keep-alive", "transfer-encoding", "content-length", "content-encoding")
+# 小于该长度的响应不压缩
+MIN_COMPRESS_SIZE = 512
+
+
+def request_key(method: str, host: str, path: str, query: str):
+    # 路径和查询参数和录制时一样先脱敏，否则带ID或token的请求永远匹配不上
+    pairs = capturemgr.redact_pairs(parse_qsl(query, keep_blank_values=True))
+    return method.upper(), (host or "").lower(), capturemgr.redact_path(path), tuple(sorted(pairs))
+
+
+class ReplayIndex:
+    def __init__(self, records: list):
+        self.records = records
+        self._exact = defaultdict(list)
+        self._by_path = defaultdict(list)
+        self._cursor = defaultdict(int)
+        for item in records:
+            url = urlparse(item["url"])
+            key = request_key(item["method"], url.hostname, url.path, url.query)
+            self._exact[key].append(item)
+            self._by_path[key[:3]].append(item)
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def hosts(self) -> list:
+        return capturemgr.archive_hosts(self.records)
+
+    def match(self, method: str, host: str, path: str, query: str):
+        """先按查询参数精确匹配，找不到时忽略查询参数。多条记录按顺序轮流返回"""
+        key = request_key(method, host, path, query)
+        candidates = self._exact.get(key)
+        if candidates:
+            self.hits += 1
+        else:
+            key = key[:3]
+            candidates = self._by_path.get(key)
+            if not candidates:
+                self.misses += 1
+                return None
+            self.fuzzy_hits += 1
+        index = self._cursor[key]
+        self._cursor[key] = index + 1
+        return candidates[index % len(candidates)]
+
+    def stats(self) -> dict:
+        return {"records": len(self.records), "hits": self.hits, "fuzzy_hits": self.fuzzy_hits, "misses": self.misses}
+
+
+class ReplayHandler(pywsgi.WSGIHandler):
+    """把客户端socket放进environ，注入断连故障时使用"""
+
+    def get_environ(self):
+        environ = super().get_environ()
+        environ["replay.socket"] = self.socket
+        return environ
+
+
+def make_app(index: ReplayIndex, latency_scale: float, delay: float, fault_rate: float, fault_mode: str):
+    faults = {"503": 0, "drop": 0}
+
+    def reply(start_response, status: str, body: bytes, headers=()):
+        start_response(status, list(headers) + [("Content-Length", str(len(body)))])
+        return [body]
+
+    def app(environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == "/_replay/hosts":
+            return reply(start_response, "200 OK", json.dumps({"hosts": index.hosts()}).encode(), [("Content-Type", "application/json")])
+        if path == "/_replay/stats":
+            body = json.dumps(dict(index.stats(), faults=faults)).encode()
+            return reply(start_response, "200 OK", body, [("Content-Type", "application/json")])
+
+        host = environ.get("HTTP_HOST", "").split(":")[0]
+        item = index.match(environ["REQUEST_METHOD"], host, path, environ.get("QUERY_STRING", ""))
+        if item is None:
+            body = json.dumps({"error": "回放归档中没有该请求", "host": host, "path": path}, ensure_ascii=False).encode()
+            return reply(start_response, "404 Not Found", body, [("Content-Type", "application/json")])
+
+        gevent.sleep(item.get("elapsed", 0) * latency_scale + delay)
+        if fault_rate and random.random() < fault_rate:
+            mode = fault_mode if fault_mode != "mixed" else random.choice(("503", "drop"))
+            faults[mode] += 1
+            if mode == "drop":
+                environ["replay.socket"].shutdown(socket.SHUT_RDWR)
+                environ["replay.socket"].close()
+                return []
+            return reply(start_response, "503 Service Unavailable", b'{"error": "injected"}', [("Content-Type", "application/json")])
+
+        response = item["response"]
+        body = capturemgr.decode_body(response["body"])
+        headers = [(k, v) for k, v in response["headers"] if k.lower() not in HOP_HEADERS]
+        if len(body) >= MIN_COMPRESS_SIZE and "gzip" in environ.get("HTTP_ACCEPT_ENCODING", ""):
+            # 归档里保存的是解压后的内容，按客户端的声明重新压缩，和真实上游的行为一致
+            body = gzip.compress(body, 6)
+            headers.append(("Content-Encoding", "gzip"))
+        status = f"{response['status']} {'OK' if response['status'] < 400 else 'ERROR'}"
+        return reply(start_response, status, body, headers)
+
+    return app
+
+
+def prepare_certificates(cert_dir: str, hosts: list):
+    """生成CA和签发给归档域名的服务器证书，返回(CA路径, 证书路径, 私钥路径)"""
+    from certmgr import certmgr
+
+    os.makedirs(cert_dir, exist_ok=True)
+    mgr = certmgr()
+    ca_key = mgr.generate_private_key(2048)
+    ca_cert = mgr.generate_ca(ca_key)
+    srv_key = mgr.generate_private_key(2048)
+    # 证书只签发给域名，IP形式的上游按IP直接访问
+    names = [i for i in hosts if not i.replace(".", "").isdigit() and ":" not in i]
+    srv_cert = mgr.generate_cert(names + ["localhost"], srv_key, ca_cert, ca_key)
+    paths = [os.path.join(cert_dir, name) for name in ("ca.pem", "server.pem", "server.key")]
+    mgr.export_cert(paths[0], ca_cert)
+    mgr.export_cert(paths[1], srv_cert)
+    mgr.export_key(paths[2], srv_key)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游请求回放服务器")
+    parser.add_argument("archive", help="--capture录制的归档（NDJSON，可gzip压缩）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="录制耗时的倍数，0表示不延迟")
+    parser.add_argument("--delay", type=float, default=0.0, help="每个请求额外延迟（秒）")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="注入故障的比例（0~1）")
+    parser.add_argument("--fault-mode", choices=("503", "drop", "mixed"), default="503", help="故障类型：返回503、断开连接或两者随机")
+    parser.add_argument("--cert-dir", default="replay-ca", help="生成CA和服务器证书的目录")
+    parser.add_argument("--plain", action="store_true", help="使用HTTP，只用于压测脚本直接请求")
+    args = parser.parse_args()
+
+    index = ReplayIndex(capturemgr.load_archive(args.archive))
+    hosts = index.hosts()
+    print(f"载入{len(index.records)}条记录，域名: {', '.join(hosts)}")
+
+    options = {}
+    if not args.plain:
+        ca_path, cert_path, key_path = prepare_certificates(args.cert_dir, hosts)
+        options = {"certfile": cert_path, "keyfile": key_path}
+        print(f"CA证书: {os.path.abspath(ca_path)}")
+        print(f"代理启动参数: --replay {args.host}:{args.port} --upstream-ca {os.path.abspath(ca_path)}")
+
+    app = make_app(index, args.latency_scale, args.delay, args.fault_rate, args.fault_mode)
+    server = pywsgi.WSGIServer((args.host, args.port), app, handler_class=ReplayHandler, log=None, **options)
+    server.start()
+    print(f"回放服务器已启动: {'http' if args.plain else 'https'}://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(index.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 账号的NDJSON流式导入导出。每行一个账号记录，可选gzip压缩。
+
+import gzip
+import io
+import json
+import zlib
+
+from logutil import setup_logger
+
+logger = setup_logger()
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class _PrefixedStream(io.RawIOBase):
+    """把已经读出的头部字节接回原始流前面，用于在不可seek的流上探测gzip"""
+
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.head:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(b))
+        if not data:
+            return 0
+        b[: len(data)] = data
+        return len(data)
+
+
+def open_reader(stream):
+    """返回按行读取的二进制流，自动识别gzip压缩"""
+    head = stream.read(2)
+    reader = io.BufferedReader(_PrefixedStream(head, stream))
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=reader, mode="rb")
+    return reader
+
+
+def iter_ndjson(stream):
+    """逐行解析NDJSON，跳过空行和无法解析的行"""
+    for line_no, line in enumerate(open_reader(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logger.error(f"第{line_no}行不是合法的JSON，已跳过")
+
+
+def iter_ndjson_lines(records, compress: bool = False):
+    """把记录编码为NDJSON字节块，compress为True时输出gzip流"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if compressor:
+            line = compressor.compress(line)
+            if not line:
+                continue
+        yield line
+    if compressor:
+        yield compressor.flush()
+
+
+def export_accounts(channels_helper, path: str, compress: bool = None) -> int:
+    """导出全部账号到文件，后缀为.gz时默认压缩"""
+    if compress is None:
+        compress = path.endswith(".gz")
+    count = 0
+
+    def counted():
+        nonlocal count
+        for record in channels_helper.iter_records():
+            count += 1
+            yield record
+
+    with open(path, "wb") as f:
+        for chunk in iter_ndjson_lines(counted(), compress):
+            f.write(chunk)
+    logger.info(f"已导出{count}个账号到{path}")
+    return count
+
+
+def import_accounts(channels_helper, path: str) -> dict:
+    """从NDJSON文件（可gzip压缩）批量导入账号"""
+    with open(path, "rb") as f:
+        result = channels_helper.import_records(iter_ndjson(f))
+    logger.info(f"已从{path}导入账号: {result}")
+    return result
+
@@ -0,0 +1,172 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 入站准入控制。连接数由监听器的greenlet池限制，请求按路由分类进入各自的隔离舱（bulkhead），
+# 普通转发流量排满时不会占用登录相关路由的名额；排队超时直接返回503，不让请求无限堆积。
+
+import json
+import time
+from collections import deque
+
+from gevent import pywsgi
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+
+from envmgr import genv
+from logutil import setup_logger
+
+# 各类路由同时处理的请求数和最长排队时间（秒），可通过genv的ADMISSION_LIMITS覆盖，格式同此
+DEFAULT_LIMITS = {
+    "login": {"limit": 32, "queue_timeout": 5},
+    "qrpoll": {"limit": 32, "queue_timeout": 5},
+    "admin": {"limit": 16, "queue_timeout": 2},
+    "proxy": {"limit": 64, "queue_timeout": 0.5},
+}
+# 监听器同时处理的连接数，可通过genv的MAX_CONNECTIONS覆盖
+DEFAULT_MAX_CONNECTIONS = 256
+# 客户端连接读写超时（秒），防止慢客户端长期占用连接，可通过genv的CLIENT_TIMEOUT覆盖
+DEFAULT_CLIENT_TIMEOUT = 30
+
+LOGIN_PREFIXES = (
+    "/mpay/api/qrcode/",
+    "/mpay/api/users/login/",
+)
+
+
+# 二维码状态查询单独一类：开启长轮询时请求会挂起到截止时间，不能占用exchange_token等登录路由的名额
+QR_POLL_PATH = "/mpay/api/qrcode/query"
+
+
+def classify(path: str) -> str:
+    if path == QR_POLL_PATH:
+        return "qrpoll"
+    if path.startswith(LOGIN_PREFIXES):
+        return "login"
+    if path.startswith("/_idv-login/"):
+        return "admin"
+    return "proxy"
+
+
+class Bulkhead:
+    def __init__(self, name: str, limit: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._slots = BoundedSemaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.peak = 0
+        self.admitted = 0
+        self.shed = 0
+        self._queue_times = deque(maxlen=500)
+
+    def acquire(self) -> bool:
+        start = time.time()
+        self.waiting += 1
+        try:
+            ok = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            self.waiting -= 1
+        self._queue_times.append(time.time() - start)
+        if not ok:
+            self.shed += 1
+            return False
+        self.admitted += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        waits = sorted(self._queue_times)
+        return {
+            "limit": self.limit,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "peak": self.peak,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "queue_ms_p50": round(waits[len(waits) // 2] * 1000, 2) if waits else 0,
+            "queue_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 2) if waits else 0,
+            "queue_ms_max": round(waits[-1] * 1000, 2) if waits else 0,
+        }
+
+
+class AdmissionController:
+    def __init__(self):
+        self.logger = setup_logger()
+        self._bulkheads = {}
+        self.pool = None
+
+    def bulkhead(self, kind: str) -> Bulkhead:
+        if kind not in self._bulkheads:
+            config = dict(DEFAULT_LIMITS.get(kind, DEFAULT_LIMITS["proxy"]))
+            config.update(genv.get("ADMISSION_LIMITS", {}).get(kind, {}))
+            self._bulkheads[kind] = Bulkhead(kind, int(config["limit"]), float(config["queue_timeout"]))
+        return self._bulkheads[kind]
+
+    def middleware(self, wsgi_app):
+        """包装WSGI应用，按路由分类限流。名额在应用返回响应后释放，流式响应的发送过程不占名额"""
+
+        def app(environ, start_response):
+            bulkhead = self.bulkhead(classify(environ.get("PATH_INFO", "")))
+            if not bulkhead.acquire():
+                self.logger.warning(f"{bulkhead.name}类请求排队超时，拒绝 {environ.get('PATH_INFO', '')}")
+                body = json.dumps({"error": "服务繁忙，请稍后重试"}, ensure_ascii=False).encode()
+                start_response(
+                    "503 Service Unavailable",
+                    [("Content-Type", "application/json"), ("Content-Length", str(len(body))), ("Retry-After", "1")],
+                )
+                return [body]
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                bulkhead.release()
+
+        return app
+
+    def server_options(self) -> dict:
+        """WSGIServer的spawn和handler_class参数。greenlet池满了之后暂停accept，新连接留在系统的监听队列里"""
+        self.pool = Pool(int(genv.get("MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)))
+        ClientTimeoutHandler.timeout = float(genv.get("CLIENT_TIMEOUT", DEFAULT_CLIENT_TIMEOUT))
+        return {"spawn": self.pool, "handler_class": ClientTimeoutHandler}
+
+    def stats(self) -> dict:
+        for kind in DEFAULT_LIMITS:
+            self.bulkhead(kind)
+        result = {"bulkheads": {kind: item.stats() for kind, item in self._bulkheads.items()}}
+        if self.pool is not None:
+            result["connections"] = {"limit": self.pool.size, "active": len(self.pool), "free": self.pool.free_count()}
+        return result
+
+
+class ClientTimeoutHandler(pywsgi.WSGIHandler):
+    """给客户端连接设置读写超时，慢客户端或空闲的长连接到时断开"""
+
+    timeout = DEFAULT_CLIENT_TIMEOUT
+
+    def handle(self):
+        self.socket.settimeout(self.timeout)
+        return super().handle()
+
+
+controller = AdmissionController()
@@ -0,0 +1,257 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 上游请求录制。把代理转发和渠道SDK发出的请求连同响应、耗时一起写入NDJSON归档（.gz结尾时压缩），
+# 写入前去掉cookie、token、密码等敏感字段和URL路径里的账号/设备ID；无法按字段脱敏的纯文本只保存哈希和长度。
+# 归档供bench/replay_server.py离线回放。
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import compressutil
+from envmgr import genv
+from logutil import setup_logger
+
+FORMAT_VERSION = 1
+REDACTED = "***"
+# 值需要脱敏的请求头/响应头
+SENSITIVE_HEADERS = ("cookie", "set-cookie", "authorization", "proxy-authorization")
+# 键名匹配时脱敏的查询参数、表单字段和JSON字段
+SENSITIVE_KEY = re.compile(
+    r"token|ticket|passw|pwd|secret|session|cookie|sign|auth|sauth|code|openid|unionid|phone|mobile|email|udid|deviceid",
+    re.IGNORECASE,
+)
+# 路径里跟在这些段后面的一段是账号、设备等ID
+ID_PARENT_SEGMENTS = ("devices", "users", "user", "accounts")
+# 看起来像ID的路径段：长数字、长十六进制串、长的token式字符串
+ID_SEGMENT = re.compile(r"^(\d{6,}|[0-9a-fA-F]{16,}|[\w\-.=]{24,})$")
+# 表单字段名，不符合的文本不按表单解析
+FORM_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_\-\[\]]{0,31}$")
+# 带=填充的base64（例如SAUTH），看起来像只有一个字段的表单
+BASE64_TEXT = re.compile(r"^[A-Za-z0-9+/_\-.]+={1,2}$")
+
+
+def redact_pairs(pairs) -> list:
+    return [(k, REDACTED if SENSITIVE_KEY.search(k) else v) for k, v in pairs]
+
+
+def redact_path(path: str) -> str:
+    """把路径里的账号、设备ID换成占位符，回放服务器匹配请求前做同样的处理"""
+    segments = path.split("/")
+    for i, segment in enumerate(segments):
+        if not segment:
+            continue
+        if (i > 0 and segments[i - 1].lower() in ID_PARENT_SEGMENTS) or ID_SEGMENT.match(segment):
+            segments[i] = REDACTED
+    return "/".join(segments)
+
+
+def redact_url(url: str) -> str:
+    parsed = urlparse(url)
+    parsed = parsed._replace(path=redact_path(parsed.path))
+    if parsed.query:
+        parsed = parsed._replace(query=urlencode(redact_pairs(parse_qsl(parsed.query, keep_blank_values=True))))
+    return urlunparse(parsed)
+
+
+def redact_json(value):
+    if isinstance(value, dict):
+        # 只处理字符串值，数字类型的code/status之类的状态码保留
+        return {k: REDACTED if isinstance(v, str) and v and SENSITIVE_KEY.search(k) else redact_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_json(i) for i in value]
+    return value
+
+
+def redact_headers(headers) -> list:
+    items = headers.items() if hasattr(headers, "items") else headers
+    return [(k, REDACTED if k.lower() in SENSITIVE_HEADERS else v) for k, v in items]
+
+
+def _is_form(text: str) -> bool:
+    if "=" not in text or " " in text or "\n" in text or BASE64_TEXT.match(text):
+        return False
+    pairs = parse_qsl(text, keep_blank_values=True)
+    return bool(pairs) and all(FORM_KEY.match(k) for k, _ in pairs)
+
+
+def encode_body(body, keep_text: bool = False) -> dict:
+    """脱敏后的请求/响应体。JSON和表单按字段脱敏，二进制用base64。
+    其他文本（例如base64的SAUTH、纯文本返回的会话）无法按字段脱敏，只保存哈希和长度，keep_text为True时原样保存"""
+    if body is None or body == b"" or body == "":
+        return {"text": ""}
+    if isinstance(body, dict):
+        return {"form": redact_pairs(body.items())}
+    if isinstance(body, str):
+        body = body.encode()
+    try:
+        text = body.decode()
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode()}
+    try:
+        return {"json": redact_json(json.loads(text))}
+    except ValueError:
+        pass
+    if _is_form(text):
+        return {"form": redact_pairs(parse_qsl(text, keep_blank_values=True))}
+    if keep_text:
+        return {"text": text}
+    return {"redacted": {"sha256": hashlib.sha256(body).hexdigest(), "length": len(body)}}
+
+
+def decode_body(item: dict) -> bytes:
+    """归档里的请求/响应体还原成字节"""
+    if "json" in item:
+        return json.dumps(item["json"], ensure_ascii=False).encode()
+    if "form" in item:
+        return urlencode(item["form"]).encode()
+    if "base64" in item:
+        return base64.b64decode(item["base64"])
+    if "redacted" in item:
+        # 内容没有保存，用同样长度的占位内容，保持回放时的传输量
+        return b"*" * item["redacted"]["length"]
+    return item.get("text", "").encode()
+
+
+def load_archive(path: str) -> list:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def archive_hosts(records) -> list:
+    return sorted({urlparse(i["url"]).hostname for i in records if urlparse(i["url"]).hostname})
+
+
+def new_archive_path(directory: str) -> str:
+    """在录制目录下按当前时间生成新的归档文件名"""
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime("capture-%Y%m%d-%H%M%S") + ".ndjson.gz")
+
+
+class CaptureRecorder:
+    def __init__(self):
+        self.logger = setup_logger()
+        self.path = ""
+        self.count = 0
+        self.started_at = 0
+        self._file = None
+
+    @property
+    def active(self) -> bool:
+        return self._file is not None
+
+    def start(self, path: str):
+        self.stop()
+        opener = gzip.open if path.endswith(".gz") else open
+        self._file = opener(path, "at", encoding="utf-8")
+        self.path = path
+        self.count = 0
+        self.started_at = time.time()
+        self.logger.info(f"开始录制上游请求 -> {path}")
+
+    def stop(self) -> int:
+        if self._file is None:
+            return 0
+        self._file.close()
+        self._file = None
+        self.logger.info(f"录制结束，共{self.count}条 -> {self.path}")
+        return self.count
+
+    def record(self, source: str, method: str, url: str, req_headers, req_body, status: int, resp_headers, resp_body, elapsed: float):
+        """记录一次上游请求。未开始录制时直接返回。
+        纯文本只对genv的CAPTURE_TEXT_HOSTS（域名列表，默认为空）里的域名原样保存"""
+        if self._file is None:
+            return
+        try:
+            keep_text = urlparse(url).hostname in genv.get("CAPTURE_TEXT_HOSTS", [])
+            resp_headers = list(resp_headers.items() if hasattr(resp_headers, "items") else resp_headers)
+            encoding = dict((k.lower(), v) for k, v in resp_headers).get("content-encoding", "")
+            if encoding and isinstance(resp_body, bytes):
+                # 保存解压后的内容，回放时按客户端的Accept-Encoding决定是否压缩
+                resp_body = compressutil.decode(resp_body, encoding)
+                resp_headers = [(k, v) for k, v in resp_headers if k.lower() != "content-encoding"]
+            item = {
+                "v": FORMAT_VERSION,
+                "time": round(time.time(), 3),
+                "source": source,
+                "method": method.upper(),
+                "url": redact_url(url),
+                "request": {"headers": redact_headers(req_headers or {}), "body": encode_body(req_body, keep_text)},
+                "response": {
+                    "status": status,
+                    "headers": redact_headers(resp_headers),
+                    "body": encode_body(resp_body, keep_text),
+                },
+                "elapsed": round(elapsed, 4),
+            }
+            self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.count += 1
+        except Exception:
+            self.logger.exception(f"录制请求失败: {method} {url}")
+
+    def status(self) -> dict:
+        return {"active": self.active, "path": self.path, "count": self.count, "started_at": int(self.started_at)}
+
+
+def _on_http_response(resp, elapsed: float):
+    """渠道SDK请求（httpclient）的录制回调。requests已经解压过响应体，去掉Content-Encoding"""
+    if not recorder.active:
+        return
+    headers = [(k, v) for k, v in resp.headers.items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+    request = resp.request
+    recorder.record("sdk", request.method, request.url, request.headers, request.body, resp.status_code, headers, resp.content, elapsed)
+
+
+def install():
+    import httpclient
+
+    httpclient.client.response_hooks.append(_on_http_response)
+
+
+def route_hosts(hosts, ip: str, port: int):
+    """通过代理的DNS劫持把这些域名的443端口指向回放服务器"""
+    from proxymgr import add_custom_dns
+
+    for host in hosts:
+        add_custom_dns(host, 443, ip, target_port=port)
+
+
+def use_replay_server(address: str, extra_hosts=()) -> str:
+    """把回放服务器（bench/replay_server.py）归档里的域名和extra_hosts都指向它，返回回放服务器的IP"""
+    import requests
+
+    host, port = address.rsplit(":", 1)
+    ip = socket.gethostbyname(host)
+    # 回放服务器的证书只签发给归档里的域名，按IP访问时不校验
+    resp = requests.get(f"https://{ip}:{port}/_replay/hosts", verify=False, timeout=5)
+    hosts = set(resp.json()["hosts"]) | set(extra_hosts)
+    route_hosts(hosts, ip, int(port))
+    setup_logger().warning(f"离线回放模式: {len(hosts)}个上游域名指向 {ip}:{port}")
+    return ip
+
+
+recorder = CaptureRecorder()
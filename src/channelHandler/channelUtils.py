@@ -6,6 +6,7 @@ import hashlib
 import time
 import requests
 import pyperclip as cb
+import httpclient
 from envmgr import genv
 import gevent
 
@@ -16,9 +17,12 @@ class CustomEncoder(json.JSONEncoder):
 
 
 def _get_my_ip():
-        #get my IP
+    #优先使用后台刷新的公网IP缓存，避免登录路径上多一次网络请求
+    provider = genv.get("IP_PROVIDER")
+    if provider is not None:
+        return provider.get_ip()
     try:
-        return requests.get("https://who.nie.netease.com/").json.get("ip")
+        return requests.get("https://who.nie.netease.com/", timeout=3).json().get("ip")
     except Exception as e:
         return "127.0.0.1"
 
@@ -61,19 +65,84 @@ def buildSAUTH(login_channel, app_channel,uid,session,game_id,sdk_version,custom
     return data
 
 
+_plain_encoder = json.JSONEncoder()
+
+
+def encode_escaped(obj) -> str:
+    """与CustomEncoder输出一致。'/'只可能出现在JSON字符串中，复用同一个编码器并对结果做一次替换"""
+    return _plain_encoder.encode(obj).replace('/', '\\/')
+
+
+_timing_hooks = []
+
+
+def add_timing_hook(hook):
+    """注册SAUTH耗时回调，参数为(game_id, stage, 耗时秒数)"""
+    _timing_hooks.append(hook)
+
+
+class SAUTHClient:
+    """单个游戏的uni_sauth客户端，预先计算好签名前缀和HMAC，走共享的httpclient连接池"""
+
+    USER_AGENT = "Dalvik/2.1.0 (Linux; U; Android 12; M2102K1AC Build/V417IR)"
+
+    def __init__(self, game_id, key, timeout=(5, 15)):
+        self.game_id = game_id
+        self.url = f"https://mgbsdk.matrix.netease.com/{game_id}/sdk/uni_sauth"
+        self.timeout = timeout
+        self.sign_prefix = get_sign_src("POST", self.url, "").encode()
+        self._hmac = hmac.new(key.encode(), digestmod=hashlib.sha256)
+        self.headers = {
+            "Content-Type": "application/json",
+            "User-Agent": self.USER_AGENT,
+        }
+        self.hooks = []
+
+    def sign(self, body: str) -> str:
+        h = self._hmac.copy()
+        h.update(self.sign_prefix)
+        h.update(body.encode())
+        return h.hexdigest()
+
+    def _emit(self, stage, start):
+        elapsed = time.perf_counter() - start
+        for hook in _timing_hooks + self.hooks:
+            try:
+                hook(self.game_id, stage, elapsed)
+            except Exception:
+                pass
+        return time.perf_counter()
+
+    def post(self, data, need_custom_encode=False):
+        start = time.perf_counter()
+        body = encode_escaped(data) if need_custom_encode else json.dumps(data)
+        headers = dict(self.headers)
+        headers["X-Client-Sign"] = self.sign(body)
+        start = self._emit("sign", start)
+        # uni_sauth是POST，httpclient只会在连接阶段失败（请求还未发出）时重试
+        r = httpclient.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        start = self._emit("post", start)
+        res = r.json()
+        self._emit("parse", start)
+        return res
+
+
+_sauth_clients = {}
+
+
+def get_sauth_client(game_id) -> SAUTHClient:
+    client = _sauth_clients.get(game_id)
+    if client is None:
+        key = genv.get("CLOUD_RES").get_by_game_id_and_key(game_id, "log_key")
+        if key is None:
+            raise Exception(f"游戏{game_id}缺少log_key，暂不支持")
+        client = SAUTHClient(game_id, key)
+        _sauth_clients[game_id] = client
+    return client
+
+
 def postSignedData(data,game_id,need_custom_encode=False):
-    url=f"https://mgbsdk.matrix.netease.com/{game_id}/sdk/uni_sauth"
-    method="POST"
-    key=genv.get("CLOUD_RES").get_by_game_id_and_key(game_id,"log_key")
-    if need_custom_encode:
-        data=json.dumps(data,cls=CustomEncoder)
-    else:
-        data=json.dumps(data)
-    headers={"X-Client-Sign":calcSign(url,method,data,key),
-             "Content-Type":"application/json",
-             "User-Agent":"Dalvik/2.1.0 (Linux; U; Android 12; M2102K1AC Build/V417IR)",}
-    r=requests.post(url,data=data,headers=headers)
-    return r.json()
+    return get_sauth_client(game_id).post(data, need_custom_encode)
 
 def getShortGameId(game_id):
     return game_id.split("-")[-1]
@@ -26,6 +26,8 @@ from logutil import setup_logger
 from channelHandler.channelUtils import getShortGameId
 from channelHandler.huaLogin.huaChannel import HuaweiLogin
 
+#getGameAuthSign的签名带时间戳，只短时间复用
+SESSION_TTL = 300
 
 class huaweiLoginResponse:
     def __init__(self, rawJson: dict) -> None:
@@ -54,6 +56,8 @@ class huaweiChannel(channelmgr.channel):
         name: str = "",
         refreshToken: str = "",
         game_id: str = "",
+        accessToken: str = None,
+        expiredTime: int = 0,
     ) -> None:
         super().__init__(
             login_info,
@@ -65,6 +69,8 @@ class huaweiChannel(channelmgr.channel):
             name,
         )
         self.refreshToken = refreshToken
+        self.accessToken = accessToken
+        self.expiredTime = expiredTime
         self.logger = setup_logger()
         self.crossGames = True
         # To DO: Use Actions to auto update game_id-app_id mapping by uploading an APK.
@@ -78,7 +84,7 @@ class huaweiChannel(channelmgr.channel):
             self.logger.error(f"Failed to get channel config for {self.name}")
             Exception(f"游戏{real_game_id}-渠道{self.channel_name}暂不支持，请参照教程联系开发者发起添加请求。")
             return
-        self.huaweiLogin = HuaweiLogin(res.get(self.channel_name), self.refreshToken)
+        self.huaweiLogin = HuaweiLogin(res.get(self.channel_name), self.refreshToken, self.accessToken, self.expiredTime)
         self.realGameId = real_game_id
         self.uniBody = None
         self.uniData = None
@@ -86,12 +92,18 @@ class huaweiChannel(channelmgr.channel):
 
     def request_user_login(self):
         genv.set("GLOB_LOGIN_UUID", self.uuid)
+        self.invalidate_credential()
         self.huaweiLogin.newOAuthLogin()
         self.refreshToken = self.huaweiLogin.refreshToken
         self.logger.debug(self.refreshToken)
         return self.refreshToken != None
 
     def _get_session(self):
+        cached = self.get_cached_credential("gameAuthSign")
+        if cached:
+            self.huaweiLogin.accessToken = cached["accessToken"]
+            self.session = huaweiLoginResponse(cached["data"])
+            return self.session
         try:
             data = self.huaweiLogin.initAccountData()
             res = huaweiLoginResponse(data)
@@ -101,8 +113,38 @@ class huaweiChannel(channelmgr.channel):
             self.refreshToken = None
             return None
         self.session = res
+        self.cache_credential(
+            "gameAuthSign", {"data": data, "accessToken": self.huaweiLogin.accessToken}, SESSION_TTL
+        )
         return res
 
+    def needs_refresh(self, within):
+        # 只有access_token真的将要过期时才需要刷新，gameAuthSign的缓存时间不代表凭证过期
+        if self.refreshToken is None or getattr(self, "huaweiLogin", None) is None:
+            return False
+        return self.huaweiLogin.expiredTime - int(time.time()) <= within
+
+    def refresh_credentials(self):
+        if self.refreshToken is None:
+            return False
+        if int(time.time()) >= self.huaweiLogin.expiredTime and not self.huaweiLogin.refreshAccessToken():
+            return False
+        # 后台刷新失败时保留refreshToken，网络错误不应让用户重新授权
+        try:
+            data = self.huaweiLogin.initAccountData()
+            res = huaweiLoginResponse(data)
+        except Exception as e:
+            self.logger.warning(f"后台刷新{self.name}的gameAuthSign失败 {e}")
+            return False
+        if not res.gameAuthSign:
+            self.logger.warning(f"后台刷新{self.name}的gameAuthSign失败 {data}")
+            return False
+        self.session = res
+        self.cache_credential(
+            "gameAuthSign", {"data": data, "accessToken": self.huaweiLogin.accessToken}, SESSION_TTL
+        )
+        return True
+
     def is_token_valid(self):
         if self.refreshToken is None:
             self.logger.info(f"Token is invalid for {self.name}")
@@ -121,8 +163,19 @@ class huaweiChannel(channelmgr.channel):
             name=data.get("name", ""),
             refreshToken=data.get("refreshToken", None),
             game_id=data.get("game_id", ""),
+            accessToken=data.get("accessToken", None),
+            expiredTime=data.get("expiredTime", 0),
         )
 
+    def before_save(self):
+        huaweiLogin = getattr(self, "huaweiLogin", None)
+        if huaweiLogin is not None:
+            self.accessToken = huaweiLogin.accessToken
+            self.expiredTime = huaweiLogin.expiredTime
+            if self.refreshToken is not None:
+                self.refreshToken = huaweiLogin.refreshToken
+        return super().before_save()
+
     def _build_extra_unisdk_data(self) -> str:
         fd = genv.get("FAKE_DEVICE")
         res = {
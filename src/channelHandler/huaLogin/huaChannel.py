@@ -5,7 +5,7 @@ import random
 import string
 import time
 import gevent
-import requests
+import httpclient
 import sys
 from faker import Faker
 import random
@@ -212,16 +212,16 @@ class HuaweiBrowser(WebBrowser):
 
 class HuaweiLogin:
 
-    def __init__(self, channelConfig, refreshToken=None):
+    def __init__(self, channelConfig, refreshToken=None, accessToken=None, expiredTime=0):
 
         os.chdir(os.path.join(os.environ["PROGRAMDATA"], "idv-login"))
         #self.logger = setup_logger()
         self.channelConfig = channelConfig
         self.refreshToken = refreshToken
-        self.accessToken=None
+        self.accessToken=accessToken
         self.code_verifier=None
         self.lastLoginTime = 0
-        self.expiredTime = 0
+        self.expiredTime = expiredTime
         if os.path.exists(DEVICE_RECORD):
             with open(DEVICE_RECORD, "r") as f:
                 self.device = json.load(f)
@@ -276,10 +276,32 @@ class HuaweiLogin:
         code=code.replace(" ","+")
         token_response = exchange_code_for_token(client_id, code, self.code_verifier, redirect_uri)
         self.refreshToken = token_response.get("refresh_token")
+        self.applyTokenResponse(token_response)
+
+    def applyTokenResponse(self, token_response):
+        #刷新授权时服务端不一定下发新的refresh_token
+        self.refreshToken = token_response.get("refresh_token", self.refreshToken)
         self.lastLoginTime=int(time.time())
         self.expiredTime=self.lastLoginTime+token_response.get("expires_in")
         self.accessToken=token_response.get("access_token")
 
+    def refreshAccessToken(self) -> bool:
+        """用refresh_token静默换取新的access_token，被拒绝时返回False"""
+        if self.refreshToken == None:
+            return False
+        logger = setup_logger()
+        try:
+            token_response = get_access_token(str(self.channelConfig["app_id"]), None, self.refreshToken)
+        except Exception as e:
+            logger.error(f"华为刷新access_token失败: {e}")
+            return False
+        if "access_token" not in token_response:
+            logger.warning(f"华为refresh_token已失效: {token_response}")
+            return False
+        self.applyTokenResponse(token_response)
+        logger.info("华为access_token已通过refresh_token刷新")
+        return True
+
 
     def initAccountData(self) -> object:
         if self.refreshToken == None:
@@ -288,7 +310,7 @@ class HuaweiLogin:
         #we dont know client secret lol.
         #get now time
         now=int(time.time())
-        if now>=self.expiredTime:
+        if now>=self.expiredTime and not self.refreshAccessToken():
             self.newOAuthLogin()
         if self.accessToken==None:
             return None
@@ -306,5 +328,5 @@ class HuaweiLogin:
         body["extraBody"] = f'json={{"appId":"{str(self.channelConfig["app_id"])}"}}'
         body["accessToken"]=self.accessToken
 
-        response = requests.post(url, headers=headers, data=body)
+        response = httpclient.post(url, headers=headers, data=body)
         return response.json()
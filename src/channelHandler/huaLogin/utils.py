@@ -1,5 +1,5 @@
 from Crypto.Cipher import AES
-import requests
+import httpclient
 import base64
 import hashlib
 import uuid
@@ -46,7 +46,7 @@ def exchange_code_for_token(client_id, code, code_verifier, redirect_uri):
     }
 
     # 发送POST请求获取Token
-    response = requests.post(token_url, headers=headers, data=data)
+    response = httpclient.post(token_url, headers=headers, data=data)
     return response.json()
 
 def get_access_token(client_id, client_secret, refresh_token):
@@ -64,6 +64,6 @@ def get_access_token(client_id, client_secret, refresh_token):
         "refresh_token": refresh_token
     }
     
-    response = requests.post(token_url, headers=headers, data=data)
+    response = httpclient.post(token_url, headers=headers, data=data)
     
     return response.json()
\ No newline at end of file
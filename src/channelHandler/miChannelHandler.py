@@ -25,6 +25,8 @@ from logutil import setup_logger
 from channelHandler.miLogin.miChannel import MiLogin
 from channelHandler.channelUtils import getShortGameId
 
+#getLoginAppAccount_v2返回的session缓存时间（秒）
+SESSION_TTL = 1800
 
 class miChannel(channelmgr.channel):
     def __init__(
@@ -73,6 +75,7 @@ class miChannel(channelmgr.channel):
 
     def request_user_login(self):
         genv.set("GLOB_LOGIN_UUID", self.uuid)
+        self.invalidate_credential()
         self.miLogin.webLogin()
         self.oAuthData = self.miLogin.oauthData
         self.account_type = self.miLogin.account_type
@@ -81,14 +84,34 @@ class miChannel(channelmgr.channel):
         return self.oAuthData != None
 
     def _get_session(self):
+        cached = self.get_cached_credential("session")
+        if cached:
+            return cached["appAccountId"], cached["session"]
         try:
             data = self.miLogin.initAccountData()
         except Exception as e:
             self.logger.error(f"Failed to get session data {e}")
             self.oAuthData = None
             return None, None
+        self.cache_credential(
+            "session", {"appAccountId": data["appAccountId"], "session": data["session"]}, SESSION_TTL
+        )
         return data["appAccountId"], data["session"]
 
+    def refresh_credentials(self):
+        if self.oAuthData is None:
+            return False
+        # 后台刷新失败（网络错误、上游5xx）时保留oAuthData，不能让用户因此重新授权
+        try:
+            data = self.miLogin.initAccountData()
+        except Exception as e:
+            self.logger.warning(f"后台刷新{self.name}的会话失败 {e}")
+            return False
+        self.cache_credential(
+            "session", {"appAccountId": data["appAccountId"], "session": data["session"]}, SESSION_TTL
+        )
+        return True
+
     def is_token_valid(self):
         if self.oAuthData is None:
             self.logger.info(f"Token is invalid for {self.name}")
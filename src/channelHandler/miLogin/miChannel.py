@@ -4,7 +4,7 @@ import random
 import string
 import time
 import channelHandler.miLogin.utils as utils
-import requests
+import httpclient
 import sys
 from faker import Faker
 import random
@@ -112,12 +112,11 @@ class MiLogin:
         params.update(self.device)
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
-            "Connection": "close",
             "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 12; M2102K1AC Build/V417IR)",
             "Host": "account.migc.g.mi.com",
             "Accept-Encoding": "gzip",
         }
-        response = requests.post(
+        response = httpclient.post(
             "http://account.migc.g.mi.com/migc-sdk-account/getLoginAppAccount_v2",
             data=utils.generate_unsign_request(params, AES_KEY),
             headers=headers,
@@ -140,12 +139,11 @@ class MiLogin:
         self.logger.info(params)
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
-            "Connection": "close",
             "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 12; M2102K1AC Build/V417IR)",
             "Host": "account.migc.g.mi.com",
             "Accept-Encoding": "gzip",
         }
-        response = requests.get(
+        response = httpclient.get(
             "http://account.migc.g.mi.com/misdk/v2/oauth",
             params=utils.generate_unsign_request(params, AES_KEY),
             headers=headers,
@@ -171,12 +169,11 @@ class MiLogin:
 
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
-            "Connection": "close",
             "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 12; M2102K1AC Build/V417IR)",
             "Host": "account.migc.g.mi.com",
             "Accept-Encoding": "gzip",
         }
-        response = requests.get(
+        response = httpclient.get(
             "http://account.migc.g.mi.com/misdk/v2/oauth",
             params=utils.generate_unsign_request(params, AES_KEY),
             headers=headers,
@@ -1,7 +1,7 @@
 import hashlib
 import hmac
 import json
-import requests
+import httpclient
 from urllib.parse import urlencode
 from Crypto.Cipher import AES
 import base64
@@ -66,7 +66,6 @@ def generate_unsign_request(params, AES_KEY):
 def post_request(url, params, miAppEntry, AES_KEY):
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
-        "Connection": "close",
         "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 12; M2102K1AC Build/V417IR)",
         "Host": "account.migc.g.mi.com",
         "Accept-Encoding": "gzip",
@@ -75,7 +74,7 @@ def post_request(url, params, miAppEntry, AES_KEY):
     data = generate_request(params, miAppEntry, AES_KEY)
     encoded_data = urlencode(data)
 
-    response = requests.post(url, headers=headers, data=encoded_data)
+    response = httpclient.post(url, headers=headers, data=encoded_data)
     return response.text
 
 
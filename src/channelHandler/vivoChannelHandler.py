@@ -26,6 +26,9 @@ from logutil import setup_logger
 from channelHandler.channelUtils import getShortGameId
 from channelHandler.vivoLogin.vivoChannel import VivoLogin
 
+#小号openToken缓存时间（秒），重启后无需重新登录小号
+OPEN_TOKEN_TTL = 1800
+
 class vivoSubAccount:
     def __init__(self, data: dict) -> None:
         self.nickName = data.get("nickName", "默认帐号")
@@ -94,6 +97,7 @@ class vivoChannel(channelmgr.channel):
 
     def request_user_login(self):
         genv.set("GLOB_LOGIN_UUID", self.uuid)
+        self.invalidate_credential()
         resp=self.vivoLogin.webLogin()
         self.logger.debug(resp)
         if resp==None:
@@ -127,12 +131,32 @@ class vivoChannel(channelmgr.channel):
             if self.session.subAccounts[i].subOpenId==self.chosenAccount:
                 self.activeAccount=self.session.subAccounts[i]
                 self.activeAccount.openToken=self.vivoLogin.loginSubAccount(self.activeAccount.subOpenId)
+                self.cache_credential(
+                    "openToken",
+                    {
+                        "nickName": self.activeAccount.nickName,
+                        "subOpenId": self.activeAccount.subOpenId,
+                        "openToken": self.activeAccount.openToken,
+                    },
+                    OPEN_TOKEN_TTL,
+                )
         self.uuid=f"{self.session.phone}-{self.activeAccount.nickName}"
         return self.session!=None
 
     def is_token_valid(self):
         return self.session!=None
 
+    def refresh_credentials(self):
+        # 小号登录需要用户在浏览器中操作，这里只能确认缓存的openToken是否还可用
+        return self.get_cached_credential("openToken") is not None
+
+    def _restore_cached_account(self):
+        cached = self.get_cached_credential("openToken")
+        if cached is None:
+            return False
+        self.activeAccount = vivoSubAccount(cached)
+        return True
+
     @classmethod
     def from_dict(cls, data: dict):
         return cls(
@@ -180,7 +204,7 @@ class vivoChannel(channelmgr.channel):
         self.logger.info(f"Get unisdk data for {self.name}")
         import channelHandler.channelUtils as channelUtils
 
-        if not self.is_token_valid():
+        if not self.is_token_valid() and not self._restore_cached_account():
             self.request_user_login()
 
         self.uniBody = channelUtils.buildSAUTH(
@@ -4,7 +4,7 @@ import random
 import string
 import time
 import channelHandler.miLogin.utils as utils
-import requests
+import httpclient
 import sys
 from faker import Faker
 import random
@@ -36,7 +36,7 @@ class VivoBrowser(WebBrowser):
         u = f"https://joint.vivo.com.cn/h5/union/get?gamePackage={self.gamePackage}"
         self.logger.info(u)
         try:
-            r = requests.get(u, cookies=self.cookies)
+            r = httpclient.get(u, cookies=self.cookies)
             self.result = r.json()
             return True
         except Exception as e:
@@ -84,7 +84,7 @@ class VivoLogin:
         header={
             "User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/105.0.0.0 Safari/537.36 Edg/105.0.1343.27"
         }
-        r = requests.post("https://joint.vivo.com.cn/h5/union/use",data=data,cookies=self.cookies,headers=header)
+        r = httpclient.post("https://joint.vivo.com.cn/h5/union/use",data=data,cookies=self.cookies,headers=header)
         try:
             resp=r.json()
             if resp.get("code") == 0:
@@ -20,7 +20,7 @@ import string
 import time
 import base64
 
-import requests
+import httpclient
 import channelmgr
 
 from envmgr import genv
@@ -28,6 +28,10 @@ from logutil import setup_logger
 from channelHandler.channelUtils import getShortGameId
 from channelHandler.wechatLogin.wechatChannel import WechatLogin
 
+#/sns/auth校验通过后，在这段时间内（且access_token未过期）不再重复校验
+AUTH_CHECK_TTL = 600
+#access_token剩余有效期不足该值时，后台刷新会提前换新
+REFRESH_BEFORE = 1800
 
 class myappVeriftResp:
     def __init__(self, rawJson: dict) -> None:
@@ -111,6 +115,7 @@ class wechatChannel(channelmgr.channel):
         self.session: myappVeriftResp = myappVeriftResp(session) if session != None else None
 
     def request_user_login(self):
+        self.invalidate_credential()
         if self.session == None:
             genv.set("GLOB_LOGIN_UUID", self.uuid)
             resp = self.wechatLogin.webLogin()
@@ -121,7 +126,7 @@ class wechatChannel(channelmgr.channel):
             #get user info
             #https://api.weixin.qq.com/sns/userinfo?access_token=ACCESS_TOKEN&openid=OPENID
             try:
-                r = requests.get(
+                r = httpclient.get(
                     f"https://api.weixin.qq.com/sns/userinfo?access_token={self.session.atk}&openid={self.session.openid}"
                 )
                 r.encoding="utf-8"
@@ -129,30 +134,60 @@ class wechatChannel(channelmgr.channel):
             except:
                 pass
         else:
-            self.logger.info(f"刷新 ac-token，当前时间: {int(time.time())}，过期时间: {self.last_login_time+self.session.atk_expire}")
-            r = requests.get(
-                f"https://api.weixin.qq.com/sns/oauth2/refresh_token?appid={self.wx_appid}&grant_type=refresh_token&refresh_token={self.session.rtk}"
-            )
-            if not r.status_code == 200:
-                self.logger.error(f"Refresh token 过期，疑似被顶号，重新唤起扫码登录。{r.text}")
+            if not self._refresh_token():
+                self.logger.error("Refresh token 过期，疑似被顶号，重新唤起扫码登录。")
                 self.session = None
                 return self.request_user_login()
-            self.session.rtk = r.json().get("refresh_token")
-            self.session.atk = r.json().get("access_token")
-            self.logger.info(f"微信刷新token返回：{r.json()}")
         if self.session!=None:
             self.last_login_time=int(time.time())
             return True
         return False
 
+    def _refresh_token(self):
+        """用refresh_token换取新的access_token，不需要用户操作"""
+        self.logger.info(f"刷新 ac-token，当前时间: {int(time.time())}，过期时间: {self.last_login_time+self.session.atk_expire}")
+        r = httpclient.get(
+            f"https://api.weixin.qq.com/sns/oauth2/refresh_token?appid={self.wx_appid}&grant_type=refresh_token&refresh_token={self.session.rtk}"
+        )
+        if not r.status_code == 200 or "access_token" not in r.json():
+            self.logger.error(f"微信刷新token失败：{r.text}")
+            return False
+        self.session.rtk = r.json().get("refresh_token")
+        self.session.atk = r.json().get("access_token")
+        self.session.atk_expire = r.json().get("expires_in", self.session.atk_expire)
+        self.logger.info(f"微信刷新token返回：{r.json()}")
+        return True
+
+    def needs_refresh(self, within):
+        if self.session == None:
+            return False
+        return self.last_login_time + self.session.atk_expire - int(time.time()) <= REFRESH_BEFORE + within
+
+    def refresh_credentials(self):
+        if self.session == None:
+            return False
+        if self.last_login_time + self.session.atk_expire - int(time.time()) > REFRESH_BEFORE:
+            return self.is_token_valid()
+        self.invalidate_credential()
+        if not self._refresh_token():
+            return False
+        self.last_login_time = int(time.time())
+        return True
+
     def is_token_valid(self):
         #	/sns/auth
         if self.session != None and self.last_login_time+self.session.atk_expire > int(time.time()):
-            r = requests.get(
+            if self.get_cached_credential("sns_auth"):
+                return True
+            r = httpclient.get(
                     f"https://api.weixin.qq.com/sns/auth?access_token={self.session.atk}&openid={self.session.openid}"
                 )
             self.logger.debug(r.json())
-            return r.json().get("errcode")==0
+            valid = r.json().get("errcode")==0
+            if valid:
+                remaining = self.last_login_time + self.session.atk_expire - int(time.time())
+                self.cache_credential("sns_auth", True, min(AUTH_CHECK_TTL, remaining))
+            return valid
         else:
             return False
 
@@ -1,8 +1,11 @@
 import base64
 import os
 import time
-import requests
 import gevent
+from gevent.event import Event
+from uuid import uuid4
+
+import httpclient
 
 from logutil import setup_logger
 
@@ -14,6 +17,170 @@ def sig_helper(magicValue="5C2F##3[6$^(68#%#D3E96;]35q#FB46",ts="1"):
     
 
 
+LONG_POLL_URL = "https://long.open.weixin.qq.com/connect/l/qrconnect"
+
+# 长轮询返回的wx_errcode
+WX_WAITING = 408
+WX_SCANNED = 404
+WX_CONFIRMED = 405
+WX_EXPIRED = 402
+WX_CANCELLED = 403
+
+_qr_sessions = {}
+
+
+class WechatQRSession:
+    """一次微信扫码登录。后台长轮询扫码状态，二维码过期自动刷新，有总超时，可取消"""
+
+    WAITING = "waiting"
+    SCANNED = "scanned"
+    CONFIRMED = "confirmed"
+    EXPIRED = "expired"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+    FINISHED_STATES = (CONFIRMED, EXPIRED, CANCELLED, FAILED)
+
+    def __init__(self, login, deadline: int = 300, max_refresh: int = 3):
+        self.logger = setup_logger()
+        self.id = uuid4().hex
+        self.login = login
+        self.deadline = deadline
+        self.max_refresh = max_refresh
+        self.state = self.WAITING
+        self.wx_uuid = ""
+        self.qrcode = ""
+        self.ts = ""
+        self.wx_code = ""
+        self.refreshes = 0
+        self.created_at = time.time()
+        self.finished_at = 0
+        self.listeners = []
+        self._done = Event()
+        self._greenlet = None
+
+    def start(self):
+        _purge_sessions()
+        _qr_sessions[self.id] = self
+        self._greenlet = gevent.spawn(self._run)
+        return self
+
+    def is_finished(self) -> bool:
+        return self.state in self.FINISHED_STATES
+
+    def wait(self, timeout=None) -> str:
+        """等待扫码结束，确认登录时返回wx_code，否则返回None"""
+        self._done.wait(timeout)
+        return self.wx_code if self.state == self.CONFIRMED else None
+
+    def cancel(self):
+        if self.is_finished():
+            return
+        if self._greenlet is not None:
+            self._greenlet.kill(block=False)
+        self._finish(self.CANCELLED)
+        self.logger.info(f"微信扫码登录{self.id}已取消")
+
+    def _finish(self, state: str):
+        if self.is_finished():
+            return
+        self.state = state
+        self.finished_at = time.time()
+        self._done.set()
+
+    def _new_qrcode(self) -> bool:
+        res = self.login.create_qrcode()
+        if res is None:
+            return False
+        self.wx_uuid, self.qrcode, self.ts = res
+        self.state = self.WAITING
+        for callback in list(self.listeners):
+            try:
+                callback(self)
+            except Exception:
+                self.logger.exception("二维码更新回调执行失败")
+        return True
+
+    def _run(self):
+        try:
+            with gevent.Timeout(self.deadline):
+                while True:
+                    if not self._new_qrcode():
+                        self._finish(self.FAILED)
+                        return
+                    state = self._poll()
+                    if state != self.EXPIRED:
+                        self._finish(state)
+                        return
+                    if self.refreshes >= self.max_refresh:
+                        self.logger.warning("微信二维码多次过期，放弃扫码登录")
+                        self._finish(self.EXPIRED)
+                        return
+                    self.refreshes += 1
+                    self.logger.info(f"微信二维码已过期，自动刷新({self.refreshes}/{self.max_refresh})")
+        except gevent.Timeout:
+            self.logger.warning(f"微信扫码登录超过{self.deadline}秒未完成")
+            self._finish(self.EXPIRED)
+        except Exception:
+            self.logger.exception("微信扫码登录异常")
+            self._finish(self.FAILED)
+
+    def _poll(self) -> str:
+        last = None
+        while True:
+            params = {"f": "json", "uuid": self.wx_uuid}
+            if last:
+                params["last"] = last
+            try:
+                # 服务端会挂起请求直到状态变化或约25秒超时
+                data = httpclient.get(LONG_POLL_URL, params=params, timeout=(5, 35)).json()
+            except Exception as e:
+                self.logger.debug(f"微信扫码状态查询失败: {e}")
+                gevent.sleep(1)
+                continue
+            errcode = data.get("wx_errcode")
+            if data.get("wx_code"):
+                self.wx_code = data.get("wx_code")
+                self.logger.info("微信扫码已确认")
+                return self.CONFIRMED
+            if errcode == WX_SCANNED:
+                if self.state != self.SCANNED:
+                    self.logger.info("微信已扫码，等待确认")
+                self.state = self.SCANNED
+                last = errcode
+            elif errcode == WX_EXPIRED:
+                return self.EXPIRED
+            elif errcode == WX_CANCELLED:
+                self.logger.info("用户在微信上取消了登录")
+                return self.CANCELLED
+            elif errcode != WX_WAITING:
+                gevent.sleep(1)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "qrcode": self.qrcode,
+            "refreshes": self.refreshes,
+            "created_at": int(self.created_at),
+            "expires_at": int(self.created_at + self.deadline),
+        }
+
+
+def _purge_sessions(keep: int = 600):
+    now = time.time()
+    for sid, session in list(_qr_sessions.items()):
+        if session.is_finished() and now - session.finished_at > keep:
+            _qr_sessions.pop(sid, None)
+
+
+def get_qr_session(sid: str):
+    return _qr_sessions.get(sid)
+
+
+def list_qr_sessions() -> list:
+    return [session.to_dict() for session in _qr_sessions.values()]
+
+
 class WechatLogin:
     def __init__(self,wx_appid,channel,refreshToken=""):
         os.chdir(os.path.join(os.environ["PROGRAMDATA"], "idv-login"))
@@ -22,7 +189,8 @@ class WechatLogin:
         self.channel=channel
         self.refreshToken = refreshToken
 
-    def webLogin(self):
+    def create_qrcode(self):
+        """申请新的扫码二维码，返回(uuid, 二维码base64, 时间戳)"""
         ts=str(int(time.time()*1000))
         qrcodeData = {
             "noncestr":"!!freeSoftwareDoNOTSell-idv-login!!"+ts,
@@ -34,7 +202,7 @@ class WechatLogin:
             "timestamp":ts
         }
         
-        r=requests.get(f"https://ysdk.qq.com/auth/wx_scan_code_login",params=qrcodeData)
+        r=httpclient.get(f"https://ysdk.qq.com/auth/wx_scan_code_login",params=qrcodeData)
         if not r.status_code==200 or not r.json()['ret']==0:
             self.logger.error(f"微信扫码请求创建失败: {r.text}")
             return None
@@ -43,7 +211,7 @@ class WechatLogin:
         rjson.pop("msg")
         rjson.pop("ret")
         #https://open.weixin.qq.com/connect/sdk/qrconnect
-        r=requests.get(f"https://open.weixin.qq.com/connect/sdk/qrconnect",params=rjson,
+        r=httpclient.get(f"https://open.weixin.qq.com/connect/sdk/qrconnect",params=rjson,
                        headers={"accept-encoding":"gzip",})
         #use utf-8
         r.encoding="utf-8"
@@ -51,26 +219,29 @@ class WechatLogin:
         #get qrcode img
         qrcode=r.json().get("qrcode").get("qrcodebase64")
         uuid=r.json().get("uuid")
+        return uuid, qrcode, ts
 
+    def _show_qrcode(self, session: WechatQRSession):
         with open("qrcode.png","wb") as f:
-            f.write(base64.b64decode(qrcode))
-        gevent.sleep(0.5)
+            f.write(base64.b64decode(session.qrcode))
         #不要阻塞
         import webbrowser
         webbrowser.open("qrcode.png")
 
+    def webLogin(self, deadline: int = 300):
+        session = WechatQRSession(self, deadline)
+        session.listeners.append(self._show_qrcode)
+        session.start()
+        code = session.wait()
+        if code is None:
+            self.logger.error(f"微信扫码登录未完成: {session.state}")
+            return None
+        self.logger.info(f"扫码成功{code}")
 
-        while True:
-            r=requests.get(f"https://long.open.weixin.qq.com/connect/l/qrconnect?f=json&uuid={uuid}")
-            print(r.text)
-            if r.json().get("wx_code") != "":
-                self.logger.info(f"扫码成功{r.json().get('wx_code')}")
-                break
-            gevent.sleep(1)
-
+        ts = session.ts
         verifyData={
             "channel":"00000000",
-            "code":r.json().get("wx_code"),
+            "code":code,
             "offerid":self.channel,
             "platform":"desktop_m_wechat",
             "client_hope_switch":"1",
@@ -81,7 +252,7 @@ class WechatLogin:
             "appid":self.wx_appid,
             "timestamp":ts
         }
-        r=requests.get("https://ysdk.qq.com/auth/wx_verify_code",params=verifyData)
+        r=httpclient.get("https://ysdk.qq.com/auth/wx_verify_code",params=verifyData)
         self.logger.debug(f"扫码校验结果: {r.text}")
         if not r.status_code==200 or not r.json()['ret']==0:
             self.logger.error(f"扫码校验失败: {r.text}")
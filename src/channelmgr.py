@@ -18,15 +18,33 @@
 
 import os
 import json
+import base64
+import bisect
 import random
 import time
+from contextlib import contextmanager
 
-import requests
+import gevent
 
+import httpclient
+import tracemgr
 from envmgr import genv
 from const import manual_login_channels
 from logutil import setup_logger
 
+try:
+    import fcntl
+except ImportError:
+    # Windows不支持多进程模式，只有一个进程写账号文件
+    fcntl = None
+
+# 扫码导入的账号登录时用到的ext_info字段，见channel.get_uniSdk_data
+IMPORTED_EXT_KEYS = ("src_app_channel2", "src_udid", "src_app_channel", "src_jf_game_id", "src_pay_channel", "extra_unisdk_data")
+
+
+class ScanRejected(Exception):
+    """上游拒绝了模拟扫码请求，通常是二维码还没就绪"""
+
 
 class channel:
     def __init__(
@@ -55,6 +73,8 @@ class channel:
         self.uuid = f"{login_info['login_channel']}-{login_info['code']}" if uuid == "" else uuid
         self.channel_name = login_info["login_channel"]
         self.crossGames = True
+        # 渠道SDK派生出的短期凭证: {名称: {"value": 凭证, "expires_at": 过期时间}}
+        self.credential_cache = {}
         if name == "":
             self.name = self.uuid
         else:
@@ -98,45 +118,114 @@ class channel:
             "name": self.name,
         }
 
+    def cache_credential(self, key: str, value, ttl: int):
+        self.credential_cache[key] = {"value": value, "expires_at": int(time.time()) + ttl}
+
+    def get_cached_credential(self, key: str, margin: int = 30):
+        """返回仍在有效期内的凭证，距过期不足margin秒视为已失效"""
+        entry = self.credential_cache.get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] - margin <= time.time():
+            del self.credential_cache[key]
+            return None
+        return entry["value"]
+
+    def invalidate_credential(self, key: str = None):
+        if key is None:
+            self.credential_cache.clear()
+        else:
+            self.credential_cache.pop(key, None)
+
+    def drop_expired_credentials(self):
+        now = time.time()
+        for key in [k for k, v in self.credential_cache.items() if v["expires_at"] <= now]:
+            del self.credential_cache[key]
+
+    def expiring_credentials(self, within: int) -> list:
+        """返回within秒内将要过期的凭证，[(名称, 过期时间)]。已过期的凭证直接丢弃"""
+        self.drop_expired_credentials()
+        deadline = time.time() + within
+        return sorted(
+            ((key, entry["expires_at"]) for key, entry in self.credential_cache.items() if entry["expires_at"] <= deadline),
+            key=lambda x: x[1],
+        )
+
+    def needs_refresh(self, within: int) -> bool:
+        """渠道的令牌是否将在within秒内过期。credential_cache只是本地缓存的有效期，不算在内，由有真实过期时间的渠道覆盖"""
+        return False
+
+    def refresh_credentials(self) -> bool:
+        """在后台静默刷新凭证，不允许弹出任何登录界面。返回False表示需要用户重新登录。
+        扫码导入的账号没有可刷新的渠道凭证，只能检查登录需要的数据是否完整"""
+        if not self.user_info.get("id") or not self.user_info.get("token"):
+            return False
+        return all(self.ext_info.get(key) is not None for key in IMPORTED_EXT_KEYS)
+
+    def check_health(self) -> bool:
+        """检查账号能否直接登录。有效的缓存凭证直接算作可用，否则尝试静默刷新"""
+        for key in list(self.credential_cache.keys()):
+            if self.get_cached_credential(key) is not None:
+                return True
+        return self.refresh_credentials()
+
     def before_save(self):
         pass
+
+
+#启动时预热连接的渠道SDK地址
+CHANNEL_PREWARM_URLS = {
+    "xiaomi_app": ["http://account.migc.g.mi.com/"],
+    "huawei": ["https://oauth-login.cloud.huawei.com/", "https://jgw-drcn.jos.dbankcloud.cn/"],
+    "nearme_vivo": ["https://joint.vivo.com.cn/"],
+    "myapp": ["https://api.weixin.qq.com/", "https://ysdk.qq.com/"],
+}
+
+#预取的uniSDK数据有效期（秒），超过后扫码时重新获取
+PREFETCH_TTL = 180
+
+
+@contextmanager
+def _record_lock(path: str):
+    """账号文件的跨进程写锁，多进程模式下各工作进程都会改写账号文件"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fingerprint(record: dict) -> str:
+    return json.dumps(record, sort_keys=True)
+
+
 class ChannelManager:
     def __init__(self):
         self.logger = setup_logger()
         self.channels = []
-        from channelHandler.miChannelHandler import miChannel
-        from channelHandler.huaChannelHandler import huaweiChannel
-        from channelHandler.vivoChannelHandler import vivoChannel
-        from channelHandler.wechatChannelHandler import wechatChannel
-
+        self._index_dirty = True
+        self._sorted_channels = []
+        self._sort_keys = []
+        self._prefix_index = []
+        self._prefetched = {}
+        self._loaded_mtime = 0
+        # 最近一次读写时账号文件里每条记录的指纹，以及当时本进程的账号对象序列化后的指纹，
+        # 保存时分别用来判断账号是否被其他进程或本进程改过
+        self._snapshot = {}
+        self._synced = {}
         if os.path.exists(genv.get("FP_CHANNEL_RECORD")):
             with open(genv.get("FP_CHANNEL_RECORD"), "r") as file:
                 try:
                     data = json.load(file)
                     for item in data:
                         if "login_info" in item.keys():
-                            channel_name = item["login_info"]["login_channel"]
-                            if channel_name == "xiaomi_app":
-
-                                tmpChannel: miChannel = miChannel.from_dict(item)
-                                # if tmpChannel.is_token_valid():
-                                self.channels.append(tmpChannel)
-                                # else:
-                                #    self.logger.error(f"渠道服登录信息失效: {tmpChannel.name}")
-                            elif channel_name == "huawei":
-                                tmpChannel: huaweiChannel = huaweiChannel.from_dict(item)
-                                # if tmpChannel.is_token_valid():
-                                self.channels.append(tmpChannel)
-                                # else:
-                                #    self.logger.error(f"渠道服登录信息失效: {tmpChannel.name}")
-                            elif channel_name =="nearme_vivo":
-                                tmpChannel: vivoChannel = vivoChannel.from_dict(item)
-                                self.channels.append(tmpChannel)
-                            elif channel_name == "myapp" and item["uuid"].startswith("wx-"):
-                                tmpChannel:wechatChannel=wechatChannel.from_dict(item)
-                                self.channels.append(tmpChannel)
-                            else:
-                                self.channels.append(channel.from_dict(item))
+                            self.channels.append(self.channel_from_dict(item))
+                    if self._shared():
+                        self._mark_synced(data)
                 except:
                     self.logger.exception(f"读取渠道服登录信息失败。已经清空渠道服信息。")
                     with open(genv.get("FP_CHANNEL_RECORD"), "w") as f:
@@ -145,32 +234,268 @@ class ChannelManager:
             with open(genv.get("FP_CHANNEL_RECORD"), "w") as f:
                 json.dump([], f)
             self.channels = []
+        self._loaded_mtime = os.path.getmtime(genv.get("FP_CHANNEL_RECORD"))
 
-    def save_records(self):
-        with open(genv.get("FP_CHANNEL_RECORD"), "w") as file:
-            for i in self.channels:
-                i.before_save()
-            oldData = [channel.__dict__.copy() for channel in self.channels]
-            data = oldData.copy()
-            for channel_data in data:
-                to_be_deleted = []
-                for key in channel_data.keys():
-                    mini_data = {"data": channel_data[key]}
-                    try:
-                        json.dumps(mini_data)
-                    except:
-                        to_be_deleted.append(key)
-                for key in to_be_deleted:
-                    del channel_data[key]
+    def reload_if_changed(self) -> bool:
+        """账号文件被其他进程改写后重新读取。多进程模式下每个工作进程各持有一份账号列表"""
+        try:
+            mtime = os.path.getmtime(genv.get("FP_CHANNEL_RECORD"))
+            if mtime == self._loaded_mtime:
+                return False
+            with open(genv.get("FP_CHANNEL_RECORD"), "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            # 其他进程正在写入，下次再读
+            return False
+        self.channels = [self.channel_from_dict(item) for item in data if "login_info" in item.keys()]
+        self._mark_synced(data)
+        self._loaded_mtime = mtime
+        self._invalidate_index()
+        self.logger.debug("账号文件已被其他进程更新，重新读取")
+        return True
+
+    @staticmethod
+    def channel_from_dict(item: dict) -> channel:
+        """根据登录渠道把存储的字典还原成对应的渠道对象"""
+        from channelHandler.miChannelHandler import miChannel
+        from channelHandler.huaChannelHandler import huaweiChannel
+        from channelHandler.vivoChannelHandler import vivoChannel
+        from channelHandler.wechatChannelHandler import wechatChannel
+
+        channel_name = item["login_info"]["login_channel"]
+        if channel_name == "xiaomi_app":
+            result = miChannel.from_dict(item)
+        elif channel_name == "huawei":
+            result = huaweiChannel.from_dict(item)
+        elif channel_name == "nearme_vivo":
+            result = vivoChannel.from_dict(item)
+        elif channel_name == "myapp" and item.get("uuid", "").startswith("wx-"):
+            result = wechatChannel.from_dict(item)
+        else:
+            result = channel.from_dict(item)
+        result.credential_cache = item.get("credential_cache", {})
+        return result
+
+    @staticmethod
+    def channel_to_dict(item: channel) -> dict:
+        """导出渠道对象中可以被json序列化的字段"""
+        item.before_save()
+        data = item.__dict__.copy()
+        to_be_deleted = []
+        for key in data.keys():
+            mini_data = {"data": data[key]}
+            try:
+                json.dumps(mini_data)
+            except:
+                to_be_deleted.append(key)
+        for key in to_be_deleted:
+            del data[key]
+        return data
+
+    @staticmethod
+    def _shared() -> bool:
+        """多进程模式下多个工作进程共用同一个账号文件"""
+        return genv.get("PROXY_WORKERS", 1) > 1
+
+    @staticmethod
+    def _write_records(path: str, data: list):
+        with open(path + ".tmp", "w") as file:
             json.dump(data, file)
+        # 替换而不是原地改写，其他进程不会读到写了一半的文件
+        os.replace(path + ".tmp", path)
+
+    def save_records(self):
+        """整体写回账号文件。多进程模式下在文件锁内读取最新的账号文件，合并其他进程的改动后再写回"""
+        self._invalidate_index()
+        path = genv.get("FP_CHANNEL_RECORD")
+        if not self._shared():
+            self._write_records(path, [self.channel_to_dict(i) for i in self.channels])
+            self.logger.info("渠道服登录信息已更新")
+            return
+        with _record_lock(path):
+            try:
+                with open(path, "r") as file:
+                    disk = [i for i in json.load(file) if "login_info" in i.keys()]
+            except (OSError, ValueError):
+                disk = []
+            pairs = self._merge_records([(i, self.channel_to_dict(i)) for i in list(self.channels)], disk)
+            self.channels = [i for i, _ in pairs]
+            data = [record for _, record in pairs]
+            self._write_records(path, data)
+            self._mark_synced(data)
+            self._loaded_mtime = os.path.getmtime(path)
         self.logger.info("渠道服登录信息已更新")
 
-    def list_channels(self,game_id: str):
-        return sorted(
-            [channel.get_non_sensitive_data()  for channel in self.channels if game_id == "" or channel.crossGames or (channel.game_id == game_id)],
-            key=lambda x: x["last_login_time"],
-            reverse=True,
+    def _mark_synced(self, data: list):
+        self._snapshot = {i.get("uuid"): _fingerprint(i) for i in data}
+        self._synced = {}
+        for item in self.channels:
+            try:
+                self._synced[item.uuid] = _fingerprint(self.channel_to_dict(item))
+            except Exception:
+                # 无法序列化的账号视为已改动，保存时以本进程的版本为准
+                pass
+
+    def _merge_records(self, ours: list, disk: list) -> list:
+        """ours为[(账号对象, 记录)]。只被其他进程改过的账号用文件里的版本，自己改过的用自己的版本；
+        其他进程新增的账号加入，删除的账号（自己没改过时）去掉，自己删除的账号不再写回"""
+        on_disk = {i.get("uuid"): i for i in disk}
+        merged = []
+        for item, record in ours:
+            uuid = record.get("uuid")
+            latest = on_disk.get(uuid)
+            unchanged = self._synced.get(uuid) == _fingerprint(record)
+            if latest is None:
+                if unchanged and uuid in self._snapshot:
+                    continue
+                merged.append((item, record))
+            elif unchanged and _fingerprint(latest) != self._snapshot.get(uuid):
+                merged.append((self.channel_from_dict(latest), latest))
+            else:
+                merged.append((item, record))
+        held = {record.get("uuid") for _, record in ours}
+        for uuid, record in on_disk.items():
+            if uuid not in held and uuid not in self._snapshot:
+                merged.append((self.channel_from_dict(record), record))
+        return merged
+
+    def iter_records(self):
+        """逐条产出可序列化的账号记录，供流式导出使用"""
+        for i in list(self.channels):
+            yield self.channel_to_dict(i)
+
+    def _build_user_index(self) -> dict:
+        index = {}
+        for i in self.channels:
+            if "id" in i.user_info:
+                index.setdefault(i.user_info["id"], []).append(i)
+        return index
+
+    def _inherit_duplicates(self, tmp_channel: channel, duplicates: list):
+        """按last_login_time排序，取最近一次登录过的账号的名字和uuid给新账号"""
+        duplicates = sorted(duplicates, key=lambda x: x.last_login_time, reverse=True)
+        tmp_channel.name = duplicates[0].name
+        tmp_channel.uuid = duplicates[0].uuid
+
+    def import_records(self, records) -> dict:
+        """批量导入账号记录。按user id和uuid去重并继承最近登录账号的名字和uuid，全部处理完后只保存一次"""
+        index = self._build_user_index()
+        by_uuid = {}
+        for i in self.channels:
+            by_uuid.setdefault(i.uuid, []).append(i)
+        removed = set()
+        added = []
+        result = {"imported": 0, "merged": 0, "skipped": 0}
+        for item in records:
+            try:
+                tmp_channel = self.channel_from_dict(item)
+            except Exception as e:
+                self.logger.error(f"跳过无法解析的账号记录: {e}")
+                result["skipped"] += 1
+                continue
+            account_name = tmp_channel.user_info.get("id") if isinstance(tmp_channel.user_info, dict) else None
+            duplicates = list(index.get(account_name, [])) if account_name is not None else []
+            # 手动添加的渠道账号没有user id，还要按uuid去重，否则重复导入同一份导出会出现uuid相同的账号
+            duplicates += [i for i in by_uuid.get(tmp_channel.uuid, []) if i not in duplicates]
+            if duplicates:
+                self._inherit_duplicates(tmp_channel, duplicates)
+                removed.update(id(i) for i in duplicates)
+                result["merged"] += 1
+            if account_name is not None:
+                index[account_name] = [tmp_channel]
+            by_uuid[tmp_channel.uuid] = [tmp_channel]
+            added.append(tmp_channel)
+            result["imported"] += 1
+        if result["imported"] == 0:
+            return result
+        self.channels = [i for i in self.channels if id(i) not in removed]
+        self.channels.extend(i for i in added if id(i) not in removed)
+        self.save_records()
+        self.logger.info(f"批量导入完成: {result}")
+        return result
+
+    def _invalidate_index(self):
+        self._index_dirty = True
+
+    def _ensure_index(self):
+        """按需重建排序索引和名称/uuid前缀索引，账号变动后只重建一次"""
+        if not self._index_dirty:
+            return
+        self._sorted_channels = sorted(
+            self.channels, key=lambda x: (-x.last_login_time, x.uuid)
         )
+        self._sort_keys = [(-i.last_login_time, i.uuid) for i in self._sorted_channels]
+        prefix_index = []
+        for i in self.channels:
+            prefix_index.append((str(i.name or "").lower(), i.uuid))
+            prefix_index.append((i.uuid.lower(), i.uuid))
+        prefix_index.sort()
+        self._prefix_index = prefix_index
+        self._index_dirty = False
+
+    def _search_prefix(self, query: str):
+        self._ensure_index()
+        query = query.lower()
+        res = set()
+        pos = bisect.bisect_left(self._prefix_index, (query, ""))
+        while pos < len(self._prefix_index) and self._prefix_index[pos][0].startswith(query):
+            res.add(self._prefix_index[pos][1])
+            pos += 1
+        return res
+
+    @staticmethod
+    def _encode_cursor(item: channel) -> str:
+        raw = f"{item.last_login_time}:{item.uuid}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        last_login_time, uuid = raw.split(":", 1)
+        return (-int(last_login_time), uuid)
+
+    def _visible(self, item: channel, game_id: str) -> bool:
+        return game_id == "" or item.crossGames or (item.game_id == game_id)
+
+    def prewarm_urls(self) -> list:
+        """已保存账号用到的渠道SDK地址，以及所有渠道都会用到的uni_sauth"""
+        urls = ["https://mgbsdk.matrix.netease.com/"]
+        for name in {i.channel_name for i in self.channels}:
+            urls.extend(CHANNEL_PREWARM_URLS.get(name, []))
+        return urls
+
+    def list_channels(self,game_id: str):
+        self._ensure_index()
+        return [
+            channel.get_non_sensitive_data()
+            for channel in self._sorted_channels
+            if self._visible(channel, game_id)
+        ]
+
+    def list_channels_page(self, game_id: str, cursor: str = "", limit: int = 50, query: str = ""):
+        """分页列出账号。按最近登录时间倒序，cursor为上一页返回的next_cursor，query按名称/uuid前缀搜索"""
+        self._ensure_index()
+        limit = max(1, min(int(limit), 500))
+        start = 0
+        if cursor:
+            start = bisect.bisect_right(self._sort_keys, self._decode_cursor(cursor))
+        matched = self._search_prefix(query) if query else None
+        items = []
+        next_cursor = None
+        for item in self._sorted_channels[start:]:
+            if matched is not None and item.uuid not in matched:
+                continue
+            if not self._visible(item, game_id):
+                continue
+            if len(items) == limit:
+                next_cursor = self._encode_cursor(last)
+                break
+            items.append(item.get_non_sensitive_data())
+            last = item
+        return {
+            "items": items,
+            "next_cursor": next_cursor,
+        }
 
     def import_from_scan(self, login_info: dict, exchange_info: dict):
         tmp_channel: channel = channel(
@@ -195,9 +520,7 @@ class ChannelManager:
                     to_be_deleted.append(i_channel)
             #按self.last_login_time排序，取最近一次登录过的账号的名字和uuid给新账号
             if len(to_be_deleted) > 0:
-                to_be_deleted = sorted(to_be_deleted, key=lambda x: x.last_login_time, reverse=True)
-                tmp_channel.name = to_be_deleted[0].name
-                tmp_channel.uuid = to_be_deleted[0].uuid
+                self._inherit_duplicates(tmp_channel, to_be_deleted)
                 for i in to_be_deleted:
                     self.channels.remove(i)
                 self.logger.warning(f"发现账号{account_name}有{len(to_be_deleted)}条重复记录，已删除重复账号，并自动继承最近一次登录的账号名和uuid。")
@@ -282,15 +605,69 @@ class ChannelManager:
                 return channel
         return None
 
+    def prefetch(self, uuid: str, game_id: str):
+        """提前在后台获取账号的uniSDK数据，扫码确认时直接使用"""
+        key = (uuid, game_id)
+        entry = self._prefetched.get(key)
+        if entry:
+            job = entry["greenlet"]
+            if not job.ready() or (job.value and time.time() - entry["ready_at"] < PREFETCH_TTL):
+                return job
+        channel = self.query_channel(uuid)
+        if channel is None:
+            return None
+        entry = {"greenlet": None, "ready_at": 0}
+
+        def fetch():
+            start = time.time()
+            with tracemgr.span("prefetch.get_uniSdk_data", channel=channel.channel_name):
+                data = channel.get_uniSdk_data(game_id)
+            entry["ready_at"] = time.time()
+            self.logger.info(f"预取{channel.name}的登录数据完成，耗时{entry['ready_at'] - start:.2f}秒")
+            return data
+
+        entry["greenlet"] = tracemgr.spawn(fetch)
+        self._prefetched[key] = entry
+        return entry["greenlet"]
+
+    def prefetch_ready(self, uuid: str, game_id: str) -> bool:
+        entry = self._prefetched.get((uuid, game_id))
+        return bool(entry) and entry["greenlet"].successful() and bool(entry["greenlet"].value)
+
+    def _take_prefetched(self, channel: channel, game_id: str, timeout: float = 30):
+        """取出预取结果，正在获取时等待其完成。结果只使用一次"""
+        entry = self._prefetched.pop((channel.uuid, game_id), None)
+        if entry is None:
+            return None
+        try:
+            data = entry["greenlet"].get(timeout=timeout)
+        except Exception:
+            self.logger.exception(f"预取{channel.name}的登录数据失败，重新获取")
+            return None
+        if not data or time.time() - entry["ready_at"] > PREFETCH_TTL:
+            return None
+        return data
+
+    def expiring_soon(self, within: int = 600) -> list:
+        """所有账号中within秒内将要过期的凭证，按过期时间排序"""
+        items = []
+        for i in self.channels:
+            for key, expires_at in i.expiring_credentials(within):
+                items.append({"uuid": i.uuid, "name": i.name, "credential": key, "expires_at": expires_at})
+        return sorted(items, key=lambda x: x["expires_at"])
+
     def simulate_confirm(self, channel: channel, scanner_uuid: str, game_id: str):
-        channel_data = channel.get_uniSdk_data(game_id)
+        with tracemgr.span("get_uniSdk_data", channel=channel.channel_name) as attrs:
+            channel_data = self._take_prefetched(channel, game_id)
+            attrs["prefetched"] = bool(channel_data)
+            if not channel_data:
+                channel_data = channel.get_uniSdk_data(game_id)
         if not channel_data:
-            genv.set("CHANNEL_ACCOUNT_SELECTED", "")
             return False
         channel_data["uuid"] = scanner_uuid
         channel_data["game_id"] = game_id
         body = "&".join([f"{k}={v}" for k, v in channel_data.items()])
-        r = requests.post(
+        r = httpclient.post(
             "https://service.mkey.163.com/mpay/api/qrcode/confirm_login",
             data=body,
             headers={"Content-Type": "application/x-www-form-urlencoded"},
@@ -301,10 +678,11 @@ class ChannelManager:
             self.save_records()
             return r.json()
         else:
-            genv.set("CHANNEL_ACCOUNT_SELECTED", "")
+            channel.invalidate_credential()
             return False
 
-    def simulate_scan(self, uuid: str, scanner_uuid: str, game_id: str):
+    def simulate_scan(self, uuid: str, scanner_uuid: str, game_id: str, raise_rejected: bool = False):
+        """模拟扫码登录。raise_rejected为True时上游拒绝扫码请求抛出ScanRejected，否则返回False"""
         for channel in self.channels:
             if channel.uuid == uuid:
                 data = {
@@ -320,18 +698,22 @@ class ChannelManager:
                 try:
                     if scanner_uuid=="Kinich":
                         return channel.get_uniSdk_data()
-                    r = requests.get(
+                    r = httpclient.get(
                         "https://service.mkey.163.com/mpay/api/qrcode/scan",
                         params=data,
                     )
                     self.logger.info(f"模拟扫码请求: {r.json()}")
                     if r.status_code == 200:
                         return self.simulate_confirm(channel, scanner_uuid, game_id)
+                    elif raise_rejected:
+                        raise ScanRejected(f"扫码请求返回{r.status_code}")
                     else:
-                        genv.set("CHANNEL_ACCOUNT_SELECTED", "")
                         return False
+                except ScanRejected:
+                    raise
                 except:
                     self.logger.exception("模拟扫码请求失败")
-                    genv.set("CHANNEL_ACCOUNT_SELECTED", "")
+                    # 缓存的凭证可能已被服务端作废，下次重新获取
+                    channel.invalidate_credential()
                     return False
         return None
\ No newline at end of file
@@ -0,0 +1,109 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 上游响应体保持压缩状态原样转发，只有需要改写内容时才解压；改写后的内容在客户端支持时重新gzip压缩。
+
+import gzip
+import zlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SUPPORTED_ENCODINGS = ("gzip", "deflate", "br") if brotli else ("gzip", "deflate")
+# 小于该长度的改写结果不再压缩
+MIN_COMPRESS_SIZE = 512
+
+
+def filter_accept_encoding(value: str) -> str:
+    """只向上游声明本地能解压的编码，保证需要改写的响应都能解开"""
+    accepted = []
+    for item in (value or "").split(","):
+        name = item.split(";")[0].strip().lower()
+        if name in SUPPORTED_ENCODINGS or name == "identity":
+            accepted.append(item.strip())
+    return ", ".join(accepted) or "identity"
+
+
+def accepts_encoding(value: str, encoding: str) -> bool:
+    for item in (value or "").split(","):
+        parts = [i.strip() for i in item.split(";")]
+        if parts[0].lower() == encoding.lower():
+            return not any(i.replace(" ", "") in ("q=0", "q=0.0") for i in parts[1:])
+    return False
+
+
+def accepts_gzip(value: str) -> bool:
+    return accepts_encoding(value, "gzip")
+
+
+def decode(data: bytes, encoding: str) -> bytes:
+    encoding = (encoding or "").strip().lower()
+    if encoding in ("", "identity"):
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # 部分服务器发送不带zlib头的原始deflate数据
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    if encoding == "br" and brotli:
+        return brotli.decompress(data)
+    raise ValueError(f"不支持的内容编码: {encoding}")
+
+
+class UpstreamResponse(Response):
+    """带着上游原始编码的响应。读取内容（get_data/get_json）时才解压，并去掉Content-Encoding"""
+
+    decoded = False
+
+    def get_data(self, as_text: bool = False):
+        encoding = self.headers.get("Content-Encoding")
+        if encoding and not self.decoded:
+            self.set_data(decode(super().get_data(), encoding))
+            del self.headers["Content-Encoding"]
+            self.decoded = True
+        return super().get_data(as_text)
+
+    def recompress(self, accept_encoding: str):
+        """内容被解压过（通常是改写过）且客户端支持时重新gzip压缩"""
+        if not self.decoded or "Content-Encoding" in self.headers or not accepts_gzip(accept_encoding):
+            return
+        data = super().get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        self.set_data(gzip.compress(data, 6))
+        self.headers["Content-Encoding"] = "gzip"
+        self.vary.add("Accept-Encoding")
+        self.decoded = False
+
+
+def preview(response: Response, limit: int = 2048) -> str:
+    """用于日志的响应体摘要，不会解压或修改响应"""
+    encoding = response.headers.get("Content-Encoding")
+    if response.direct_passthrough:
+        return "<流式响应>"
+    data = Response.get_data(response)
+    if encoding:
+        return f"<{encoding}压缩 {len(data)}字节>"
+    return data[:limit].decode(errors="replace")
@@ -109,6 +109,10 @@ html = r"""<!DOCTYPE html>
             font-size: 0.875rem;
             font-weight: 500;
         }
+
+        .channel-dead td {
+            opacity: 0.5;
+        }
     </style>
 </head>
 
@@ -221,6 +225,7 @@ html = r"""<!DOCTYPE html>
         <div class="card mt-4">
             <div class="card-header d-flex justify-content-between align-items-center">
                 <span><i class="bi bi-list-ul me-2"></i>账号列表</span>
+                <input type="search" id="channelSearch" class="form-control form-control-sm w-25" placeholder="按名称/UUID搜索">
                 <div class="btn-group" id="batchOperationsGroup">
                     <button onclick="batchDelete()" class="btn btn-danger btn-sm">
                         <i class="bi bi-trash me-1"></i>批量删除
@@ -247,6 +252,9 @@ html = r"""<!DOCTYPE html>
                 <div id="noAccounts" class="alert alert-secondary text-center" style="display:none;">
                     <i class="bi bi-info-circle me-2"></i> 暂无账号记录，请通过手动登录或用游戏客户端扫码添加账号
                 </div>
+                <div id="loadMoreSentinel" class="text-center" style="display:none;">
+                    <button onclick="loadChannelPage(false)" class="btn btn-outline-secondary btn-sm">加载更多</button>
+                </div>
             </div>
         </div>
         
@@ -371,10 +379,32 @@ html = r"""<!DOCTYPE html>
             });
         }
 
+        // 等待后台任务结束，返回任务最终状态
+        function waitForJob(jobId) {
+            return new Promise(resolve => {
+                function poll() {
+                    fetch(`/_idv-login/jobs?id=${jobId}`)
+                        .then(response => response.json())
+                        .then(job => {
+                            if (['queued', 'running'].includes(job.state)) {
+                                setTimeout(poll, 1000);
+                            } else {
+                                resolve(job);
+                            }
+                        })
+                        .catch(() => setTimeout(poll, 1000));
+                }
+                poll();
+            });
+        }
+
         function switchChannel(uuid) {
-            fetch(`/_idv-login/switch?uuid=${uuid}`)
+            const qr = getQueryVariable("qr") || "";
+            fetch(`/_idv-login/switch?uuid=${uuid}&qr=${qr}&async=1`)
                 .then(response => response.json())
-                .then(data => {
+                .then(data => waitForJob(data.job_id))
+                .then(job => {
+                    var data = job.result || {};
                     if (data.current == uuid) {
                         swal({
                             title: "模拟登录成功",
@@ -699,6 +729,124 @@ html = r"""<!DOCTYPE html>
                 });
         }
 
+        // 账号列表分页加载
+        const CHANNEL_PAGE_SIZE = 50;
+        var channelNextCursor = null;
+        var channelLoading = false;
+        // 每次请求加一，过期请求的响应直接丢弃
+        var channelRequestGeneration = 0;
+        var channelSearchTimer = null;
+        var channelHealth = {};
+
+        function applyChannelHealth(row) {
+            var result = channelHealth[row.dataset.uuid];
+            if (result && !result.ok) {
+                row.classList.add('channel-dead');
+                row.title = '凭证已失效，登录时需要重新授权';
+            } else {
+                row.classList.remove('channel-dead');
+                row.title = '';
+            }
+        }
+
+        // 后台检查账号可用性，失效的账号置灰
+        function loadChannelHealth() {
+            fetch('/_idv-login/health')
+                .then(response => response.json())
+                .then(data => {
+                    (data.results || []).forEach(result => channelHealth[result.uuid] = result);
+                    document.querySelectorAll('#channelTableBody tr').forEach(applyChannelHealth);
+                    if (data.running) {
+                        setTimeout(loadChannelHealth, 3000);
+                    }
+                });
+        }
+
+        function renderChannelRow(tableBody, channel) {
+            var row = tableBody.insertRow();
+            row.dataset.uuid = channel.uuid;
+            row.insertCell().innerHTML = `<input type="checkbox" class="account-checkbox" value="${channel.uuid}">`;
+
+            var uuidCell = row.insertCell();
+            uuidCell.innerHTML = `<span class="badge bg-light text-dark">${channel.uuid}</span>`;
+            uuidCell.title = channel.uuid;
+
+            row.insertCell().innerHTML = channel.name;
+            row.insertCell().innerHTML = `<small>${timeStampToLocalTime(channel.last_login_time)}</small>`;
+
+            var actionsCell = row.insertCell();
+            actionsCell.innerHTML = `
+                <div class="actions-container">
+                    <div class="action-button">
+                        <button onclick="switchChannel('${channel.uuid}')" class="btn btn-sm btn-primary btn-action">
+                            <i class="bi bi-box-arrow-in-right"></i>
+                        </button>
+                        <span class="action-label">登录</span>
+                    </div>
+                    <div class="action-button">
+                        <button onclick="renameChannel('${channel.uuid}')" class="btn btn-sm btn-info btn-action text-white">
+                            <i class="bi bi-pencil"></i>
+                        </button>
+                        <span class="action-label">改名</span>
+                    </div>
+                    <div class="action-button">
+                        <button onclick="deleteChannel('${channel.uuid}')" class="btn btn-sm btn-danger btn-action">
+                            <i class="bi bi-trash"></i>
+                        </button>
+                        <span class="action-label">删除</span>
+                    </div>
+                    <div class="action-button">
+                        <button onclick="defaultChannel('${channel.uuid}')" class="btn btn-sm btn-success btn-action">
+                            <i class="bi bi-star"></i>
+                        </button>
+                        <span class="action-label">默认</span>
+                    </div>
+                </div>
+            `;
+            applyChannelHealth(row);
+        }
+
+        function loadChannelPage(reset) {
+            // 翻页请求在途时不重复翻页；重置（搜索、刷新）总是重新请求，之前的请求作废
+            if (!reset && (channelLoading || !channelNextCursor)) return;
+            const generation = ++channelRequestGeneration;
+            channelLoading = true;
+            const game_id = getQueryVariable("game_id");
+            const query = document.getElementById('channelSearch').value.trim();
+            var url = `/_idv-login/list?game_id=${game_id}&limit=${CHANNEL_PAGE_SIZE}&q=${encodeURIComponent(query)}`;
+            if (!reset) {
+                url += `&cursor=${encodeURIComponent(channelNextCursor)}`;
+            }
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    if (generation !== channelRequestGeneration) return;
+                    var tableBody = document.getElementById('channelTableBody');
+                    var noAccountsDiv = document.getElementById('noAccounts');
+                    var batchOperationsGroup = document.getElementById('batchOperationsGroup');
+                    if (reset) {
+                        tableBody.innerHTML = '';
+                    }
+                    // 只追加新的一页，已渲染的行不再重绘
+                    (data.items || []).forEach(channel => renderChannelRow(tableBody, channel));
+                    channelNextCursor = data.next_cursor;
+                    document.getElementById('loadMoreSentinel').style.display = channelNextCursor ? 'block' : 'none';
+
+                    if (tableBody.rows.length === 0) {
+                        noAccountsDiv.style.display = query ? 'none' : 'block';
+                        batchOperationsGroup.style.display = 'none'; // 没有账号时隐藏批量操作
+                    } else {
+                        noAccountsDiv.style.display = 'none';
+                        batchOperationsGroup.style.display = 'block'; // 有账号时显示批量操作
+                    }
+                })
+                .finally(() => {
+                    if (generation === channelRequestGeneration) {
+                        channelLoading = false;
+                    }
+                });
+        }
+
         // 在页面加载时获取账号列表
         window.onload = function () {
             //获得query参数game_id
@@ -712,74 +860,27 @@ html = r"""<!DOCTYPE html>
                 // 加载登录延迟设置
                 loadLoginDelay();
                 
-                fetch('/_idv-login/list?game_id=' + game_id)
-                    .then(response => response.json())
-                    .then(data => {
-                        var tableBody = document.getElementById('channelTableBody');
-                        var noAccountsDiv = document.getElementById('noAccounts');
-                        var batchOperationsGroup = document.getElementById('batchOperationsGroup');
-                        
-                        // 清空表格
-                        tableBody.innerHTML = '';
-                        
-                        if (data.length === 0) {
-                            noAccountsDiv.style.display = 'block';
-                            batchOperationsGroup.style.display = 'none'; // 没有账号时隐藏批量操作
-                        } else {
-                            noAccountsDiv.style.display = 'none';
-                            batchOperationsGroup.style.display = 'block'; // 有账号时显示批量操作
-                            
-                            data.forEach(channel => {
-                                var row = tableBody.insertRow();
-                                row.insertCell().innerHTML = `<input type="checkbox" class="account-checkbox" value="${channel.uuid}">`;
-                                
-                                var uuidCell = row.insertCell();
-                                uuidCell.innerHTML = `<span class="badge bg-light text-dark">${channel.uuid}</span>`;
-                                uuidCell.title = channel.uuid;
-                                
-                                row.insertCell().innerHTML = channel.name;
-                                row.insertCell().innerHTML = `<small>${timeStampToLocalTime(channel.last_login_time)}</small>`;
-                                
-                                var actionsCell = row.insertCell();
-                                actionsCell.innerHTML = `
-                                    <div class="actions-container">
-                                        <div class="action-button">
-                                            <button onclick="switchChannel('${channel.uuid}')" class="btn btn-sm btn-primary btn-action">
-                                                <i class="bi bi-box-arrow-in-right"></i>
-                                            </button>
-                                            <span class="action-label">登录</span>
-                                        </div>
-                                        <div class="action-button">
-                                            <button onclick="renameChannel('${channel.uuid}')" class="btn btn-sm btn-info btn-action text-white">
-                                                <i class="bi bi-pencil"></i>
-                                            </button>
-                                            <span class="action-label">改名</span>
-                                        </div>
-                                        <div class="action-button">
-                                            <button onclick="deleteChannel('${channel.uuid}')" class="btn btn-sm btn-danger btn-action">
-                                                <i class="bi bi-trash"></i>
-                                            </button>
-                                            <span class="action-label">删除</span>
-                                        </div>
-                                        <div class="action-button">
-                                            <button onclick="defaultChannel('${channel.uuid}')" class="btn btn-sm btn-success btn-action">
-                                                <i class="bi bi-star"></i>
-                                            </button>
-                                            <span class="action-label">默认</span>
-                                        </div>
-                                    </div>
-                                `;
-                            });
-                            
-                            // 全选功能
-                            document.getElementById('selectAll').addEventListener('change', function() {
-                                const checkboxes = document.querySelectorAll('.account-checkbox');
-                                checkboxes.forEach(checkbox => {
-                                    checkbox.checked = this.checked;
-                                });
-                            });
+                loadChannelPage(true);
+                loadChannelHealth();
+                document.getElementById('channelSearch').addEventListener('input', function() {
+                    clearTimeout(channelSearchTimer);
+                    channelSearchTimer = setTimeout(() => loadChannelPage(true), 250);
+                });
+                // 滚动到列表底部时自动加载下一页
+                if ('IntersectionObserver' in window) {
+                    new IntersectionObserver(entries => {
+                        if (entries[0].isIntersecting && channelNextCursor) {
+                            loadChannelPage(false);
                         }
+                    }).observe(document.getElementById('loadMoreSentinel'));
+                }
+                // 全选功能
+                document.getElementById('selectAll').addEventListener('change', function() {
+                    const checkboxes = document.querySelectorAll('.account-checkbox');
+                    checkboxes.forEach(checkbox => {
+                        checkbox.checked = this.checked;
                     });
+                });
 
                 fetch('/_idv-login/manualChannels')
                     .then(response => response.json())
@@ -877,9 +978,11 @@ html = r"""<!DOCTYPE html>
                 closeOnClickOutside: false,
             });
             
-            fetch(`/_idv-login/import?channel=${selectedChannel}&game_id=${game_id}`)
+            fetch(`/_idv-login/import?channel=${selectedChannel}&game_id=${game_id}&async=1`)
                 .then(response => response.json())
-                .then(data => {
+                .then(data => waitForJob(data.job_id))
+                .then(job => {
+                    var data = job.result || {};
                     swal.close();
                     if (data.success) {
                         swal({
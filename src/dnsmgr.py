@@ -48,4 +48,13 @@ class DNSResolver(object):
             return None
         except:
             self.logger.exception(f"DNS解析失败。")
-            return None
\ No newline at end of file
+            return None
+
+    def gethostbyname_all(self, hostname):
+        """返回全部A记录，解析失败时返回空列表"""
+        try:
+            r = dns.resolver.resolve(hostname, 'A')
+            return [str(i) for i in r]
+        except:
+            self.logger.exception(f"DNS解析失败。")
+            return []
@@ -4,9 +4,10 @@ import os
 
 
 class genv:
-    global _list, _cachePath
+    global _list, _cachePath, _cacheMtime
     _list = {}
     _cachePath = "config.json"
+    _cacheMtime = 0
 
     def set(key, value, cached=False):
         _list[key] = value
@@ -26,6 +27,24 @@ class genv:
                     print("Failed to cache data",key,value)
                     pass
 
+    def reload_if_changed():
+        """缓存文件被其他进程改写后，用文件里的值更新内存中同名的键，返回是否重新读取了。
+        多进程模式下每个工作进程各有一份内存中的值"""
+        global _cacheMtime
+        try:
+            mtime = os.path.getmtime(_cachePath)
+            if mtime == _cacheMtime:
+                return False
+            with open(_cachePath, 'r') as f:
+                data = json.load(f)
+        except:
+            return False
+        _cacheMtime = mtime
+        for key, value in data.items():
+            if key in _list:
+                _list[key] = value
+        return True
+
     def get(key, default=None):
         if key in _list:
             return _list[key]
@@ -35,7 +35,11 @@ class Game:
         should_auto_start: bool = False,
         auto_close_after_login: bool = False,
         login_delay: int = 6,
-        last_used_time: int = 0
+        last_used_time: int = 0,
+        min_polls: int = 2,
+        ready_after: float = 0,
+        login_history: list = None,
+        success_streak: int = 0
     ) -> None:
         self.game_id = game_id
         self.name = name if name else game_id
@@ -44,6 +48,12 @@ class Game:
         self.auto_close_after_login = auto_close_after_login
         self.login_delay = login_delay
         self.last_used_time = last_used_time or int(time.time())
+        # 自动登录调度学习到的参数：客户端轮询几次后可以扫码、客户端就绪的平均耗时
+        self.min_polls = min_polls
+        self.ready_after = ready_after
+        self.login_history = login_history or []
+        # 连续自动登录成功的次数，用来逐步调回min_polls
+        self.success_streak = success_streak
         self.logger = setup_logger()
 
     @classmethod
@@ -55,7 +65,11 @@ class Game:
             should_auto_start=data.get("should_auto_start", False),
             auto_close_after_login=data.get("auto_close_after_login", True),
             last_used_time=data.get("last_used_time", int(time.time())),
-            login_delay=data.get("login_delay", 6)
+            login_delay=data.get("login_delay", 6),
+            min_polls=data.get("min_polls", 2),
+            ready_after=data.get("ready_after", 0),
+            login_history=data.get("login_history", []),
+            success_streak=data.get("success_streak", 0)
         )
 
     def to_dict(self) -> dict:
@@ -66,7 +80,11 @@ class Game:
             "should_auto_start": self.should_auto_start,
             "auto_close_after_login": self.auto_close_after_login,
             "last_used_time": self.last_used_time,
-            "login_delay": self.login_delay
+            "login_delay": self.login_delay,
+            "min_polls": self.min_polls,
+            "ready_after": self.ready_after,
+            "login_history": self.login_history,
+            "success_streak": self.success_streak
         }
 
     def get_non_sensitive_data(self) -> dict:
@@ -162,6 +180,11 @@ class Game:
 
 class GameManager:
     GAMES_CACHE_KEY = "game_settings"
+    LOGIN_HISTORY_SIZE = 20
+    MAX_MIN_POLLS = 5
+    DEFAULT_MIN_POLLS = 2
+    # 连续成功这么多次后min_polls减一，直到回到默认值
+    LOWER_AFTER_SUCCESSES = 3
     
     def __init__(self):
         self.logger = setup_logger()
@@ -180,6 +203,11 @@ class GameManager:
             # 初始化空数据以恢复
             genv.set(self.GAMES_CACHE_KEY, {}, cached=True)
 
+    def reload(self):
+        """配置文件被其他进程改写后重新读取游戏设置。多进程模式下每个工作进程各持有一份"""
+        self.games = {}
+        self._load_games()
+
     def _save_games(self):
         """保存游戏设置到缓存"""
         try:
@@ -316,4 +344,41 @@ class GameManager:
         game = self.get_game(game_id)
         if game:
             return game.login_delay
-        return 6
\ No newline at end of file
+        return 6
+
+    def record_login_attempt(self, game_id: str, attempt: dict):
+        """记录一次自动登录，并据此调整该游戏的调度参数"""
+        game = self.get_game(game_id)
+        if not game:
+            return
+        game.login_history.append(attempt)
+        del game.login_history[:-self.LOGIN_HISTORY_SIZE]
+        if attempt["success"]:
+            ready_at = attempt.get("ready_at")
+            if ready_at:
+                game.ready_after = ready_at if game.ready_after == 0 else round(game.ready_after * 0.7 + ready_at * 0.3, 3)
+            game.success_streak += 1
+            if game.success_streak >= self.LOWER_AFTER_SUCCESSES and game.min_polls > self.DEFAULT_MIN_POLLS:
+                game.min_polls -= 1
+                game.success_streak = 0
+                self.logger.info(f"游戏 {game_id} 自动登录连续成功，扫码前等待的轮询次数调整为{game.min_polls}")
+        else:
+            game.success_streak = 0
+            if attempt["trigger"] == "poll" and attempt.get("reason") == "rejected" and game.min_polls < self.MAX_MIN_POLLS:
+                # 轮询信号触发的扫码被上游拒绝（二维码还没就绪），说明触发得太早，下次多等一轮。
+                # 凭证过期、网络错误等失败和扫码时机无关，不调整
+                game.min_polls += 1
+                self.logger.info(f"游戏 {game_id} 扫码过早被拒绝，扫码前等待的轮询次数调整为{game.min_polls}")
+        self._save_games()
+
+    def get_login_stats(self, game_id: str) -> dict:
+        """获取自动登录调度参数和最近的登录记录"""
+        game = self.get_game(game_id)
+        if not game:
+            return {}
+        return {
+            "login_delay": game.login_delay,
+            "min_polls": game.min_polls,
+            "ready_after": game.ready_after,
+            "history": game.login_history,
+        }
@@ -0,0 +1,136 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 账号可用性批量检查：有限并发地逐个校验账号，结果带时间戳缓存，检查进度可以流式订阅。
+
+import time
+
+import gevent
+from gevent.pool import Pool
+from gevent.queue import Queue
+
+from logutil import setup_logger
+
+
+class HealthChecker:
+    def __init__(self, channels_helper, concurrency: int = 16, ttl: int = 300, timeout: float = 30):
+        self.logger = setup_logger()
+        self.channels_helper = channels_helper
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.timeout = timeout
+        self.results = {}
+        self._running = None
+        self._subscribers = []
+
+    def is_running(self) -> bool:
+        return self._running is not None and not self._running.ready()
+
+    def _is_fresh(self, uuid: str) -> bool:
+        result = self.results.get(uuid)
+        return result is not None and time.time() - result["checked_at"] < self.ttl
+
+    def _publish(self, event: dict):
+        for queue in list(self._subscribers):
+            queue.put(event)
+
+    def _check_one(self, channel):
+        start = time.time()
+        error = ""
+        try:
+            with gevent.Timeout(self.timeout):
+                ok = bool(channel.check_health())
+        except gevent.Timeout:
+            ok = False
+            error = "检查超时"
+        except Exception as e:
+            ok = False
+            error = str(e)
+        result = {
+            "uuid": channel.uuid,
+            "name": channel.name,
+            "ok": ok,
+            "error": error,
+            "checked_at": int(time.time()),
+            "elapsed": round(time.time() - start, 3),
+        }
+        self.results[channel.uuid] = result
+        self._publish(dict(result, type="result"))
+        return ok
+
+    def _run(self, force: bool):
+        error = ""
+        try:
+            targets = [i for i in list(self.channels_helper.channels) if force or not self._is_fresh(i.uuid)]
+            self._publish({"type": "start", "total": len(targets)})
+            start = time.time()
+            pool = Pool(self.concurrency)
+            for channel in targets:
+                pool.spawn(self._check_one, channel)
+            pool.join()
+            if targets:
+                # 检查过程中刷新的凭证统一保存一次
+                self.channels_helper.save_records()
+            self.logger.info(f"账号检查完成，共{len(targets)}个，耗时{time.time() - start:.2f}秒")
+        except Exception as e:
+            error = str(e)
+            self.logger.exception("账号检查失败")
+        finally:
+            # 出错或被终止时也要通知订阅者，否则stream会一直等待
+            event = dict(self.summary(), type="done")
+            if error:
+                event["error"] = error
+            self._publish(event)
+        return self.summary()
+
+    def start(self, force: bool = False):
+        """开始一轮检查，已有检查在进行时直接复用"""
+        if not self.is_running():
+            self._running = gevent.spawn(self._run, force)
+        return self._running
+
+    def stream(self, force: bool = False):
+        """开始（或加入正在进行的）检查，逐个产出检查结果，最后产出汇总"""
+        queue = Queue()
+        self._subscribers.append(queue)
+        try:
+            self.start(force)
+            while True:
+                event = queue.get()
+                if event["type"] == "start":
+                    continue
+                yield event
+                if event["type"] == "done":
+                    break
+        finally:
+            self._subscribers.remove(queue)
+
+    def summary(self) -> dict:
+        results = list(self.results.values())
+        return {
+            "total": len(results),
+            "ok": sum(1 for i in results if i["ok"]),
+            "dead": sum(1 for i in results if not i["ok"]),
+        }
+
+    def report(self) -> dict:
+        existing = {i.uuid for i in self.channels_helper.channels}
+        return {
+            "running": self.is_running(),
+            "results": [i for uuid, i in self.results.items() if uuid in existing],
+        }
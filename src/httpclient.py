@@ -0,0 +1,163 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 渠道SDK请求共用的HTTP客户端：按host复用连接池，默认超时，失败重试，启动预热和按host的耗时统计。
+
+import time
+from collections import deque
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import gevent
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from logutil import setup_logger
+
+
+class HostStats:
+    def __init__(self, max_samples: int = 200):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def record(self, elapsed: float, ok: bool):
+        self.count += 1
+        self.total += elapsed
+        self.samples.append(elapsed)
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 1),
+            "p95_ms": round(self.percentile(0.95) * 1000, 1),
+            "max_ms": round(max(self.samples) * 1000, 1) if self.samples else 0,
+        }
+
+
+class HttpClient:
+    def __init__(self, timeout=(5, 20), retries: int = 2, backoff: float = 0.3, pool_size: int = 10):
+        self.logger = setup_logger()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._sessions = {}
+        self.stats = {}
+        self.hooks = []
+        # 收到响应后调用，参数为(response, 耗时)，供录制使用
+        self.response_hooks = []
+        # 上游证书校验，为CA文件路径时用该CA校验（回放测试时使用）
+        self.verify = True
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        # 各账号的cookie由调用方显式传入，不能在共享会话里串号
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        # 连接失败对所有方法重试；读超时和5xx只对幂等方法重试
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.verify = self.verify
+        return session
+
+    def session_for(self, url: str) -> requests.Session:
+        host = urlparse(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            session = self._new_session()
+            self._sessions[host] = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlparse(url).netloc
+        stats = self.stats.setdefault(host, HostStats())
+        start = time.perf_counter()
+        ok = False
+        try:
+            resp = self.session_for(url).request(method, url, **kwargs)
+            ok = resp.status_code < 500
+            if self.response_hooks and not kwargs.get("stream"):
+                for hook in self.response_hooks:
+                    try:
+                        hook(resp, time.perf_counter() - start)
+                    except Exception:
+                        pass
+            return resp
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.record(elapsed, ok)
+            for hook in self.hooks:
+                try:
+                    hook(method, url, elapsed, ok)
+                except Exception:
+                    pass
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def prewarm(self, urls):
+        """后台建立到各host的连接，登录时不必再做TCP/TLS握手"""
+
+        def warm(url):
+            try:
+                self.session_for(url).head(url, timeout=3, allow_redirects=False)
+            except Exception as e:
+                self.logger.debug(f"预热连接{url}失败: {e}")
+
+        return [gevent.spawn(warm, url) for url in urls]
+
+    def get_stats(self) -> dict:
+        return {host: stats.to_dict() for host, stats in self.stats.items()}
+
+
+client = HttpClient()
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return client.request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return client.get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return client.post(url, **kwargs)
@@ -0,0 +1,144 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import ipaddress
+import time
+
+import gevent
+import requests
+
+from envmgr import genv
+from logutil import setup_logger
+
+
+def _parse_json_ip(resp: requests.Response):
+    return resp.json().get("ip")
+
+
+def _parse_text_ip(resp: requests.Response):
+    return resp.text.strip()
+
+
+def _parse_any_ip(resp: requests.Response):
+    """自定义来源可能返回{"ip": ...}或纯文本"""
+    try:
+        return _parse_json_ip(resp)
+    except ValueError:
+        return _parse_text_ip(resp)
+
+
+class PublicIPProvider:
+    """本机公网IP缓存。多个来源并行竞速取最快结果，带TTL缓存、后台刷新和变更通知"""
+
+    # 默认只向网易查询，和原来的行为一致。第三方来源会定时收到用户的IP，
+    # 需要时通过genv的IP_EXTRA_SOURCES（URL列表，例如["https://api.ipify.org/?format=json"]）自行添加
+    SOURCES = [
+        ("https://who.nie.netease.com/", _parse_json_ip),
+    ]
+    FALLBACK_IP = "127.0.0.1"
+
+    def __init__(self, ttl: int = 600, timeout: float = 3, refresh_interval: int = 300, sources=None):
+        self.logger = setup_logger()
+        self.ttl = ttl
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        if sources is None:
+            sources = self.SOURCES + [(url, _parse_any_ip) for url in genv.get("IP_EXTRA_SOURCES", [])]
+        self.sources = sources
+        self.session = requests.Session()
+        self._ip = None
+        self._fetched_at = 0
+        self._listeners = []
+        self._refreshing = None
+        self._daemon = None
+
+    def subscribe(self, callback):
+        """注册IP变化回调，参数为(旧IP, 新IP)"""
+        self._listeners.append(callback)
+
+    def is_fresh(self) -> bool:
+        return self._ip is not None and time.time() - self._fetched_at < self.ttl
+
+    def get_ip(self, block: bool = True) -> str:
+        """返回缓存的公网IP。缓存过期时后台刷新并先返回旧值，从未获取过时最多阻塞timeout秒"""
+        if self.is_fresh():
+            return self._ip
+        if self._ip is not None:
+            self.refresh_async()
+            return self._ip
+        if block:
+            self.refresh()
+        return self._ip if self._ip is not None else self.FALLBACK_IP
+
+    def refresh_async(self):
+        if self._refreshing is None or self._refreshing.ready():
+            self._refreshing = gevent.spawn(self._race)
+        return self._refreshing
+
+    def refresh(self):
+        return self.refresh_async().get()
+
+    def _fetch(self, url, parser):
+        try:
+            resp = self.session.get(url, timeout=self.timeout)
+            resp.raise_for_status()
+            ip = parser(resp)
+            ipaddress.ip_address(ip)
+            return ip
+        except Exception as e:
+            self.logger.debug(f"从{url}获取公网IP失败: {e}")
+            return None
+
+    def _race(self):
+        jobs = [gevent.spawn(self._fetch, url, parser) for url, parser in self.sources]
+        ip = None
+        try:
+            for job in gevent.iwait(jobs, timeout=self.timeout):
+                if job.value is not None:
+                    ip = job.value
+                    break
+        finally:
+            gevent.killall(jobs, block=False)
+        if ip is None:
+            self.logger.warning("获取公网IP失败，继续使用缓存的IP")
+            return self._ip
+        self._update(ip)
+        return ip
+
+    def _update(self, ip: str):
+        old = self._ip
+        self._ip = ip
+        self._fetched_at = time.time()
+        if old != ip:
+            self.logger.info(f"公网IP变更: {old} -> {ip}")
+            for callback in list(self._listeners):
+                try:
+                    callback(old, ip)
+                except Exception:
+                    self.logger.exception("公网IP变更回调执行失败")
+
+    def start(self):
+        """启动后台刷新，保证登录时直接命中缓存"""
+        if self._daemon is None:
+            self._daemon = gevent.spawn(self._refresh_loop)
+        return self
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            gevent.sleep(self.refresh_interval)
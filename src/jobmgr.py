@@ -0,0 +1,161 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 耗时的账号操作（模拟登录、手动导入）放到后台任务里执行，接口立即返回任务ID。
+
+import time
+from uuid import uuid4
+
+import gevent
+from gevent.lock import BoundedSemaphore
+from gevent.queue import Queue
+
+from logutil import setup_logger
+
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+    FINISHED_STATES = (SUCCEEDED, FAILED, TIMEOUT, CANCELLED)
+
+    def __init__(self, kind: str):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.state = self.QUEUED
+        self.result = None
+        self.error = ""
+        self.created_at = time.time()
+        self.started_at = 0
+        self.finished_at = 0
+        self.greenlet = None
+
+    def is_finished(self) -> bool:
+        return self.state in self.FINISHED_STATES
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "result": self.result,
+            "error": self.error,
+            "created_at": int(self.created_at),
+            "started_at": int(self.started_at),
+            "finished_at": int(self.finished_at),
+        }
+
+
+class JobManager:
+    # 每种任务同时执行的数量和超时时间（秒）
+    LIMITS = {"switch": 2, "import": 1}
+    TIMEOUTS = {"switch": 120, "import": 600}
+    DEFAULT_LIMIT = 2
+    DEFAULT_TIMEOUT = 300
+    # 已结束的任务保留多久（秒）
+    KEEP_FINISHED = 600
+
+    def __init__(self):
+        self.logger = setup_logger()
+        self.jobs = {}
+        self._slots = {}
+        self._subscribers = {}
+
+    def _slot(self, kind: str) -> BoundedSemaphore:
+        if kind not in self._slots:
+            self._slots[kind] = BoundedSemaphore(self.LIMITS.get(kind, self.DEFAULT_LIMIT))
+        return self._slots[kind]
+
+    def _purge(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.is_finished() and now - job.finished_at > self.KEEP_FINISHED:
+                self.jobs.pop(job_id, None)
+
+    def _set_state(self, job: Job, state: str):
+        job.state = state
+        if state == Job.RUNNING:
+            job.started_at = time.time()
+        elif state in Job.FINISHED_STATES:
+            job.finished_at = time.time()
+        event = job.to_dict()
+        for queue in list(self._subscribers.get(job.id, [])):
+            queue.put(event)
+
+    def submit(self, kind: str, func, *args, **kwargs) -> Job:
+        """提交任务并立即返回，任务在后台按种类限制并发执行"""
+        self._purge()
+        job = Job(kind)
+        self.jobs[job.id] = job
+        job.greenlet = gevent.spawn(self._execute, job, func, args, kwargs)
+        return job
+
+    def _execute(self, job: Job, func, args, kwargs):
+        slot = self._slot(job.kind)
+        with slot:
+            if job.is_finished():
+                return
+            self._set_state(job, Job.RUNNING)
+            try:
+                with gevent.Timeout(self.TIMEOUTS.get(job.kind, self.DEFAULT_TIMEOUT)):
+                    job.result = func(*args, **kwargs)
+                self._set_state(job, Job.SUCCEEDED)
+            except gevent.Timeout:
+                job.error = "任务执行超时"
+                self.logger.error(f"后台任务{job.kind}({job.id})执行超时")
+                self._set_state(job, Job.TIMEOUT)
+            except Exception as e:
+                job.error = str(e)
+                self.logger.exception(f"后台任务{job.kind}({job.id})执行失败")
+                self._set_state(job, Job.FAILED)
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list:
+        return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.is_finished():
+            return False
+        job.greenlet.kill(block=False)
+        self._set_state(job, Job.CANCELLED)
+        return True
+
+    def events(self, job_id: str):
+        """逐个产出任务的状态变化，任务结束后停止"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        queue = Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            event = job.to_dict()
+            while True:
+                yield event
+                if event["state"] in Job.FINISHED_STATES:
+                    break
+                event = queue.get()
+        finally:
+            self._subscribers[job_id].remove(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
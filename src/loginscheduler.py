@@ -0,0 +1,163 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 自动登录调度：根据客户端轮询qrcode/query的情况尽早扫码，login_delay只作为兜底上限。
+
+import time
+
+import gevent
+from gevent.event import Event
+
+import tracemgr
+from channelmgr import ScanRejected
+from envmgr import genv
+from logutil import setup_logger
+
+
+class LoginAttempt:
+    def __init__(self, qr_uuid: str, game_id: str, account_uuid: str, client_key: str = ""):
+        self.qr_uuid = qr_uuid
+        self.game_id = game_id
+        self.account_uuid = account_uuid
+        self.client_key = client_key
+        self.created_at = time.time()
+        self.polls = 0
+        self.ready_at = 0
+        self.fired_at = 0
+        self.trigger = ""
+        self.cancelled = False
+        self.polled = Event()
+        self.greenlet = None
+
+    def elapsed(self) -> float:
+        return time.time() - self.created_at
+
+
+class AutoLoginScheduler:
+    # 客户端开始轮询后至少再等这么久，避免和客户端刚发出的请求撞车
+    MIN_DELAY = 0.5
+
+    def __init__(self, game_helper, scan=None):
+        self.logger = setup_logger()
+        self.game_helper = game_helper
+        # 执行扫码的函数，参数为(账号uuid, 二维码uuid, game_id)
+        self.scan = scan
+        self._attempts = {}
+
+    def schedule(self, qr_uuid: str, game_id: str, account_uuid: str, client_key: str = "") -> LoginAttempt:
+        """为新的登录二维码安排自动扫码。同一个二维码或同一个客户端之前未完成的安排会被取消，
+        不同客户端（多个座位通过同一个代理启动同一个游戏）互不影响"""
+        for attempt in list(self._attempts.values()):
+            if attempt.qr_uuid == qr_uuid or (client_key and attempt.client_key == client_key):
+                self.cancel(attempt.qr_uuid)
+        attempt = LoginAttempt(qr_uuid, game_id, account_uuid, client_key)
+        self._attempts[qr_uuid] = attempt
+        attempt.greenlet = gevent.spawn(self._run, attempt)
+        return attempt
+
+    def cancel(self, qr_uuid: str):
+        attempt = self._attempts.pop(qr_uuid, None)
+        if attempt and not attempt.fired_at:
+            attempt.cancelled = True
+            attempt.greenlet.kill(block=False)
+
+    def on_query(self, qr_uuid: str):
+        """客户端轮询二维码状态时调用"""
+        attempt = self._attempts.get(qr_uuid)
+        if attempt is None or attempt.fired_at:
+            return
+        attempt.polls += 1
+        game = self.game_helper.get_game(attempt.game_id)
+        if attempt.polls >= game.min_polls and not attempt.ready_at:
+            attempt.ready_at = attempt.elapsed()
+        attempt.polled.set()
+
+    def _should_fire(self, attempt: LoginAttempt, game) -> str:
+        elapsed = attempt.elapsed()
+        if elapsed >= game.login_delay:
+            return "timeout"
+        if elapsed < self.MIN_DELAY:
+            return ""
+        if attempt.polls >= game.min_polls:
+            return "poll"
+        # 客户端轮询变慢时，按学习到的就绪时间放宽到只看到一次轮询
+        if game.ready_after and attempt.polls >= 1 and elapsed >= game.ready_after * 1.5 + 1:
+            return "learned"
+        return ""
+
+    def _run(self, attempt: LoginAttempt):
+        tracemgr.bind(attempt.qr_uuid)
+        game = self.game_helper.get_game(attempt.game_id)
+        while True:
+            trigger = self._should_fire(attempt, game)
+            if trigger:
+                break
+            attempt.polled.clear()
+            timeout = max(game.login_delay - attempt.elapsed(), 0)
+            if game.ready_after:
+                timeout = min(timeout, max(game.ready_after * 1.5 + 1 - attempt.elapsed(), self.MIN_DELAY))
+            if attempt.elapsed() < self.MIN_DELAY:
+                timeout = min(timeout, self.MIN_DELAY - attempt.elapsed())
+            attempt.polled.wait(timeout)
+        attempt.fired_at = attempt.elapsed()
+        attempt.trigger = trigger
+        tracemgr.record("auto_login.wait", attempt.created_at, attempt.fired_at, trigger=trigger, polls=attempt.polls)
+        self.logger.info(
+            f"{attempt.fired_at:.2f}秒后开始自动扫码（触发条件: {trigger}，客户端轮询{attempt.polls}次）"
+        )
+        success = False
+        # 失败原因：rejected表示上游拒绝扫码（二维码还没就绪），只有这种失败说明扫码太早
+        reason = ""
+        try:
+            scan = self.scan or genv.get("CHANNELS_HELPER").simulate_scan
+            success = bool(scan(attempt.account_uuid, attempt.qr_uuid, attempt.game_id, raise_rejected=True))
+            if not success:
+                reason = "failed"
+        except ScanRejected as e:
+            reason = "rejected"
+            self.logger.warning(f"自动登录失败: {e}")
+        except Exception:
+            reason = "error"
+            self.logger.exception("自动登录失败")
+        finally:
+            self._attempts.pop(attempt.qr_uuid, None)
+        record = {
+            "time": int(attempt.created_at),
+            "trigger": trigger,
+            "polls": attempt.polls,
+            "ready_at": round(attempt.ready_at, 3),
+            "fired_after": round(attempt.fired_at, 3),
+            "time_to_login": round(attempt.elapsed(), 3),
+            "success": success,
+            "reason": reason,
+        }
+        self.logger.info(f"自动登录{'成功' if success else '失败'}，耗时{record['time_to_login']}秒")
+        self.game_helper.record_login_attempt(attempt.game_id, record)
+        return success
+
+    def pending(self) -> list:
+        return [
+            {
+                "qr_uuid": attempt.qr_uuid,
+                "game_id": attempt.game_id,
+                "client": attempt.client_key,
+                "polls": attempt.polls,
+                "elapsed": round(attempt.elapsed(), 3),
+            }
+            for attempt in self._attempts.values()
+        ]
@@ -246,7 +246,6 @@ def initialize():
     genv.set("FP_WEBKEY", os.path.join(genv.get("FP_WORKDIR"), "domain_key_2.pem"))
     genv.set("FP_CACERT", os.path.join(genv.get("FP_WORKDIR"), "root_ca.pem"))
     genv.set("FP_CHANNEL_RECORD", os.path.join(genv.get("FP_WORKDIR"), "channels.json"))
-    genv.set("CHANNEL_ACCOUNT_SELECTED", "")
     genv.set("GLOB_LOGIN_PROFILE_PATH", os.path.join(genv.get("FP_WORKDIR"), "profile"))
     genv.set("GLOB_LOGIN_CACHE_PATH", os.path.join(genv.get("FP_WORKDIR"), "cache"))
     CloudPaths = ["https://gitee.com/opguess/idv-login/raw/main/assets/cloudRes.json","https://cdn.jsdelivr.net/gh/Alexander-Porter/idv-login@main/assets/cloudRes.json"]
@@ -298,6 +297,15 @@ def initialize():
     
     m_proxy = proxymgr()    # 关于线程安全：谁？
     genv.set("CHANNELS_HELPER", ChannelManager())
+    import httpclient
+    import tracemgr
+    import capturemgr
+    from upstreammgr import upstream
+    tracemgr.install()
+    capturemgr.install()
+    # 指定了CA文件时上游（包括回放服务器）用它校验证书
+    if genv.get("UPSTREAM_CA_BUNDLE", ""):
+        httpclient.client.verify = upstream.verify = genv.get("UPSTREAM_CA_BUNDLE")
 
     # frozen模式下检查_MEIPASS路径，如果包含非ASCII字符则复制PyQt5文件
     if getattr(sys, 'frozen', False):
@@ -323,6 +331,22 @@ def initialize():
         logger.error("如果程序出错，请将计算机名修改为纯英文后重试！具体请参见常见问题解决文档。")
 
 
+def start_background_services():
+    """启动会读写账号或访问网络的后台服务。命令行导入导出账号时不启动，避免和导入同时写账号文件"""
+    import httpclient
+    import capturemgr
+    from ipmgr import PublicIPProvider
+    from refreshmgr import CredentialRefresher
+    from proxymgr import game_helper
+    # 后台获取公网IP，供SAUTH使用
+    genv.set("IP_PROVIDER", PublicIPProvider().start())
+    if genv.get("CAPTURE_PATH", ""):
+        capturemgr.recorder.start(genv.get("CAPTURE_PATH"))
+        atexit.register(capturemgr.recorder.stop)
+    httpclient.client.prewarm(genv.get("CHANNELS_HELPER").prewarm_urls())
+    genv.set("CREDENTIAL_REFRESHER", CredentialRefresher(genv.get("CHANNELS_HELPER"), game_helper).start())
+
+
 def welcome():
     print(f"[+] 欢迎使用第五人格登陆助手 {genv.get('VERSION')}!")
     print(" - 官方项目地址 : https://github.com/Alexander-Porter/idv-login/")
@@ -394,9 +418,28 @@ def parse_command_line_args():
     """解析命令行参数"""
     arg_parser = argparse.ArgumentParser(description="第五人格登陆助手")
     arg_parser.add_argument('--mitm', action='store_true', help='直接使用备用模式 (mitmproxy)')
+    arg_parser.add_argument('--export-accounts', metavar='PATH', help='导出全部账号为NDJSON文件（以.gz结尾时压缩）后退出，相对路径基于工作目录')
+    arg_parser.add_argument('--import-accounts', metavar='PATH', help='从NDJSON文件（可gzip压缩）批量导入账号后退出，相对路径基于工作目录')
+    arg_parser.add_argument('--workers', type=int, default=1, metavar='N', help='使用N个进程处理代理请求（仅Linux/macOS，默认单进程）')
+    arg_parser.add_argument('--replay', metavar='HOST:PORT', help='上游改为bench/replay_server.py启动的回放服务器，通常配合--upstream-ca使用')
+    arg_parser.add_argument('--upstream-ca', metavar='PATH', help='用该CA证书校验上游（例如回放服务器生成的CA）')
+    arg_parser.add_argument('--capture', metavar='PATH', help='把上游请求和响应（脱敏后）录制到NDJSON文件（以.gz结尾时压缩），供离线回放')
     return arg_parser.parse_args()
 
 
+def handle_account_transfer(cli_args):
+    """处理命令行的账号批量导入导出"""
+    import accountio
+    channels_helper = genv.get("CHANNELS_HELPER")
+    if cli_args.import_accounts:
+        result = accountio.import_accounts(channels_helper, cli_args.import_accounts)
+        # imported包含合并进已有账号的记录
+        print(f"导入完成：新增{result['imported'] - result['merged']}条，合并重复{result['merged']}条，跳过{result['skipped']}条。")
+    if cli_args.export_accounts:
+        count = accountio.export_accounts(channels_helper, cli_args.export_accounts)
+        print(f"导出完成：共{count}个账号 -> {cli_args.export_accounts}")
+
+
 def cleanup_expired_certificates():
     """清理过期的证书文件"""
     # 检查证书是否过期
@@ -646,10 +689,21 @@ def main():
     # 解析命令行参数
     cli_args = parse_command_line_args()
     force_mitm_mode = cli_args.mitm
+    genv.set("PROXY_WORKERS", max(cli_args.workers, 1))
+    if cli_args.upstream_ca:
+        genv.set("UPSTREAM_CA_BUNDLE", os.path.abspath(cli_args.upstream_ca))
+    if cli_args.replay:
+        genv.set("REPLAY_UPSTREAM", cli_args.replay)
+    if cli_args.capture:
+        genv.set("CAPTURE_PATH", os.path.abspath(cli_args.capture))
 
     try:
         cloudBuildInfo()
         initialize() # This sets up atexit(handle_exit) among other things
+        if cli_args.export_accounts or cli_args.import_accounts:
+            handle_account_transfer(cli_args)
+            return
+        start_background_services()
         welcome()
         handle_update()
         handle_announcement()
@@ -19,13 +19,26 @@
 
 import sys
 import time
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, g
 from gevent import pywsgi
 import gevent
 from channelHandler.channelUtils import getShortGameId
 from envmgr import genv
 from logutil import setup_logger
 from gamemgr import Game, GameManager
+from loginscheduler import AutoLoginScheduler
+import qrpoller
+from qrpoller import QRStatusPoller
+from jobmgr import JobManager
+from sessionmgr import SessionTable
+import admission
+import capturemgr
+import compressutil
+from compressutil import UpstreamResponse
+import singleflight
+import tracemgr
+import upstreammgr
+from upstreammgr import UpstreamTimeout, pinned_ip, upstream
 import socket
 import requests
 import json
@@ -33,6 +46,8 @@ import os
 import psutil
 import const
 import subprocess
+import secrets
+import hmac
 import socket
 import requests
 
@@ -42,15 +57,18 @@ def is_ipv4(s):
 
 dns_cache = {}
 
-def add_custom_dns(domain, port, ip):
+def add_custom_dns(domain, port, ip, target_port=None):
+    """把domain:port解析到ip，target_port不为空时同时改写端口（例如指向本地的回放服务器）"""
     key = (domain, port)
+    target_port = target_port or port
     # Strange parameters explained at:
     # https://docs.python.org/2/library/socket.html#socket.getaddrinfo
     # Values were taken from the output of `socket.getaddrinfo(...)`
+    # socket类型写明SOCK_STREAM，Linux上类型为0的socket无法创建
     if is_ipv4(ip):
-        value = (socket.AddressFamily.AF_INET, 0, 0, '', (ip, port))
+        value = (socket.AddressFamily.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (ip, target_port))
     else: # ipv6
-        value = (socket.AddressFamily.AF_INET6, 0, 0, '', (ip, port, 0, 0))
+        value = (socket.AddressFamily.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (ip, target_port, 0, 0))
     dns_cache[key] = [value]
 
 # Inspired by: https://stackoverflow.com/a/15065711/868533
@@ -58,6 +76,14 @@ prv_getaddrinfo = socket.getaddrinfo
 def new_getaddrinfo(*args):
     # Uncomment to see what calls to `getaddrinfo` look like.
     # print(args)
+    # 对冲请求指定了上游IP时只解析到该IP，调用方限定了其他地址族时不指定
+    ip = pinned_ip()
+    if ip and args[:2] in dns_cache:
+        family = socket.AddressFamily.AF_INET if is_ipv4(ip) else socket.AddressFamily.AF_INET6
+        if len(args) < 3 or args[2] in (socket.AF_UNSPEC, family):
+            port = dns_cache[args[:2]][0][4][1]
+            address = (ip, port) if family == socket.AddressFamily.AF_INET else (ip, port, 0, 0)
+            return [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', address)]
     try:
         return dns_cache[args[:2]] # hostname and port
     except KeyError:
@@ -66,7 +92,42 @@ def new_getaddrinfo(*args):
 socket.getaddrinfo = new_getaddrinfo
 
 app = Flask(__name__)
+app.wsgi_app = admission.controller.middleware(app.wsgi_app)
 game_helper = GameManager()
+login_sessions = SessionTable()
+job_manager = JobManager()
+
+
+def _scan_for_session(account_uuid, qr_uuid, game_id, raise_rejected=False):
+    """为二维码会话模拟扫码登录，失败时清除会话选中的账号"""
+    session = login_sessions.get(qr_uuid)
+    if session is not None:
+        session.account_uuid = account_uuid
+        login_sessions.save(session)
+    result = False
+    try:
+        result = genv.get("CHANNELS_HELPER").simulate_scan(account_uuid, qr_uuid, game_id, raise_rejected)
+    finally:
+        if not result and session is not None:
+            session.account_uuid = ""
+            login_sessions.save(session)
+    return result
+
+
+login_scheduler = AutoLoginScheduler(game_helper, _scan_for_session)
+
+
+def _on_qr_status_change(qr_uuid, watch):
+    """官方扫码确认后记下登录信息，等exchange_token拿到token后导入为渠道服账号"""
+    if watch.status != qrpoller.STATUS_CONFIRMED:
+        return
+    session = login_sessions.get(qr_uuid)
+    if session is not None and session.account_uuid == "":
+        session.pending_login_info = qrpoller.parse_body(watch.result)["login_info"]
+        login_sessions.save(session)
+
+
+qr_poller = QRStatusPoller(_on_qr_status_change)
 logger=setup_logger()
 
 
@@ -123,67 +184,105 @@ g_req = requests.session()
 g_req.trust_env = False
 
 
+# 转发时不复制的上游响应头。Content-Encoding保留，响应体按上游的压缩状态原样转发
+excluded_headers = [
+    "content-length",
+    "transfer-encoding",
+    "connection",
+]
+
+
+def _upstream_url(request):
+    url = request.base_url
+    if request.host == "localhost":
+        url = url.replace("localhost", genv.get("DOMAIN_TARGET"))
+    return url
+
+
+def _upstream_fetcher(sender, request, url, query, data=None):
+    """返回(转发的请求头, fetch(ip, timeout))。fetch不依赖flask的请求上下文，可以在其他greenlet里调用"""
+    method = request.method
+    headers = {
+        name: compressutil.filter_accept_encoding(value) if name.lower() == "accept-encoding" else value
+        for name, value in request.headers.items()
+    }
+    if "Accept-Encoding" not in request.headers:
+        # 不带该头时requests会默认声明gzip，原样转发给不支持的客户端就会出错
+        headers["Accept-Encoding"] = "identity"
+    cookies = request.cookies.to_dict()
+
+    def fetch(ip, timeout):
+        start = time.time()
+        resp = (upstream.session_for(ip) if ip else sender).request(
+            method=method,
+            url=url,
+            params=query,
+            headers=headers,
+            data=data,
+            cookies=cookies,
+            allow_redirects=False,
+            timeout=(min(upstreammgr.CONNECT_TIMEOUT, timeout), timeout),
+            stream=True,
+            verify=upstream.verify,
+        )
+        app.logger.info(resp.url)
+        # 不解压，读完后把连接放回连接池
+        body = resp.raw.read(decode_content=False)
+        resp.raw.release_conn()
+        resp_headers = tuple(
+            (name, value)
+            for (name, value) in resp.raw.headers.items()
+            if name.lower() not in excluded_headers
+        )
+        if capturemgr.recorder.active:
+            capturemgr.recorder.record(
+                "proxy", method, resp.url, headers, data, resp.status_code, resp_headers, body, time.time() - start
+            )
+        return resp.status_code, resp_headers, body
+
+    return headers, fetch
+
+
+def _timeout_result():
+    body = json.dumps({"error": "上游请求超时"}, ensure_ascii=False)
+    return 504, (("Content-Type", "application/json"),), body.encode()
+
+
+def _send_upstream(sender, request, url, query, data=None):
+    """向上游发送请求，返回(状态码, 响应头, 未解压的响应体)。只读路由上相同的并发GET只发送一次，结果共享给所有等待者。
+    请求在本路由的截止时间内没有完成时返回504"""
+    # 对冲请求在其他greenlet里发送，拿不到flask的请求上下文，先取出需要的字段
+    headers, fetch = _upstream_fetcher(sender, request, url, query, data)
+    method = request.method
+    path = request.path
+    deadline = g.get("deadline") or time.time() + upstream.deadline_for(path)
+    rule = request.url_rule.rule if request.url_rule else ""
+    try:
+        if singleflight.mergeable(method, rule) and not data:
+            key = singleflight.make_key(method, url, query, headers)
+            return singleflight.group.do(
+                key, upstream.call, path, fetch, deadline, hedge=True, timeout=max(deadline - time.time(), 0)
+            )
+        return upstream.call(path, fetch, deadline)
+    except (UpstreamTimeout, gevent.Timeout):
+        return _timeout_result()
+
+
 def requestGetAsCv(request, cv):
     query = request.args.copy()
     if cv:
         query["cv"] = cv
-    url = request.base_url
-    if request.host == "localhost":
-        url = url.replace("localhost", genv.get("DOMAIN_TARGET"))
-    resp = g_req.request(
-        method=request.method,
-        url=url,
-        params=query,
-        headers=request.headers,
-        cookies=request.cookies,
-        allow_redirects=False
-    )
-    excluded_headers = [
-        "content-encoding",
-        "content-length",
-        "transfer-encoding",
-        "connection",
-    ]
-    headers = [
-        (name, value)
-        for (name, value) in resp.raw.headers.items()
-        if name.lower() not in excluded_headers
-    ]
-    return Response(resp.text, resp.status_code, headers)
+    status, headers, body = _send_upstream(g_req, request, _upstream_url(request), query)
+    return UpstreamResponse(body, status, list(headers))
 
 
 def proxy(request):
     query = request.args.copy()
     new_body = request.get_data(as_text=True)
-    url = request.base_url
-    if request.host == "localhost":
-        url = url.replace("localhost", genv.get("DOMAIN_TARGET"))
     # 向目标服务发送代理请求
-    resp = requests.request(
-        method=request.method,
-        url=url,
-        params=query,
-        headers=request.headers,
-        data=new_body,
-        cookies=request.cookies,
-        allow_redirects=False
-    )
-    app.logger.info(resp.url)
+    status, headers, body = _send_upstream(requests, request, _upstream_url(request), query, data=new_body)
     # 构造代理响应
-    excluded_headers = [
-        "content-encoding",
-        "content-length",
-        "transfer-encoding",
-        "connection",
-    ]
-    headers = [
-        (name, value)
-        for (name, value) in resp.raw.headers.items()
-        if name.lower() not in excluded_headers
-    ]
-
-    response = Response(resp.content, resp.status_code, headers)
-    return response
+    return UpstreamResponse(body, status, list(headers))
 
 
 def requestPostAsCv(request, cv):
@@ -201,30 +300,8 @@ def requestPostAsCv(request, cv):
         new_body = "&".join([f"{k}={v}" for k, v in new_body.items()])
 
     app.logger.info(new_body)
-    url = request.base_url
-    if request.host == "localhost":
-        url = url.replace("localhost", genv.get("DOMAIN_TARGET"))
-    resp = g_req.request(
-        method=request.method,
-        url=url,
-        params=query,
-        data=new_body,
-        headers=request.headers,
-        cookies=request.cookies,
-        allow_redirects=False
-    )
-    excluded_headers = [
-        "content-encoding",
-        "content-length",
-        "transfer-encoding",
-        "connection",
-    ]
-    headers = [
-        (name, value)
-        for (name, value) in resp.raw.headers.items()
-        if name.lower() not in excluded_headers
-    ]
-    return Response(resp.text, resp.status_code, headers)
+    status, headers, body = _send_upstream(g_req, request, _upstream_url(request), query, data=new_body)
+    return UpstreamResponse(body, status, list(headers))
 
 
 @app.route("/mpay/games/<game_id>/login_methods", methods=["GET"])
@@ -293,28 +370,23 @@ def handle_pc_config():
 def handle_create_login():
     try:
         resp: Response = proxy(request)
-        genv.set("CHANNEL_ACCOUNT_SELECTED", "")
         data={
             "uuid":resp.get_json()["uuid"],
             "game_id":request.args["game_id"]
         }
-        genv.set("CACHED_QRCODE_DATA",data)
-        genv.set("pending_login_info",None)
+        session = login_sessions.create(data["uuid"], data["game_id"], request.remote_addr)
+        tracemgr.bind(data["uuid"])
         #auto login start
         if genv.get(f"auto-{request.args['game_id']}", "") != "":
                 delay=game_helper.get_login_delay(request.args["game_id"])
-                logger.info(f"即将自动登录，{delay}秒后开始扫码")
+                logger.info(f"即将自动登录，客户端就绪后开始扫码，最迟{delay}秒")
                 uuid=genv.get(f"auto-{request.args['game_id']}")
-                genv.set("CHANNEL_ACCOUNT_SELECTED",uuid)
-                gevent.spawn_later(
-                    delay,
-                    genv.get("CHANNELS_HELPER").simulate_scan,
-                    uuid,
-                    data["uuid"],
-                    data["game_id"]
-                )
+                session.account_uuid = uuid
+                login_sessions.save(session)
+                genv.get("CHANNELS_HELPER").prefetch(uuid, data["game_id"])
+                login_scheduler.schedule(data["uuid"], data["game_id"], uuid, request.remote_addr)
         new_config = resp.get_json()
-        new_config["qrcode_scanners"][0]["url"] = "https://localhost/_idv-login/index?game_id="+request.args["game_id"]
+        new_config["qrcode_scanners"][0]["url"] = "https://localhost/_idv-login/index?game_id="+request.args["game_id"]+"&qr="+data["uuid"]
         return jsonify(new_config)
     except:
         return proxy(request)
@@ -334,23 +406,42 @@ def _manual_list():
 @app.route("/_idv-login/list", methods=["GET"])
 def _list_channels():
     try:
-        body=genv.get("CHANNELS_HELPER").list_channels(request.args["game_id"])
+        #带分页参数时返回分页结果，否则保持旧的列表格式
+        if any(k in request.args for k in ("limit", "cursor", "q")):
+            body=genv.get("CHANNELS_HELPER").list_channels_page(
+                request.args["game_id"],
+                request.args.get("cursor", ""),
+                int(request.args.get("limit", 50)),
+                request.args.get("q", "").strip(),
+            )
+        else:
+            body=genv.get("CHANNELS_HELPER").list_channels(request.args["game_id"])
     except Exception as e:
         body = {
             "error": str(e)
         }
     return jsonify(body)
 
-@app.route("/_idv-login/switch", methods=["GET"])
-def _switch_channel():
-    genv.set("CHANNEL_ACCOUNT_SELECTED",request.args["uuid"])
-    if genv.get("CACHED_QRCODE_DATA"):
-         data=genv.get("CACHED_QRCODE_DATA")
-         genv.get("CHANNELS_HELPER").simulate_scan(request.args["uuid"],data["uuid"],data["game_id"])
+def _do_switch(uuid, session):
+    if session:
+         tracemgr.bind(session.qr_uuid)
+         _scan_for_session(uuid,session.qr_uuid,session.game_id)
+         session = login_sessions.get(session.qr_uuid) or session
+         return {"current":session.account_uuid}
     #debug only
     else:
-        genv.get("CHANNELS_HELPER").simulate_scan(request.args["uuid"],"Kinich","aecfrt3rmaaaaajl-g-g37")
-    return {"current":genv.get("CHANNEL_ACCOUNT_SELECTED")}
+        genv.get("CHANNELS_HELPER").simulate_scan(uuid,"Kinich","aecfrt3rmaaaaajl-g-g37")
+        return {"current":uuid}
+
+@app.route("/_idv-login/switch", methods=["GET"])
+def _switch_channel():
+    # 页面带qr参数时登录到对应的二维码，否则取发起请求的客户端最近的二维码
+    session = login_sessions.resolve(request.args.get("qr", ""), request.remote_addr)
+    # async=1时放到后台任务执行，立即返回任务ID
+    if request.args.get("async") == "1":
+        job = job_manager.submit("switch", _do_switch, request.args["uuid"], session)
+        return jsonify({"job_id": job.id})
+    return _do_switch(request.args["uuid"], session)
 
 @app.route("/_idv-login/del", methods=["GET"])
 def _del_channel():
@@ -366,12 +457,98 @@ def _rename_channel():
     }
     return jsonify(resp)
 
+def _do_import(channel, game_id):
+    return {
+        "success":genv.get("CHANNELS_HELPER").manual_import(channel,game_id)
+    }
+
 @app.route("/_idv-login/import", methods=["GET"])
 def _import_channel():
-    resp={
-        "success":genv.get("CHANNELS_HELPER").manual_import(request.args["channel"],request.args["game_id"])
-    }
-    return jsonify(resp)
+    if request.args.get("async") == "1":
+        job = job_manager.submit("import", _do_import, request.args["channel"], request.args["game_id"])
+        return jsonify({"job_id": job.id})
+    return jsonify(_do_import(request.args["channel"],request.args["game_id"]))
+
+@app.route("/_idv-login/jobs", methods=["GET"])
+def _list_jobs():
+    job_id = request.args.get("id", "")
+    if job_id == "":
+        return jsonify(job_manager.list_jobs())
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"})
+    return jsonify(job.to_dict())
+
+@app.route("/_idv-login/jobs/events", methods=["GET"])
+def _job_events():
+    job_id = request.args.get("id", "")
+    if job_manager.get(job_id) is None:
+        return jsonify({"success": False, "error": "任务不存在"})
+    def generate():
+        for event in job_manager.events(job_id):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route("/_idv-login/jobs/cancel", methods=["GET"])
+def _cancel_job():
+    return jsonify({"success": job_manager.cancel(request.args.get("id", ""))})
+
+# 管理口令所在的文件名，位于工作目录
+ADMIN_TOKEN_FILE = "admin_token.txt"
+
+
+def init_admin_token():
+    """生成本次运行的管理口令并写入工作目录（仅本机用户可读）。
+    代理劫持了登录域名，任何网页都能访问/_idv-login/，导入导出账号这类敏感接口要求POST并在X-IDV-Token请求头带上口令"""
+    token = secrets.token_urlsafe(32)
+    path = os.path.join(genv.get("FP_WORKDIR"), ADMIN_TOKEN_FILE)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    genv.set("ADMIN_TOKEN", token)
+    logger.info(f"管理口令已写入{path}")
+    return token
+
+
+def _admin_denied():
+    """校验管理口令，不通过时返回403响应，通过时返回None"""
+    token = genv.get("ADMIN_TOKEN", "")
+    if token and hmac.compare_digest(request.headers.get("X-IDV-Token", ""), token):
+        return None
+    return jsonify({"success": False, "error": f"管理口令错误，请在X-IDV-Token请求头带上{ADMIN_TOKEN_FILE}中的口令"}), 403
+
+
+@app.route("/_idv-login/export-accounts", methods=["POST"])
+def _export_accounts():
+    import accountio
+    denied = _admin_denied()
+    if denied:
+        return denied
+    compress = request.args.get("gzip", "") in ("1", "true")
+    filename = "idv-login-accounts.ndjson" + (".gz" if compress else "")
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    return Response(
+        accountio.iter_ndjson_lines(genv.get("CHANNELS_HELPER").iter_records(), compress),
+        mimetype="application/gzip" if compress else "application/x-ndjson",
+        headers=headers,
+    )
+
+@app.route("/_idv-login/import-accounts", methods=["POST"])
+def _import_accounts():
+    import accountio
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        result = genv.get("CHANNELS_HELPER").import_records(accountio.iter_ndjson(request.stream))
+        result["success"] = True
+    except Exception as e:
+        logger.exception("批量导入账号失败")
+        result = {
+            "success": False,
+            "error": str(e)
+        }
+    return jsonify(result)
 
 @app.route("/_idv-login/setDefault", methods=["GET"])
 def _set_default_channel():
@@ -551,6 +728,10 @@ def _start_game():
             game.start()
             game.last_used_time = int(time.time())
             game_helper._save_games()
+            #游戏启动期间提前准备默认账号的登录数据
+            default_uuid = genv.get(f"auto-{game_id}", "")
+            if default_uuid != "":
+                genv.get("CHANNELS_HELPER").prefetch(default_uuid, game_id)
 
 
         return jsonify({
@@ -611,6 +792,113 @@ def set_login_delay():
             "error": str(e)
         })
 
+@app.route("/_idv-login/login-stats", methods=["GET"])
+def get_login_stats():
+    return jsonify({
+        "stats": game_helper.get_login_stats(request.args["game_id"]),
+        "pending": login_scheduler.pending()
+    })
+
+@app.route("/_idv-login/health", methods=["GET"])
+def _health():
+    checker = genv.get("HEALTH_CHECKER")
+    if checker is None:
+        from healthmgr import HealthChecker
+        checker = HealthChecker(genv.get("CHANNELS_HELPER"))
+        genv.set("HEALTH_CHECKER", checker)
+    force = request.args.get("force") == "1"
+    if request.args.get("stream") == "1":
+        def generate():
+            for event in checker.stream(force):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+    checker.start(force)
+    return jsonify(checker.report())
+
+@app.route("/_idv-login/refresh-status", methods=["GET"])
+def _refresh_status():
+    refresher = genv.get("CREDENTIAL_REFRESHER")
+    if refresher is None:
+        return jsonify({"success": False, "error": "后台刷新未启动"})
+    if request.args.get("run") == "1":
+        refresher.run_async()
+    return jsonify(refresher.status())
+
+@app.route("/_idv-login/sessions", methods=["GET"])
+def _list_sessions():
+    return jsonify(login_sessions.list_sessions())
+
+@app.route("/_idv-login/traces", methods=["GET"])
+def _traces():
+    trace_id = request.args.get("trace")
+    if request.args.get("format") == "chrome":
+        return jsonify(tracemgr.export_chrome(trace_id))
+    if trace_id:
+        return jsonify(tracemgr.get_spans(trace_id))
+    return jsonify(tracemgr.list_traces())
+
+@app.route("/_idv-login/http-stats", methods=["GET"])
+def _http_stats():
+    import httpclient
+    return jsonify(httpclient.client.get_stats())
+
+@app.route("/_idv-login/singleflight-stats", methods=["GET"])
+def _singleflight_stats():
+    return jsonify(singleflight.group.stats())
+
+@app.route("/_idv-login/admission-stats", methods=["GET"])
+def _admission_stats():
+    return jsonify(admission.controller.stats())
+
+@app.route("/_idv-login/upstream-stats", methods=["GET"])
+def _upstream_stats():
+    return jsonify(upstream.stats())
+
+@app.route("/_idv-login/capture", methods=["GET"])
+def _capture_status():
+    return jsonify(capturemgr.recorder.status())
+
+@app.route("/_idv-login/capture", methods=["POST"])
+def _capture():
+    # action=start 开始录制，action=stop 结束录制。需要管理口令；
+    # 归档写到启动时--capture指定的文件，没有指定时写到工作目录的captures目录下，不接受客户端传来的路径
+    denied = _admin_denied()
+    if denied:
+        return denied
+    action = request.values.get("action", "")
+    if action == "start":
+        path = genv.get("CAPTURE_PATH", "") or capturemgr.new_archive_path(os.path.join(genv.get("FP_WORKDIR"), "captures"))
+        capturemgr.recorder.start(path)
+    elif action == "stop":
+        capturemgr.recorder.stop()
+    else:
+        return jsonify({"success": False, "error": "action只能是start或stop"}), 400
+    return jsonify(capturemgr.recorder.status())
+
+@app.route("/_idv-login/qr-poller", methods=["GET"])
+def _qr_poller_status():
+    return jsonify(qr_poller.list_watches())
+
+@app.route("/_idv-login/wechat-qr/status", methods=["GET"])
+def _wechat_qr_status():
+    from channelHandler.wechatLogin import wechatChannel
+    sid = request.args.get("id", "")
+    if sid == "":
+        return jsonify(wechatChannel.list_qr_sessions())
+    session = wechatChannel.get_qr_session(sid)
+    if session is None:
+        return jsonify({"success": False, "error": "扫码会话不存在"})
+    return jsonify(session.to_dict())
+
+@app.route("/_idv-login/wechat-qr/cancel", methods=["GET"])
+def _wechat_qr_cancel():
+    from channelHandler.wechatLogin import wechatChannel
+    session = wechatChannel.get_qr_session(request.args.get("id", ""))
+    if session is None:
+        return jsonify({"success": False, "error": "扫码会话不存在"})
+    session.cancel()
+    return jsonify({"success": True})
+
 @app.route("/_idv-login/index",methods=['GET'])
 def _handle_switch_page():
     try:
@@ -623,19 +911,40 @@ def _handle_switch_page():
 
 @app.route("/mpay/api/qrcode/query", methods=["GET"])
 def handle_qrcode_query():
-    if genv.get("CHANNEL_ACCOUNT_SELECTED"):
+    qr_uuid = request.args.get("uuid", "")
+    login_scheduler.on_query(qr_uuid)
+    if not qr_uuid:
         return proxy(request)
-    else:
-        resp: Response = proxy(request)
-        qrCodeStatus = resp.get_json()["qrcode"]["status"]
-        if qrCodeStatus == 2 and genv.get("CHANNEL_ACCOUNT_SELECTED") == "":
-            genv.set("pending_login_info", resp.get_json()["login_info"])
-        return resp
+    # 由后台轮询查询上游，这里直接返回本地保存的最新状态
+    _, fetch = _upstream_fetcher(requests, request, _upstream_url(request), request.args.copy())
+    path = request.path
+
+    def poll():
+        return upstream.call(path, fetch, time.time() + upstream.deadline_for(path), hedge=True)
+
+    try:
+        result = qr_poller.query(qr_uuid, poll, request.remote_addr, g.deadline - time.time())
+    except (UpstreamTimeout, gevent.Timeout):
+        result = None
+    # 后台轮询没拿到任何结果就结束时也按超时应答
+    status, headers, body = result or _timeout_result()
+    resp = UpstreamResponse(body, status, list(headers))
+    encoding = resp.headers.get("Content-Encoding")
+    if encoding and not compressutil.accepts_encoding(request.headers.get("Accept-Encoding", ""), encoding):
+        # 最先查询的客户端支持压缩，这个客户端不支持
+        resp.get_data()
+    return resp
 
 @app.route("/mpay/api/users/login/qrcode/exchange_token", methods=['POST'])
 def handle_token_exchange():
-    if genv.get("CHANNEL_ACCOUNT_SELECTED"):
-        logger.info(f"尝试登录{genv.get('CHANNEL_ACCOUNT_SELECTED')}")
+    # 先缓存请求体，读取form之后proxy仍能拿到原始数据
+    request.get_data()
+    qr_uuid = request.form.get("uuid") or request.args.get("uuid", "")
+    session = login_sessions.resolve(qr_uuid, request.remote_addr)
+    if session:
+        tracemgr.bind(session.qr_uuid)
+    if session and session.account_uuid:
+        logger.info(f"尝试登录{session.account_uuid}")
         resp=  proxy(request)
         try:
             # 尝试读取 form 数据
@@ -654,10 +963,12 @@ def handle_token_exchange():
         logger.info(f"捕获到渠道服登录Token.")
         resp: Response = proxy(request)
         if resp.status_code == 200:
-            if genv.get("pending_login_info"):
+            if session and session.pending_login_info:
                 genv.get("CHANNELS_HELPER").import_from_scan(
-                    genv.get("pending_login_info"), resp.get_json()
+                    session.pending_login_info, resp.get_json()
                 )
+                session.pending_login_info = None
+                login_sessions.save(session)
         return resp
 
 @app.route("/mpay/api/qrcode/<path>", methods=["POST"])
@@ -694,25 +1005,47 @@ def globalProxy(path):
     else:
         return requestPostAsCv(request, "i4.7.0")
 
+@app.before_request
+def before_request_func():
+    g.request_start = time.time()
+    # 本次请求转发到上游的截止时间
+    g.deadline = g.request_start + upstream.deadline_for(request.path)
+    # 客户端请求带二维码uuid时归到对应的trace。不带uuid的请求由需要会话的处理函数自己查找后再绑定，
+    # 多进程模式下查找会话要访问状态服务，不能每个请求都查
+    tracemgr.bind(request.args.get("uuid"))
+    # 多进程模式下其他进程可能改写了账号文件和配置文件（默认账号、游戏设置）
+    if genv.get("PROXY_WORKERS", 1) > 1:
+        genv.get("CHANNELS_HELPER").reload_if_changed()
+        if genv.reload_if_changed():
+            game_helper.reload()
+
 @app.after_request
 def after_request_func(response:Response):
+    if not request.path.startswith("/_idv-login/") and "request_start" in g:
+        tracemgr.record(
+            f"proxy {request.method} {request.path}",
+            g.request_start,
+            time.time() - g.request_start,
+            status=response.status_code,
+        )
+    # 改写过的上游响应在客户端支持时重新压缩
+    if isinstance(response, UpstreamResponse):
+        response.recompress(request.headers.get("Accept-Encoding", ""))
     #只log出现错误的请求
     if response.status_code!=200 and response.status_code!=302 and response.status_code!=301 and response.status_code!=304:
         if response.status_code==404:
             if ".ico" in request.url:
                 return response
-        logger.error(f"请求 {request.url} {request.headers} {request.get_data().decode()}")
-        logger.error(f"发送 {response.status} {response.headers} {response.get_data().decode()}")
+        logger.error(f"请求 {request.url} {request.headers} {request.get_data().decode(errors='replace')}")
+        logger.error(f"发送 {response.status} {response.headers} {compressutil.preview(response)}")
     else:
         logger.debug(f"请求 {request.url} {response.status}")
     return response
 
 class proxymgr:
     def __init__(self) -> None:
-        genv.set("CHANNEL_ACCOUNT_SELECTED", "")
-        genv.set("CACHED_QRCODE_DATA",{})
-        genv.set("pending_login_info",None)
-        
+        pass
+
 
     def check_port(self):
         def is_port_in_use(port, host="127.0.0.1"):
@@ -753,47 +1086,90 @@ class proxymgr:
                         gevent.sleep(3)
                         break
 
+    def start_workers(self, count):
+        """多进程模式：fork出工作进程共同监听443端口，登录会话放到主进程的共享状态服务里"""
+        if count <= 1:
+            return None
+        import atexit
+        import workers
+        from statestore import RemoteStore, StateServer
+
+        if not workers.supported():
+            logger.warning("当前系统不支持多进程模式，将以单进程运行")
+            genv.set("PROXY_WORKERS", 1)
+            return None
+        state_server = StateServer().start()
+        pool = workers.WorkerPool(count, ("127.0.0.1", 443))
+
+        def on_child(index):
+            state_server.close()
+            refresher = genv.get("CREDENTIAL_REFRESHER", None)
+            if refresher:
+                refresher.stop()
+            login_sessions.attach(RemoteStore(state_server.address))
+
+        pool.start(on_child)
+        if pool.index == 0:
+            login_sessions.attach(state_server.store)
+            atexit.register(state_server.remove)
+            atexit.register(pool.stop)
+            logger.info(f"多进程模式: 共{pool.count}个工作进程")
+        return pool
+
     def run(self):
         from dnsmgr import DNSResolver
 
-        resolver = DNSResolver()
-        target = resolver.gethostbyname(genv.get("DOMAIN_TARGET"))
-        logger.info(target)
-        
-        # result check
-        try:
-            if (
-                target == None
-                or g_req.get(f"https://{target}", verify=False).status_code != 200
-            ):
+        replay = genv.get("REPLAY_UPSTREAM", "")
+        if replay:
+            # 离线回放：所有上游域名都指向回放服务器
+            target = capturemgr.use_replay_server(replay, [genv.get("DOMAIN_TARGET")])
+            upstream.set_targets(target, [])
+        else:
+            resolver = DNSResolver()
+            target = resolver.gethostbyname(genv.get("DOMAIN_TARGET"))
+            logger.info(target)
+
+            # result check
+            try:
+                if (
+                    target == None
+                    or g_req.get(f"https://{target}", verify=False).status_code != 200
+                ):
+                    logger.warning(
+                        "警告 : DNS解析失败，将使用硬编码的IP地址！（如果你是海外/加速器/VPN用户，出现这条消息是正常的，您不必太在意）"
+                    )
+                    target = "42.186.193.21"
+            except:
                 logger.warning(
                     "警告 : DNS解析失败，将使用硬编码的IP地址！（如果你是海外/加速器/VPN用户，出现这条消息是正常的，您不必太在意）"
                 )
                 target = "42.186.193.21"
-        except:
-            logger.warning(
-                "警告 : DNS解析失败，将使用硬编码的IP地址！（如果你是海外/加速器/VPN用户，出现这条消息是正常的，您不必太在意）"
-            )
-            target = "42.186.193.21"
+            upstream.set_targets(target, resolver.gethostbyname_all(genv.get("DOMAIN_TARGET")))
+            #劫持dns，使得Hosts文件被忽略。在fork工作进程之前完成，子进程同样生效
+            add_custom_dns(genv.get("DOMAIN_TARGET"), 443, target)
         genv.set("URI_REMOTEIP", f"https://{target}")
         self.check_port()
+        init_admin_token()
         #创建一个空日志
         import logging
         web_logger=logging.getLogger("web")
         web_logger.setLevel(logging.WARN)
+        pool = self.start_workers(genv.get("PROXY_WORKERS", 1))
         server = pywsgi.WSGIServer(
-                listener=("127.0.0.1", 443),
+                listener=pool.listener() if pool else ("127.0.0.1", 443),
                 certfile=genv.get("FP_WEBCERT"),
                 keyfile=genv.get("FP_WEBKEY"),
                 application=app,
                 log=web_logger,
+                **admission.controller.server_options(),
             )
+        if pool and pool.index != 0:
+            # 工作子进程只负责处理请求，hosts、DNS劫持和自动启动游戏都由主进程完成
+            pool.serve(server.serve_forever)
         if socket.gethostbyname(genv.get("DOMAIN_TARGET")) == "127.0.0.1" or genv.get("USING_BACKUP_VER", False):
             logger.info("拦截成功! 您现在可以打开游戏了")
             logger.warning("如果您在之前已经打开了游戏，请关闭游戏后重新打开，否则工具不会生效！")
             logger.info("登入账号且已经··进入游戏··后，您可以关闭本工具。")
-            #劫持dns，使得Hosts文件被忽略
-            add_custom_dns(genv.get("DOMAIN_TARGET"), 443, target)
             if game_helper.list_auto_start_games():
                 should_start_text="\n".join([i.name for i in game_helper.list_auto_start_games()])
                 logger.info(f"检测到有游戏设置了自动启动，游戏列表{should_start_text}")
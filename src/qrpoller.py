@@ -0,0 +1,213 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 二维码状态的后台轮询。每个正在使用的二维码由一个greenlet查询上游并保存最新结果，
+# 只有客户端来查询过才会再查一次上游（多个客户端的查询合并），两次查询至少间隔QR_POLL_INTERVAL。
+# 客户端还没拿到的新状态直接返回，否则等这次查询触发的上游结果，可选挂起到状态变化再返回（长轮询）。
+# 不开长轮询时上游查询次数不超过客户端查询次数；开启后挂起期间每个二维码每隔QR_POLL_INTERVAL查询一次上游，
+# 上游查询次数可能超过客户端查询次数。
+
+import json
+import time
+
+import gevent
+from gevent.event import Event
+
+import compressutil
+import tracemgr
+from envmgr import genv
+from logutil import setup_logger
+
+# 两次查询上游之间的最小间隔（秒），可通过genv的QR_POLL_INTERVAL覆盖
+DEFAULT_INTERVAL = 0.5
+# 客户端这么久没有来查询就停止后台轮询（秒）
+IDLE_TIMEOUT = 20
+# 查询失败时的最长重试间隔（秒）
+MAX_BACKOFF = 5
+# 二维码已确认，之后不再变化
+STATUS_CONFIRMED = 2
+
+
+class QRWatch:
+    def __init__(self, qr_uuid: str, fetch):
+        self.qr_uuid = qr_uuid
+        # 查询上游的函数，返回(状态码, 响应头, 响应体)，失败时抛出异常
+        self.fetch = fetch
+        self.result = None
+        self.status = None
+        self.version = 0
+        self.changed = Event()
+        # 有客户端在等新的上游结果
+        self.demand = Event()
+        # 每次查询上游完成后触发并换成新的Event
+        self.fetched = Event()
+        self.served = {}
+        self.upstream_polls = 0
+        self.client_polls = 0
+        self.last_client_poll = time.time()
+        self.finished = False
+        self.greenlet = None
+
+    def update(self, result) -> bool:
+        """保存查询结果，内容有变化时返回True"""
+        if self.result is not None and self.result[0] == result[0] and self.result[2] == result[2]:
+            return False
+        self.result = result
+        self.status = parse_status(result)
+        self.version += 1
+        self.changed.set()
+        self.changed = Event()
+        return True
+
+    def mark_fetched(self):
+        self.fetched.set()
+        self.fetched = Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "qr_uuid": self.qr_uuid,
+            "status": self.status,
+            "version": self.version,
+            "upstream_polls": self.upstream_polls,
+            "client_polls": self.client_polls,
+            "finished": self.finished,
+        }
+
+
+def parse_status(result):
+    status_code, headers, body = result
+    if status_code != 200:
+        return None
+    try:
+        encoding = dict((k.lower(), v) for k, v in headers).get("content-encoding", "")
+        return json.loads(compressutil.decode(body, encoding))["qrcode"]["status"]
+    except Exception:
+        return None
+
+
+def parse_body(result) -> dict:
+    status_code, headers, body = result
+    encoding = dict((k.lower(), v) for k, v in headers).get("content-encoding", "")
+    return json.loads(compressutil.decode(body, encoding))
+
+
+class QRStatusPoller:
+    def __init__(self, on_change=None):
+        self.logger = setup_logger()
+        # 状态变化时调用，参数为(二维码uuid, QRWatch)
+        self.on_change = on_change
+        self._watches = {}
+        self._interval = None
+        self._hold = None
+
+    @property
+    def interval(self) -> float:
+        if self._interval is None:
+            self._interval = float(genv.get("QR_POLL_INTERVAL", DEFAULT_INTERVAL))
+        return self._interval
+
+    @property
+    def hold(self) -> float:
+        """长轮询最长挂起时间（秒），0表示不挂起，可通过genv的QR_LONG_POLL设置。
+        挂起期间每个二维码每隔interval秒查询一次上游，不再受客户端查询次数限制"""
+        if self._hold is None:
+            self._hold = float(genv.get("QR_LONG_POLL", 0))
+        return self._hold
+
+    def _purge(self):
+        for qr_uuid, watch in list(self._watches.items()):
+            if watch.finished and time.time() - watch.last_client_poll > IDLE_TIMEOUT:
+                del self._watches[qr_uuid]
+
+    def watch(self, qr_uuid: str, fetch) -> QRWatch:
+        """取得二维码的后台轮询，没有时用fetch创建"""
+        self._purge()
+        watch = self._watches.get(qr_uuid)
+        if watch is None or (watch.finished and watch.status != STATUS_CONFIRMED):
+            watch = QRWatch(qr_uuid, fetch)
+            self._watches[qr_uuid] = watch
+            watch.greenlet = tracemgr.spawn(self._run, watch)
+        return watch
+
+    def query(self, qr_uuid: str, fetch, client_key: str, timeout: float):
+        """客户端查询二维码状态。返回(状态码, 响应头, 响应体)，timeout内没有任何结果时抛出gevent.Timeout，
+        后台轮询没拿到任何结果就结束时返回None"""
+        watch = self.watch(qr_uuid, fetch)
+        watch.client_polls += 1
+        watch.last_client_poll = time.time()
+        deadline = time.time() + timeout
+        if watch.result is not None and (watch.finished or watch.served.get(client_key) != watch.version):
+            # 有这个客户端还没拿到的状态，或者状态不会再变
+            watch.served[client_key] = watch.version
+            return watch.result
+        changed, fetched = watch.changed, watch.fetched
+        watch.demand.set()
+        if watch.result is None:
+            if not changed.wait(timeout):
+                raise gevent.Timeout(timeout)
+        else:
+            # 等这次查询触发的上游结果，和直接转发一样新
+            fetched.wait(max(deadline - time.time(), 0))
+            end = min(deadline, time.time() + self.hold)
+            while watch.served.get(client_key) == watch.version and not watch.finished and time.time() < end:
+                # 状态没有变化，挂起期间继续按最小间隔查询上游，直到状态变化或超时
+                fetched = watch.fetched
+                watch.demand.set()
+                fetched.wait(max(end - time.time(), 0))
+        watch.served[client_key] = watch.version
+        return watch.result
+
+    def _run(self, watch: QRWatch):
+        tracemgr.bind(watch.qr_uuid)
+        failures = 0
+        try:
+            while True:
+                # 等到有客户端查询才查上游，客户端长时间不来查询就结束
+                idle = IDLE_TIMEOUT - (time.time() - watch.last_client_poll)
+                if idle <= 0 or not watch.demand.wait(idle):
+                    break
+                watch.demand.clear()
+                try:
+                    result = watch.fetch()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    self.logger.warning(f"后台查询二维码{watch.qr_uuid}状态失败: {e}")
+                    # 等待的客户端还没拿到结果，退避后重试
+                    watch.demand.set()
+                    gevent.sleep(min(self.interval * 2 ** failures, MAX_BACKOFF))
+                    continue
+                watch.upstream_polls += 1
+                if watch.update(result) and self.on_change:
+                    try:
+                        self.on_change(watch.qr_uuid, watch)
+                    except Exception:
+                        self.logger.exception("处理二维码状态变化失败")
+                watch.mark_fetched()
+                if result[0] != 200 or watch.status == STATUS_CONFIRMED:
+                    break
+                gevent.sleep(self.interval)
+        finally:
+            watch.finished = True
+            # 唤醒还在挂起的客户端
+            watch.changed.set()
+            watch.fetched.set()
+
+    def list_watches(self) -> list:
+        self._purge()
+        return [i.to_dict() for i in self._watches.values()]
@@ -0,0 +1,137 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 后台定期刷新已保存账号的凭证，保证用户选中的账号登录时不需要再走渠道SDK。
+
+import random
+import time
+
+import gevent
+from gevent.pool import Pool
+
+from envmgr import genv
+from logutil import setup_logger
+
+
+class CredentialRefresher:
+    def __init__(
+        self,
+        channels_helper,
+        game_helper=None,
+        interval: int = 600,
+        within: int = 900,
+        concurrency: int = 4,
+        jitter: float = 30,
+        initial_delay: float = 20,
+    ):
+        self.logger = setup_logger()
+        self.channels_helper = channels_helper
+        self.game_helper = game_helper
+        self.interval = interval
+        self.within = within
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.initial_delay = initial_delay
+        self.results = {}
+        self.last_run = 0
+        self._running = None
+        self._daemon = None
+
+    def _preferred_uuids(self) -> set:
+        """各游戏设置的默认账号，需要一直保持可用"""
+        if self.game_helper is None:
+            return set()
+        uuids = set()
+        for game_id in list(self.game_helper.games.keys()):
+            uuid = genv.get(f"auto-{game_id}", "")
+            if uuid:
+                uuids.add(uuid)
+        return uuids
+
+    def candidates(self) -> list:
+        """令牌将要过期的账号，以及本地缓存已失效的默认账号"""
+        preferred = self._preferred_uuids()
+        targets = []
+        for i in list(self.channels_helper.channels):
+            i.drop_expired_credentials()
+            if i.needs_refresh(self.within) or (i.uuid in preferred and not i.credential_cache):
+                targets.append(i)
+        return targets
+
+    def _refresh_one(self, channel):
+        gevent.sleep(random.uniform(0, self.jitter))
+        try:
+            ok = bool(channel.refresh_credentials())
+        except Exception:
+            self.logger.exception(f"后台刷新{channel.name}的凭证失败")
+            ok = False
+        self.results[channel.uuid] = {"name": channel.name, "ok": ok, "time": int(time.time())}
+        if not ok:
+            self.logger.warning(f"账号{channel.name}的凭证无法自动刷新，下次登录时需要重新授权")
+        return ok
+
+    def run_once(self) -> dict:
+        targets = self.candidates()
+        if targets:
+            self.logger.info(f"开始后台刷新{len(targets)}个账号的凭证")
+            pool = Pool(self.concurrency)
+            for channel in targets:
+                pool.spawn(self._refresh_one, channel)
+            pool.join()
+            # 所有账号刷新完后统一保存一次
+            self.channels_helper.save_records()
+        self.last_run = int(time.time())
+        return self.status()
+
+    def run_async(self):
+        if self._running is None or self._running.ready():
+            self._running = gevent.spawn(self.run_once)
+        return self._running
+
+    def needs_relogin(self) -> list:
+        return [
+            {"uuid": uuid, "name": result["name"], "time": result["time"]}
+            for uuid, result in self.results.items()
+            if not result["ok"] and self.channels_helper.query_channel(uuid) is not None
+        ]
+
+    def status(self) -> dict:
+        return {
+            "last_run": self.last_run,
+            "needs_relogin": self.needs_relogin(),
+            "expiring": self.channels_helper.expiring_soon(self.within),
+        }
+
+    def start(self):
+        if self._daemon is None:
+            self._daemon = gevent.spawn(self._loop)
+        return self
+
+    def stop(self):
+        if self._daemon is not None:
+            self._daemon.kill(block=False)
+            self._daemon = None
+
+    def _loop(self):
+        gevent.sleep(self.initial_delay)
+        while True:
+            try:
+                self.run_async().join()
+            except Exception:
+                self.logger.exception("后台刷新凭证失败")
+            gevent.sleep(self.interval + random.uniform(0, self.jitter))
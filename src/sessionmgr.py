@@ -0,0 +1,129 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 登录会话表。每个登录二维码一条记录，多个客户端同时登录时互不影响。
+# 多进程模式下会话同时写入共享状态服务，客户端的请求落到任意工作进程都能找到同一个会话。
+
+import time
+
+from logutil import setup_logger
+
+
+class LoginSession:
+    def __init__(self, qr_uuid: str, game_id: str, client_key: str):
+        self.qr_uuid = qr_uuid
+        self.game_id = game_id
+        self.client_key = client_key
+        # 选中的渠道服账号，为空表示走官方扫码流程
+        self.account_uuid = ""
+        # 官方扫码确认后的登录信息，等exchange_token拿到token后导入为渠道服账号
+        self.pending_login_info = None
+        self.created_at = time.time()
+        self.touched_at = self.created_at
+
+    def to_dict(self) -> dict:
+        return {
+            "qr_uuid": self.qr_uuid,
+            "game_id": self.game_id,
+            "client_key": self.client_key,
+            "account_uuid": self.account_uuid,
+            "pending": self.pending_login_info is not None,
+            "created_at": int(self.created_at),
+        }
+
+    def to_state(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_state(cls, data: dict):
+        session = cls(data["qr_uuid"], data["game_id"], data["client_key"])
+        session.__dict__.update(data)
+        return session
+
+
+class SessionTable:
+    STORE_NS = "sessions"
+
+    def __init__(self, ttl: int = 600):
+        self.logger = setup_logger()
+        self.ttl = ttl
+        self._sessions = {}
+        # 共享状态服务，为空时只在本进程内保存
+        self.store = None
+
+    def attach(self, store):
+        """接入共享状态服务，之后的读写都以共享状态为准"""
+        self.store = store
+        for session in self._sessions.values():
+            self.save(session)
+        self._sessions.clear()
+
+    def save(self, session: LoginSession):
+        """修改会话字段后调用，把改动同步到共享状态"""
+        session.touched_at = time.time()
+        if self.store is not None:
+            self.store.set(self.STORE_NS, session.qr_uuid, session.to_state(), self.ttl)
+
+    def _all(self) -> list:
+        if self.store is not None:
+            return [LoginSession.from_state(i) for i in self.store.items(self.STORE_NS).values()]
+        self._purge()
+        return list(self._sessions.values())
+
+    def _purge(self):
+        deadline = time.time() - self.ttl
+        for qr_uuid, session in list(self._sessions.items()):
+            if session.touched_at < deadline:
+                del self._sessions[qr_uuid]
+
+    def create(self, qr_uuid: str, game_id: str, client_key: str) -> LoginSession:
+        self._purge()
+        session = LoginSession(qr_uuid, game_id, client_key)
+        if self.store is None:
+            self._sessions[qr_uuid] = session
+        self.save(session)
+        return session
+
+    def get(self, qr_uuid: str):
+        if self.store is not None:
+            data = self.store.get(self.STORE_NS, qr_uuid)
+            return LoginSession.from_state(data) if data else None
+        session = self._sessions.get(qr_uuid)
+        if session is None:
+            return None
+        if session.touched_at < time.time() - self.ttl:
+            del self._sessions[qr_uuid]
+            return None
+        session.touched_at = time.time()
+        return session
+
+    def latest(self, client_key: str = None):
+        """该客户端最近创建的会话，client_key为空时取全局最近的会话"""
+        candidates = [i for i in self._all() if client_key is None or i.client_key == client_key]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda x: x.created_at)
+
+    def resolve(self, qr_uuid: str = "", client_key: str = None):
+        """按二维码uuid查找会话，请求里没有uuid时取该客户端最近的会话"""
+        if qr_uuid:
+            return self.get(qr_uuid)
+        return self.latest(client_key)
+
+    def list_sessions(self) -> list:
+        return [i.to_dict() for i in self._all()]
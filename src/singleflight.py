@@ -0,0 +1,113 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 合并同时进行的相同上游请求。游戏启动时多个客户端（或同一客户端重试）会同时请求login_methods、pc_config等，
+# 第一个请求真正发往上游，其余相同请求等待它的结果。结果必须是不可变的，由各调用方自行构造响应。
+
+from urllib.parse import urlencode
+
+from gevent.event import AsyncResult
+
+# 参与合并键的请求头，其余请求头不影响上游返回的内容
+KEY_HEADERS = ("cookie", "accept-encoding", "authorization")
+# 只合并幂等请求
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+# 只合并这些只读路由（flask路由规则）。create_login等会在上游创建会话的GET不能合并，
+# 否则同时请求的多个客户端会拿到同一个二维码
+MERGEABLE_ROUTES = (
+    "/mpay/games/<game_id>/login_methods",
+    "/mpay/games/pc_config",
+    "/mpay/api/qrcode/query",
+    "/<path:path>",
+)
+# 分路径统计最多记录的路径数，超出的归到同一项
+MAX_TRACKED_PATHS = 500
+
+
+def mergeable(method: str, rule: str) -> bool:
+    """请求是否可以和其他相同请求合并，rule为请求匹配到的flask路由规则"""
+    return method.upper() in IDEMPOTENT_METHODS and rule in MERGEABLE_ROUTES
+
+
+def make_key(method: str, url: str, query, headers) -> tuple:
+    """按方法、URL、排序后的查询参数和相关请求头生成合并键"""
+    if hasattr(query, "items") and hasattr(query, "getlist"):
+        pairs = [(k, v) for k in query.keys() for v in query.getlist(k)]
+    else:
+        pairs = list(dict(query or {}).items())
+    lowered = {k.lower(): v for k, v in dict(headers or {}).items()}
+    return (
+        method.upper(),
+        url,
+        urlencode(sorted(pairs)),
+        tuple(lowered.get(i, "") for i in KEY_HEADERS),
+    )
+
+
+class Group:
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+        self.errors = 0
+        self.by_path = {}
+
+    def do(self, key: tuple, func, *args, timeout=None, **kwargs):
+        """执行func，同一key已有请求在进行时等待并复用它的结果（包括异常）。timeout为等待别人结果的最长时间"""
+        path = key[1] if key[1] in self.by_path or len(self.by_path) < MAX_TRACKED_PATHS else "(其他)"
+        path_stats = self.by_path.setdefault(path, {"leaders": 0, "shared": 0})
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            path_stats["shared"] += 1
+            return call.get(timeout=timeout)
+        call = AsyncResult()
+        self._calls[key] = call
+        self.leaders += 1
+        path_stats["leaders"] += 1
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.errors += 1
+            call.set_exception(e)
+            raise
+        else:
+            call.set(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+    def inflight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.shared
+        return {
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "errors": self.errors,
+            "inflight": self.inflight(),
+            "hit_rate": round(self.shared / total, 4) if total else 0,
+            "by_path": {
+                path: dict(item, hit_rate=round(item["shared"] / (item["leaders"] + item["shared"]), 4))
+                for path, item in sorted(self.by_path.items(), key=lambda x: -(x[1]["leaders"] + x[1]["shared"]))[:50]
+            },
+        }
+
+
+group = Group()
@@ -0,0 +1,185 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 多进程模式下的共享状态服务。主进程持有数据并在Unix socket上提供按行JSON的读写接口，工作进程通过RemoteStore访问。
+# socket文件权限为0600，放在0700的临时目录里，本机其他用户无法读写登录会话。多进程模式依赖fork，只在Linux/macOS上使用。
+# 没有用multiprocessing.Manager：它的连接直接对fd调用os.read，和gevent打过补丁的非阻塞socket不兼容。
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+from gevent import socket as gsocket
+from gevent.queue import LifoQueue, Empty
+from gevent.server import StreamServer
+
+from logutil import setup_logger
+
+
+class LocalStore:
+    """按命名空间存放可JSON序列化的值，单进程模式或主进程内直接使用"""
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, ns: str, key: str, default=None):
+        item = self._data.get(ns, {}).get(key)
+        if item is None:
+            return default
+        value, expire_at = item
+        if expire_at and expire_at < time.time():
+            del self._data[ns][key]
+            return default
+        return value
+
+    def set(self, ns: str, key: str, value, ttl: float = 0):
+        self._data.setdefault(ns, {})[key] = (value, time.time() + ttl if ttl else 0)
+
+    def delete(self, ns: str, key: str):
+        self._data.get(ns, {}).pop(key, None)
+
+    def items(self, ns: str) -> dict:
+        now = time.time()
+        bucket = self._data.get(ns, {})
+        for key, (_, expire_at) in list(bucket.items()):
+            if expire_at and expire_at < now:
+                del bucket[key]
+        return {key: value for key, (value, _) in bucket.items()}
+
+    def execute(self, op: str, ns: str, key: str = "", value=None, ttl: float = 0):
+        if op == "get":
+            return self.get(ns, key)
+        if op == "set":
+            return self.set(ns, key, value, ttl)
+        if op == "delete":
+            return self.delete(ns, key)
+        if op == "items":
+            return self.items(ns)
+        raise ValueError(f"未知的操作: {op}")
+
+
+class StateServer:
+    def __init__(self, store: LocalStore = None):
+        self.logger = setup_logger()
+        self.store = store or LocalStore()
+        self._dir = tempfile.mkdtemp(prefix="idv-login-state-")
+        self.path = os.path.join(self._dir, "state.sock")
+        listener = gsocket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 先收紧umask再bind，socket文件创建出来就是0600
+        umask = os.umask(0o177)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        listener.listen(128)
+        self.server = StreamServer(listener, self._handle)
+
+    @property
+    def address(self) -> str:
+        return self.path
+
+    def start(self):
+        self.server.start()
+        self.logger.info(f"共享状态服务已启动: {self.path}")
+        return self
+
+    def close(self):
+        """关闭监听。工作进程fork后调用，只关闭自己复制的那份socket"""
+        self.server.close()
+
+    def remove(self):
+        """主进程退出时关闭服务并删除socket文件"""
+        self.server.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _handle(self, sock, address):
+        reader = sock.makefile("rb")
+        try:
+            for line in reader:
+                try:
+                    req = json.loads(line)
+                    resp = {"ok": True, "value": self.store.execute(**req)}
+                except Exception as e:
+                    resp = {"ok": False, "error": str(e)}
+                sock.sendall(json.dumps(resp).encode() + b"\n")
+        except OSError:
+            pass
+        finally:
+            reader.close()
+            sock.close()
+
+
+class RemoteStore:
+    """和LocalStore接口相同，通过共享状态服务读写。连接按需建立并复用"""
+
+    def __init__(self, address: str, timeout: float = 5, pool_size: int = 8):
+        self.address = address
+        self.timeout = timeout
+        self._pool = LifoQueue(pool_size)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile("rb")
+
+    def _call(self, op: str, ns: str, key: str = "", value=None, ttl: float = 0):
+        try:
+            conn = self._pool.get_nowait()
+        except Empty:
+            conn = self._connect()
+        sock, reader = conn
+        try:
+            sock.sendall(json.dumps({"op": op, "ns": ns, "key": key, "value": value, "ttl": ttl}).encode() + b"\n")
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("共享状态服务已断开")
+        except Exception:
+            reader.close()
+            sock.close()
+            raise
+        if not self._pool.full():
+            self._pool.put(conn)
+        else:
+            reader.close()
+            sock.close()
+        resp = json.loads(line)
+        if not resp["ok"]:
+            raise RuntimeError(resp["error"])
+        return resp["value"]
+
+    def get(self, ns: str, key: str, default=None):
+        value = self._call("get", ns, key)
+        return default if value is None else value
+
+    def set(self, ns: str, key: str, value, ttl: float = 0):
+        self._call("set", ns, key, value, ttl)
+
+    def delete(self, ns: str, key: str):
+        self._call("delete", ns, key)
+
+    def items(self, ns: str) -> dict:
+        return self._call("items", ns)
@@ -0,0 +1,136 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 登录流程耗时追踪。以二维码uuid作为trace id，各阶段和上游请求记录为span，保存在内存环形缓冲区中。
+
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import gevent
+from gevent.local import local
+
+MAX_SPANS = 2000
+
+_spans = deque(maxlen=MAX_SPANS)
+_context = local()
+
+
+def bind(trace_id):
+    """把当前greenlet之后记录的span归到trace_id下"""
+    _context.trace_id = trace_id
+
+
+def current_trace():
+    return getattr(_context, "trace_id", None)
+
+
+def record(name: str, start: float, elapsed: float, trace_id=None, **attrs):
+    _spans.append(
+        {
+            "name": name,
+            "trace_id": trace_id or current_trace() or "",
+            "start": start,
+            "duration": elapsed,
+            "greenlet": id(gevent.getcurrent()),
+            "attrs": attrs,
+        }
+    )
+
+
+@contextmanager
+def span(name: str, trace_id=None, **attrs):
+    start = time.time()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        record(name, start, time.time() - start, trace_id, **attrs)
+
+
+def spawn(func, *args, **kwargs):
+    """和gevent.spawn相同，但新greenlet沿用当前的trace id"""
+    trace_id = current_trace()
+
+    def run():
+        bind(trace_id)
+        return func(*args, **kwargs)
+
+    return gevent.spawn(run)
+
+
+def get_spans(trace_id=None) -> list:
+    return [i for i in list(_spans) if trace_id is None or i["trace_id"] == trace_id]
+
+
+def list_traces() -> list:
+    traces = {}
+    for i in list(_spans):
+        item = traces.setdefault(i["trace_id"], {"trace_id": i["trace_id"], "start": i["start"], "end": 0, "spans": 0})
+        item["start"] = min(item["start"], i["start"])
+        item["end"] = max(item["end"], i["start"] + i["duration"])
+        item["spans"] += 1
+    return sorted(traces.values(), key=lambda x: x["start"], reverse=True)
+
+
+def export_chrome(trace_id=None) -> dict:
+    """导出为Chrome trace格式，可在chrome://tracing或Perfetto中打开。每个trace单独一行"""
+    rows = {}
+    events = []
+    for i in get_spans(trace_id):
+        tid = rows.setdefault(i["trace_id"], len(rows) + 1)
+        events.append(
+            {
+                "name": i["name"],
+                "cat": "login",
+                "ph": "X",
+                "ts": int(i["start"] * 1e6),
+                "dur": int(i["duration"] * 1e6),
+                "pid": 1,
+                "tid": tid,
+                "args": dict(i["attrs"], trace_id=i["trace_id"]),
+            }
+        )
+    for trace, tid in rows.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": trace or "(无trace)"}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def clear():
+    _spans.clear()
+
+
+def _on_http(method, url, elapsed, ok):
+    parsed = urlparse(url)
+    record(f"{method} {parsed.netloc}{parsed.path}", time.time() - elapsed, elapsed, ok=ok)
+
+
+def _on_sauth(game_id, stage, elapsed):
+    record(f"uni_sauth.{stage}", time.time() - elapsed, elapsed, game_id=game_id)
+
+
+def install():
+    """接入渠道SDK请求和uni_sauth的耗时回调"""
+    import httpclient
+    from channelHandler import channelUtils
+
+    httpclient.client.hooks.append(_on_http)
+    channelUtils.add_timing_hook(_on_sauth)
@@ -0,0 +1,219 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 上游请求的截止时间和对冲请求。每个路由有自己的截止时间，转发时作为上游请求的超时；
+# 幂等GET在超过该路由p95耗时仍未返回时，向下一个上游IP再发一份，取先返回的结果。
+
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import gevent
+import requests
+from gevent.local import local
+
+import tracemgr
+from envmgr import genv
+from logutil import setup_logger
+
+# 按路径前缀匹配的截止时间（秒），先匹配的优先，可通过genv的UPSTREAM_DEADLINES覆盖（同样的[前缀, 秒数]列表）
+DEFAULT_DEADLINES = [
+    ["/mpay/api/qrcode/query", 5],
+    ["/mpay/api/qrcode/", 10],
+    ["/mpay/api/users/login/", 15],
+    ["/mpay/", 15],
+    ["", 30],
+]
+# 允许对冲的只读路由，整段匹配，*匹配路径中的一段。带用户凭证的请求（如devices/.../users）不能对冲，
+# 否则会从另一个IP重复发送。可通过genv的UPSTREAM_HEDGE_PATHS覆盖，设为空列表即关闭对冲
+DEFAULT_HEDGE_PATHS = ["/mpay/api/qrcode/query", "/mpay/games/pc_config", "/mpay/games/*/login_methods"]
+# 样本不足时的对冲延迟，以及对冲延迟的上下限（秒）
+DEFAULT_HEDGE_DELAY = 1.0
+MIN_HEDGE_DELAY = 0.2
+MAX_HEDGE_DELAY = 3.0
+MIN_SAMPLES = 20
+CONNECT_TIMEOUT = 3
+
+_pinned = local()
+
+
+class UpstreamTimeout(Exception):
+    pass
+
+
+def _match_route(pattern: str, path: str) -> bool:
+    """pattern中的*匹配路径中的一段，其余各段必须相同"""
+    expected = pattern.split("/")
+    actual = path.split("/")
+    return len(expected) == len(actual) and all(i == "*" or i == j for i, j in zip(expected, actual))
+
+
+def pinned_ip():
+    """当前greenlet被指定连接的上游IP，供DNS劫持使用"""
+    return getattr(_pinned, "ip", None)
+
+
+@contextmanager
+def pin(ip):
+    previous = pinned_ip()
+    _pinned.ip = ip
+    try:
+        yield
+    finally:
+        _pinned.ip = previous
+
+
+class UpstreamManager:
+    def __init__(self):
+        self.logger = setup_logger()
+        self.primary = ""
+        self.ips = []
+        self._ip_latency = {}
+        self._samples = {}
+        self._sessions = {}
+        self._deadlines = None
+        self._hedge_paths = None
+        # 上游证书校验，回放测试时设为回放服务器的CA文件（genv的UPSTREAM_CA_BUNDLE）
+        self.verify = True
+        self.counters = {
+            "requests": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    def set_targets(self, primary: str, ips: list):
+        self.primary = primary
+        self.ips = [primary] + [i for i in ips if i != primary]
+        if len(self.ips) > 1:
+            self.logger.info(f"上游备用IP: {self.ips[1:]}")
+
+    def deadline_for(self, path: str) -> float:
+        if self._deadlines is None:
+            self._deadlines = genv.get("UPSTREAM_DEADLINES", DEFAULT_DEADLINES)
+        for prefix, seconds in self._deadlines:
+            if path.startswith(prefix):
+                return float(seconds)
+        return float(DEFAULT_DEADLINES[-1][1])
+
+    def hedge_route(self, path: str):
+        """路径匹配的对冲路由，耗时样本按路由统计"""
+        if self._hedge_paths is None:
+            self._hedge_paths = genv.get("UPSTREAM_HEDGE_PATHS", DEFAULT_HEDGE_PATHS)
+        for route in self._hedge_paths:
+            if _match_route(route, path):
+                return route
+        return None
+
+    def should_hedge(self, path: str) -> bool:
+        return len(self.ips) > 1 and self.hedge_route(path) is not None
+
+    def hedge_delay(self, path: str) -> float:
+        samples = sorted(self._samples.get(self.hedge_route(path), ()))
+        if len(samples) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        p95 = samples[int(len(samples) * 0.95)]
+        return min(max(p95, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+    def alternate_ip(self):
+        """主IP之外延迟最低的IP，没有测过的按DNS返回的顺序"""
+        others = [i for i in self.ips if i != self.primary]
+        if not others:
+            return None
+        return min(others, key=lambda ip: (ip not in self._ip_latency, self._ip_latency.get(ip, 0), others.index(ip)))
+
+    def session_for(self, ip: str) -> requests.Session:
+        """固定连接到某个IP的会话。连接池里的连接都是在pin(ip)下建立的，不会和默认会话混用"""
+        if ip not in self._sessions:
+            session = requests.session()
+            session.trust_env = False
+            self._sessions[ip] = session
+        return self._sessions[ip]
+
+    def _observe(self, path: str, ip: str, elapsed: float):
+        route = self.hedge_route(path)
+        if route is not None:
+            self._samples.setdefault(route, deque(maxlen=200)).append(elapsed)
+        previous = self._ip_latency.get(ip)
+        self._ip_latency[ip] = elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+
+    def call(self, path: str, fetch, deadline: float, hedge: bool = False):
+        """在截止时间内执行fetch(ip, timeout)，ip为None表示走默认会话。超时抛出UpstreamTimeout"""
+        self.counters["requests"] += 1
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            self.counters["timeouts"] += 1
+            raise UpstreamTimeout()
+        try:
+            with gevent.Timeout(remaining, UpstreamTimeout):
+                if hedge and self.should_hedge(path):
+                    return self._hedged(path, fetch, deadline)
+                start = time.time()
+                result = fetch(None, remaining)
+                self._observe(path, self.primary, time.time() - start)
+                return result
+        except (UpstreamTimeout, requests.exceptions.Timeout):
+            self.counters["timeouts"] += 1
+            self.logger.warning(f"上游请求超时: {path}")
+            raise UpstreamTimeout()
+
+    def _attempt(self, path: str, fetch, ip, deadline: float):
+        start = time.time()
+        if ip is None:
+            result = fetch(None, deadline - time.time())
+        else:
+            with pin(ip):
+                result = fetch(ip, deadline - time.time())
+        self._observe(path, ip or self.primary, time.time() - start)
+        return result
+
+    def _hedged(self, path: str, fetch, deadline: float):
+        primary = tracemgr.spawn(self._attempt, path, fetch, None, deadline)
+        backup = None
+        try:
+            primary.join(self.hedge_delay(path))
+            if primary.ready():
+                return primary.get()
+            ip = self.alternate_ip()
+            self.counters["hedges"] += 1
+            backup = tracemgr.spawn(self._attempt, path, fetch, ip, deadline)
+            pending = [primary, backup]
+            while pending:
+                done = gevent.wait(pending, count=1)[0]
+                pending.remove(done)
+                if done.successful():
+                    if done is backup:
+                        self.counters["hedge_wins"] += 1
+                        self.logger.debug(f"对冲请求先返回: {path} -> {ip}")
+                    return done.value
+            return primary.get()
+        finally:
+            primary.kill(block=False)
+            if backup is not None:
+                backup.kill(block=False)
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            ips=self.ips,
+            ip_latency_ms={ip: round(v * 1000, 1) for ip, v in self._ip_latency.items()},
+            hedge_delay_ms={route: round(self.hedge_delay(route) * 1000, 1) for route in self._samples},
+        )
+
+
+upstream = UpstreamManager()
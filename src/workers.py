@@ -0,0 +1,125 @@
+# coding=UTF-8
+"""
+ Copyright (c) 2025 Alexander-Porter & fwilliamhe
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# 多进程监听同一端口。Linux上每个进程用SO_REUSEPORT各自绑定，由内核分配连接；
+# 其他支持fork的系统先绑定再fork，多个进程在同一个监听socket上accept。
+# 多进程模式只支持Linux/macOS：Windows没有fork，--workers会退回单进程运行。
+# 进程间共享的只有登录会话（statestore）、账号文件和配置文件（收到请求时发现文件变化就重新读取）。
+# 自动登录调度、二维码后台轮询、任务队列和各种统计都在各个工作进程内，客户端的请求落到不同进程时，
+# 自动登录看不到其他进程收到的轮询，会退回按登录延迟扫码。
+
+import os
+import signal
+import socket
+import sys
+
+import gevent
+
+from logutil import setup_logger
+
+
+def supported() -> bool:
+    return hasattr(os, "fork")
+
+
+def reuse_port_supported() -> bool:
+    return sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+
+
+def bind_listener(address, reuse_port: bool = False, backlog: int = 1024) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class WorkerPool:
+    """当前进程作为0号工作进程，另外fork出count-1个子进程，各自在address上提供服务"""
+
+    def __init__(self, count: int, address, reuse_port: bool = None):
+        self.logger = setup_logger()
+        self.count = max(int(count), 1)
+        self.address = address
+        self.reuse_port = reuse_port_supported() if reuse_port is None else reuse_port
+        self.index = 0
+        self.pids = []
+        self._listener = None
+
+    def start(self, on_child=None) -> int:
+        """fork子进程，返回当前进程的序号（主进程为0）。on_child在子进程中以序号为参数调用"""
+        if not self.reuse_port:
+            self._listener = bind_listener(self.address)
+        parent = os.getpid()
+        for index in range(1, self.count):
+            pid = os.fork()
+            if pid == 0:
+                self.index = index
+                self.pids = []
+                gevent.spawn(self._watch_parent, parent)
+                # 子进程由主进程负责结束，不执行主进程的退出清理
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                if on_child:
+                    on_child(index)
+                return index
+            self.pids.append(pid)
+        if self.pids:
+            self.logger.info(f"已启动{len(self.pids)}个工作子进程: {self.pids}（{'SO_REUSEPORT' if self.reuse_port else 'pre-fork'}）")
+        return 0
+
+    def _watch_parent(self, parent: int):
+        """主进程没来得及结束子进程就退出时（例如被强制结束），子进程跟着退出"""
+        while os.getppid() == parent:
+            gevent.sleep(2)
+        os._exit(0)
+
+    def listener(self) -> socket.socket:
+        """当前进程用于accept的socket"""
+        if self._listener is None:
+            self._listener = bind_listener(self.address, reuse_port=True)
+        return self._listener
+
+    def stop(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.pids = []
+
+    def serve(self, serve_func):
+        """在当前进程运行serve_func。子进程结束时直接退出，不返回调用方"""
+        if self.index == 0:
+            return serve_func()
+        code = 0
+        try:
+            serve_func()
+        except BaseException:
+            self.logger.exception(f"工作进程{self.index}异常退出")
+            code = 1
+        finally:
+            os._exit(code)
@@ -139,4 +139,5 @@ def getNeteaseGameInfo(apkPath):
     print(json.dumps(RES))
     if app_channel in ["xiaomi_app","huawei","myapp"]:
         updateCloudRes(RES)
-getNeteaseGameInfo("app.apk")
\ No newline at end of file
+if __name__ == "__main__":
+    getNeteaseGameInfo("app.apk")
\ No newline at end of file